@@ -1,22 +1,99 @@
 import asyncio
+import csv
+import io
 import logging
-from typing import Dict
+import re
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from tiktok_api import TikTokAPI
-from data_processor import DataProcessor
+from data_processor import DataProcessor, EXPORTERS
 from config import Config
+from profiling import StageProfile
+from report_pool import ReportPool
+from snapshot_store import SnapshotStore
+from checkpoints import AnalysisCheckpoint
+from raw_data import FollowerRawData
+from resilience import UpstreamError
+from state_backend import StateBackend
 
 logger = logging.getLogger(__name__)
 
+# Допустимый никнейм TikTok
+USERNAME_PATTERN = re.compile(r'^[A-Za-z0-9_.]{2,24}$')
+# Заголовки колонок в загруженных CSV, которые не являются никнеймами
+SEED_LIST_HEADERS = {'username', 'user', 'account', 'nickname', 'tiktok', 'url', 'link'}
+
 
 class TikTokAnalyzer:
-    def __init__(self):
-        self.api = TikTokAPI()
-        self.processor = DataProcessor()
+    def __init__(self, api: TikTokAPI = None, max_concurrency: int = None,
+                 snapshots: SnapshotStore = None, state: StateBackend = None,
+                 chat_id: int = None, reports: ReportPool = None):
+        # API (пул соединений, лимитер, кэш) может быть общим для всех сессий
+        self.api = api or TikTokAPI()
+        # Снимки прошлых анализов: повторный запуск проверяет только новых
+        # и изменившихся фолловеров и строит отчет изменений
+        self.snapshots = snapshots
+        self.max_concurrency = max_concurrency or Config.MAX_CONCURRENT_REQUESTS
+        # Пул процессов для сборки отчетов (общий для всех сессий бота);
+        # без него отчеты собираются в текущем процессе
+        self.reports = reports or ReportPool(workers=0)
         self.search_settings = {
             'max_followers': Config.DEFAULT_MAX_FOLLOWERS,
             'min_views': Config.DEFAULT_MIN_VIEWS,
             'min_videos': Config.DEFAULT_MIN_VIDEOS
         }
+        self.report_format = Config.DEFAULT_REPORT_FORMAT
+        # Настройки чата и данные последнего анализа в бэкенде состояния
+        # видны всем процессам бота (без бэкенда - только этому объекту)
+        self.state = state
+        self.chat_id = chat_id
+        self._last_run: Optional[FollowerRawData] = None
+        self.load_state()
+    
+    def load_state(self):
+        """Загружает настройки чата из бэкенда (их мог изменить другой процесс)"""
+        if self.state is None:
+            return
+        stored = self.state.get('chat_settings', self.chat_id)
+        if stored:
+            self.search_settings.update(stored['search_settings'])
+            self.report_format = stored['report_format']
+    
+    def _save_settings(self):
+        if self.state is not None:
+            self.state.set('chat_settings', self.chat_id, {
+                'search_settings': self.search_settings,
+                'report_format': self.report_format
+            })
+    
+    @property
+    def last_run(self) -> Optional[FollowerRawData]:
+        """Сырые данные фолловеров последнего успешного анализа (см. refilter)"""
+        if self.state is None:
+            return self._last_run
+        stored = self.state.get('last_run', self.chat_id)
+        return FollowerRawData.from_state(stored) if stored else None
+    
+    @last_run.setter
+    def last_run(self, raw: FollowerRawData):
+        if self.state is None:
+            self._last_run = raw
+        else:
+            self.state.set('last_run', self.chat_id, raw.to_state())
+    
+    def has_last_run(self) -> bool:
+        """Есть ли данные для refilter (без загрузки самих данных)"""
+        if self.state is None:
+            return self._last_run is not None
+        return self.state.exists('last_run', self.chat_id)
+    
+    def set_report_format(self, report_format: str):
+        """Меняет формат отчета (xlsx, csv, jsonl, parquet)"""
+        if report_format not in EXPORTERS:
+            raise ValueError(f"Неизвестный формат отчета: {report_format}")
+        self.report_format = report_format
+        self._save_settings()
+        logger.info(f"Формат отчета обновлен: {report_format}")
     
     def update_settings(self, max_followers: int = None,
                         min_views: int = None,
@@ -28,6 +105,7 @@ class TikTokAnalyzer:
             self.search_settings['min_views'] = min_views
         if min_videos is not None:
             self.search_settings['min_videos'] = min_videos
+        self._save_settings()
         
         logger.info(f"Настройки обновлены: {self.search_settings}")
     
@@ -40,19 +118,73 @@ class TikTokAnalyzer:
 • Минимум просмотров видео: {self.search_settings['min_views']:,}
 • Минимум подходящих видео: {self.search_settings['min_videos']}
 
-Для изменения используйте команду /settings
+• Формат отчета: {self.report_format}
+
+Для изменения используйте команды /settings и /format
         """.strip()
     
-    async def analyze_account(self, url_or_username: str,
-                              progress_callback=None) -> Dict:
-        """Анализирует один аккаунт и его фолловеров"""
-        # Очищаем предыдущие результаты
-        self.processor.clear_results()
-        
-        # Извлекаем username из URL
+    def normalize_username(self, url_or_username: str) -> str:
+        """Никнейм из ссылки на профиль или строки вида @username"""
         username = self.api.extract_username_from_url(url_or_username)
         if not username:
             username = url_or_username.replace('@', '')
+        return username.strip()
+    
+    def parse_seed_list(self, text: str) -> List[str]:
+        """Разбирает список аккаунтов из текста или CSV.
+        
+        Никнеймы и ссылки могут разделяться переводами строк, пробелами,
+        запятыми или точкой с запятой; в CSV берутся все ячейки, похожие
+        на никнейм, кроме типичных заголовков колонок. Дубликаты убираются
+        без учета регистра с сохранением порядка.
+        """
+        seeds: List[str] = []
+        seen = set()
+        for row in csv.reader(io.StringIO(text.replace(';', ','))):
+            for cell in row:
+                for token in cell.split():
+                    username = self.normalize_username(token)
+                    if (not USERNAME_PATTERN.match(username)
+                            or username.lower() in SEED_LIST_HEADERS):
+                        continue
+                    if username.lower() not in seen:
+                        seen.add(username.lower())
+                        seeds.append(username)
+        return seeds
+    
+    async def _resolve_seed(self, username: str,
+                            profile: StageProfile) -> Tuple[Optional[str], Optional[str]]:
+        """Находит secUid исходного аккаунта: (secUid, None) или (None, ошибка)"""
+        try:
+            with profile.measure('seed_lookup'):
+                user_info = await self.api.get_user_info(username)
+        except UpstreamError as e:
+            return None, f'API недоступен, не удалось получить аккаунт {username}: {e}'
+        if not user_info:
+            return None, f'Не удалось получить информацию об аккаунте {username}'
+        
+        sec_uid = user_info.get('user', {}).get('secUid') or user_info.get('secUid')
+        if not sec_uid:
+            return None, f'Не удалось получить secUid для аккаунта {username}'
+        return sec_uid, None
+    
+    async def analyze_account(self, url_or_username: str,
+                              progress_callback=None,
+                              checkpoint: AnalysisCheckpoint = None) -> Dict:
+        """Анализирует один аккаунт и его фолловеров.
+        
+        С контрольной точкой прогресс периодически сохраняется, а прерванный
+        анализ продолжается со страницы, на которой остановился, с теми же
+        настройками и форматом отчета.
+        """
+        # У каждого запуска свои результаты и снимок настроек, поэтому
+        # параллельные анализы не мешают друг другу
+        processor = DataProcessor()
+        settings, report_format = self._run_settings(checkpoint)
+        profile = StageProfile()
+        
+        # Извлекаем username из URL
+        username = self.normalize_username(url_or_username)
         
         logger.info(f"Начинаем анализ аккаунта: {username}")
         
@@ -60,112 +192,587 @@ class TikTokAnalyzer:
         if progress_callback:
             await progress_callback("📋 Получаем информацию об аккаунте...")
         
-        user_info = self.api.get_user_info(username)
-        if not user_info:
+        sec_uid, error = await self._resolve_seed(username, profile)
+        if error:
+            return {'success': False, 'error': error}
+        
+        # Получаем фолловеров постранично и анализируем их по мере загрузки
+        if progress_callback:
+            await progress_callback("👥 Получаем список фолловеров...")
+        
+        listed_before = checkpoint.listed_before if checkpoint else 0
+        restored_results = checkpoint.restored_results() if checkpoint else []
+        followers = profile.measure_stream(
+            'follower_paging',
+            self.api.iter_user_followers(
+                sec_uid, max(Config.MAX_FOLLOWERS_TOTAL - listed_before, 1),
+                start_cursor=checkpoint.cursor if checkpoint else 0,
+                on_page=checkpoint.on_page if checkpoint else None
+            )
+        )
+        # Счетчики этапов: сколько фолловеров отсеяно без дорогих запросов
+        stages = self._new_stages()
+        raw = FollowerRawData([username])
+        if checkpoint is not None:
+            # Фолловеры страниц до курсора заново не загружаются
+            for follower_username, list_followers, list_videos in checkpoint.followers_before:
+                raw.add(follower_username, list_followers, list_videos)
+                self._restore_raw(follower_username, raw)
+        def add_result(evaluation: Tuple):
+            follower_info, email, high_view_videos = evaluation
+            with profile.measure('report_write'):
+                processor.add_micro_influencer(
+                    follower_info, email, high_view_videos
+                )
+        
+        # Инфлюенсеры, найденные до прерывания
+        for evaluation in restored_results:
+            add_result(evaluation)
+        
+        analyzed_count, evaluations = await self._evaluate_followers(
+            followers, settings, stages, progress_callback, add_result, profile,
+            checkpoint, raw
+        )
+        analyzed_count += listed_before
+        
+        if not analyzed_count:
             return {
                 'success': False,
-                'error': f'Не удалось получить информацию об аккаунте {username}'
+                'error': f'Не удалось получить фолловеров для {username}'
             }
         
-        sec_uid = user_info.get('user', {}).get('secUid') or user_info.get('secUid')
-        if not sec_uid:
+        logger.info(f"Проанализировано {analyzed_count} фолловеров")
+        micro_influencers_found = (
+            len(restored_results) + sum(1 for e in evaluations if e)
+        )
+        
+        # Завершаем отчет (он собирается в памяти, без временных файлов)
+        if progress_callback:
+            await progress_callback("📊 Создаем файл с результатами...")
+        
+        with profile.measure('report_write'):
+            # По убыванию фолловеров, как и отчет пакетного анализа
+            report = await self.reports.export(processor, report_format)
+            changes = self._update_snapshots(
+                processor, {username: analyzed_count}, settings, stages
+            )
+            diff_report = await self.reports.export_diff(
+                processor, changes, report_format
+            )
+        profile.finish()
+        self.last_run = raw
+        
+        return {
+            'success': True,
+            'total_followers_analyzed': analyzed_count,
+            'micro_influencers_found': micro_influencers_found,
+            'stage_stats': stages,
+            'api_calls_saved': (
+                2 * stages['rejected_by_list'] + stages['rejected_by_info']
+                + 2 * (stages['reused'] + stages['resumed'])
+            ),
+            'report': report,
+            'changes': changes,
+            'diff_report': diff_report,
+            'summary': processor.get_results_summary(),
+            'profile': profile,
+            'stage_timings': profile.summary()
+        }
+    
+    async def analyze_accounts(self, seeds: List[str],
+                               progress_callback=None,
+                               checkpoint: AnalysisCheckpoint = None) -> Dict:
+        """Пакетный анализ нескольких аккаунтов.
+        
+        Фолловеры всех исходных аккаунтов собираются в одну очередь без
+        повторов: общий фолловер проверяется один раз, а в отчете у него
+        перечислены все исходные аккаунты, где он встретился. Поэтому число
+        запросов растет с числом уникальных фолловеров, а не с их суммой.
+        При возобновлении по контрольной точке списки фолловеров обходятся
+        заново, но уже проверенные фолловеры повторно не проверяются.
+        """
+        processor = DataProcessor(with_seeds=True)
+        settings, report_format = self._run_settings(checkpoint)
+        profile = StageProfile()
+        
+        usernames = []
+        seen = set()
+        for seed in seeds:
+            username = self.normalize_username(seed)
+            if username and username.lower() not in seen:
+                seen.add(username.lower())
+                usernames.append(username)
+        if not usernames:
+            return {'success': False, 'error': 'Список аккаунтов пуст'}
+        if len(usernames) > Config.BATCH_MAX_SEEDS:
             return {
                 'success': False,
                 'error': (
-                    f'Не удалось получить secUid для аккаунта {username}'
+                    f'Слишком много аккаунтов: {len(usernames)} '
+                    f'(максимум {Config.BATCH_MAX_SEEDS})'
                 )
             }
         
-        # Получаем список фолловеров
+        logger.info(f"Начинаем пакетный анализ {len(usernames)} аккаунтов")
         if progress_callback:
-            await progress_callback("👥 Получаем список фолловеров...")
+            await progress_callback(
+                f"📋 Получаем информацию об аккаунтах ({len(usernames)})..."
+            )
         
-        followers = self.api.get_user_followers(
-            sec_uid,
-            Config.MAX_FOLLOWERS_PER_SEARCH
+        resolved = await asyncio.gather(*[
+            self._resolve_seed(username, profile) for username in usernames
+        ])
+        valid_seeds = []
+        failed_seeds = []
+        for username, (sec_uid, error) in zip(usernames, resolved):
+            if error:
+                logger.warning(error)
+                failed_seeds.append(username)
+            else:
+                valid_seeds.append((username, sec_uid))
+        if not valid_seeds:
+            return {
+                'success': False,
+                'error': 'Не удалось получить информацию ни об одном аккаунте'
+            }
+        
+        # Исходные аккаунты каждого фолловера (ключ - никнейм в нижнем регистре)
+        follower_seeds: Dict[str, List[str]] = {}
+        counters = {'listed': 0, 'duplicates': 0, 'current_seed': 0,
+                    'per_seed': {seed: 0 for seed, _ in valid_seeds}}
+        stages = self._new_stages()
+        followers = self._merged_followers(
+            valid_seeds, follower_seeds, counters, stages, profile
+        )
+        raw = FollowerRawData([seed for seed, _ in valid_seeds], batch=True)
+        raw.follower_seeds = follower_seeds
+        
+        async def batch_progress(text: str):
+            await progress_callback(
+                f"🌱 Исходные аккаунты: {counters['current_seed']}/{len(valid_seeds)}, "
+                f"повторов пропущено: {counters['duplicates']}\n{text}"
+            )
+        
+        def add_result(evaluation: Tuple):
+            follower_info, email, high_view_videos = evaluation
+            with profile.measure('report_write'):
+                processor.add_micro_influencer(
+                    follower_info, email, high_view_videos
+                )
+        
+        analyzed_count, evaluations = await self._evaluate_followers(
+            followers, settings, stages,
+            batch_progress if progress_callback else None,
+            add_result, profile, checkpoint, raw
         )
         
-        if not followers:
+        if not analyzed_count:
             return {
                 'success': False,
-                'error': f'Не удалось получить фолловеров для {username}'
+                'error': 'Не удалось получить фолловеров ни одного аккаунта'
+            }
+        
+        # Источники известны полностью только после обхода всех аккаунтов
+        for record in processor.records:
+            for seed in follower_seeds.get(record.username.lower(), []):
+                processor.add_seed(record.username, seed)
+        
+        logger.info(
+            f"Пакетный анализ: {analyzed_count} уникальных фолловеров "
+            f"из {counters['listed']}"
+        )
+        if progress_callback:
+            await progress_callback("📊 Создаем файл с результатами...")
+        
+        with profile.measure('report_write'):
+            report = await self.reports.export(processor, report_format)
+            changes = self._update_snapshots(
+                processor, counters['per_seed'], settings, stages
+            )
+            diff_report = await self.reports.export_diff(
+                processor, changes, report_format
+            )
+        profile.finish()
+        self.last_run = raw
+        
+        return {
+            'success': True,
+            'seeds_total': len(usernames),
+            'seeds_failed': failed_seeds,
+            'total_followers_listed': counters['listed'],
+            'duplicates_skipped': counters['duplicates'],
+            'total_followers_analyzed': analyzed_count,
+            'micro_influencers_found': sum(1 for e in evaluations if e),
+            'stage_stats': stages,
+            'api_calls_saved': (
+                2 * stages['rejected_by_list'] + stages['rejected_by_info']
+                + 2 * (stages['reused'] + stages['resumed'])
+            ),
+            'report': report,
+            'changes': changes,
+            'diff_report': diff_report,
+            'summary': processor.get_results_summary(),
+            'profile': profile,
+            'stage_timings': profile.summary()
+        }
+    
+    async def refilter(self) -> Dict:
+        """Применяет текущие настройки к данным последнего анализа.
+        
+        Запросов к API не делает: критерии проверяются по сохраненным
+        профилям и просмотрам видео, отчет строится заново. Фолловеры,
+        которым при новых настройках нужны не загруженные ранее данные
+        (например, отсеянные по списку при меньшем максимуме фолловеров),
+        не проверяются и возвращаются в 'missing_data'.
+        """
+        raw = self.last_run
+        if raw is None:
+            return {
+                'success': False,
+                'error': 'Нет данных прошлого анализа, сначала запустите /analyze'
             }
         
-        logger.info(f"Найдено {len(followers)} фолловеров для анализа")
+        started = time.perf_counter()
+        settings = dict(self.search_settings)
+        evaluations, missing = raw.evaluate(self.api, settings)
         
-        # Анализируем каждого фолловера
-        total_followers = len(followers)
-        analyzed_count = 0
+        processor = DataProcessor(with_seeds=raw.batch)
+        for follower_info, email, high_view_videos in evaluations:
+            processor.add_micro_influencer(follower_info, email, high_view_videos)
+        for record in processor.records:
+            for seed in raw.follower_seeds.get(record.username.lower(), []):
+                processor.add_seed(record.username, seed)
+        report = await self.reports.export(processor, self.report_format)
+        
+        return {
+            'success': True,
+            'seeds': raw.seeds,
+            'total_followers_analyzed': len(raw),
+            'micro_influencers_found': len(evaluations),
+            'missing_data': missing,
+            'report': report,
+            'summary': processor.get_results_summary(),
+            'elapsed': time.perf_counter() - started
+        }
+    
+    def _run_settings(self, checkpoint: Optional[AnalysisCheckpoint]) -> Tuple[Dict, str]:
+        """Снимок настроек и формат отчета для запуска анализа"""
+        if checkpoint is not None:
+            return dict(checkpoint.settings), checkpoint.report_format
+        return dict(self.search_settings), self.report_format
+    
+    @staticmethod
+    def _new_stages() -> Dict[str, int]:
+        return {
+            'rejected_by_list': 0,
+            'rejected_by_info': 0,
+            'fully_checked': 0,
+            'reused': 0,
+            'resumed': 0,
+            # Пропущено из-за недоступности API (после всех повторов)
+            'upstream_failed': 0,
+            'pages_failed': 0
+        }
+    
+    def _update_snapshots(self, processor: DataProcessor,
+                          seed_followers: Dict[str, int],
+                          settings: Dict,
+                          stages: Dict[str, int]) -> Optional[List[Dict]]:
+        """Сохраняет снимки исходных аккаунтов и возвращает изменения
+        относительно прошлых снимков (None, если прошлых снимков нет)"""
+        if self.snapshots is None:
+            return None
+        self.snapshots.flush()
+        if stages['upstream_failed'] or stages['pages_failed']:
+            # Неполный снимок заменил бы полный: пропущенные из-за сбоев
+            # инфлюенсеры выглядели бы выбывшими, а потом снова новыми
+            logger.warning(
+                "[Snapshots] Анализ неполный из-за сбоев API: "
+                "снимок не сохранен, сравнение не выполнено"
+            )
+            return None
+        
+        current_by_seed: Dict[str, Dict[str, Dict]] = {
+            seed: {} for seed in seed_followers
+        }
+        for record in processor.records:
+            # При анализе одного аккаунта источники у записей не ведутся
+            for seed in record.seeds or list(seed_followers):
+                if seed in current_by_seed:
+                    current_by_seed[seed][record.username] = record.snapshot()
+        
+        settings_key = SnapshotStore.settings_key(settings)
+        previous, snapshots = self.snapshots.previous_influencers(
+            list(current_by_seed), settings_key
+        )
+        changes = None
+        if snapshots:
+            # Сравниваем только аккаунты, у которых есть прошлый снимок
+            # с теми же настройками
+            current = {}
+            for seed in snapshots:
+                current.update(current_by_seed[seed])
+            changes = self.snapshots.diff(previous, current)
+        
+        for seed, followers_count in seed_followers.items():
+            self.snapshots.save_seed_snapshot(
+                seed, settings_key, followers_count, current_by_seed[seed]
+            )
+        return changes
+    
+    async def _merged_followers(self, seeds: List[Tuple[str, str]],
+                                follower_seeds: Dict[str, List[str]],
+                                counters: Dict[str, int],
+                                stages: Dict[str, int],
+                                profile: StageProfile) -> AsyncIterator[Dict]:
+        """Фолловеры всех исходных аккаунтов подряд, каждый - один раз.
+        
+        Повторные вхождения только дописывают исходный аккаунт
+        в follower_seeds. Если список фолловеров аккаунта перестал
+        загружаться из-за сбоя API, обход переходит к следующему аккаунту.
+        """
+        for number, (seed, sec_uid) in enumerate(seeds, 1):
+            counters['current_seed'] = number
+            followers = profile.measure_stream(
+                'follower_paging',
+                self.api.iter_user_followers(sec_uid, Config.MAX_FOLLOWERS_TOTAL)
+            )
+            try:
+                async for follower in followers:
+                    follower_username = follower.get('user', {}).get('uniqueId')
+                    if not follower_username:
+                        continue
+                    counters['listed'] += 1
+                    counters['per_seed'][seed] += 1
+                    key = follower_username.lower()
+                    sources = follower_seeds.get(key)
+                    if sources is not None:
+                        counters['duplicates'] += 1
+                        if seed not in sources:
+                            sources.append(seed)
+                        continue
+                    follower_seeds[key] = [seed]
+                    yield follower
+            except UpstreamError as e:
+                stages['pages_failed'] += 1
+                logger.warning(f"Список фолловеров @{seed} загружен не полностью: {e}")
+    
+    async def _evaluate_followers(self, followers: AsyncIterator[Dict],
+                                  settings: Dict, stages: Dict[str, int],
+                                  progress_callback=None,
+                                  on_result=None,
+                                  profile: StageProfile = None,
+                                  checkpoint: AnalysisCheckpoint = None,
+                                  raw: FollowerRawData = None) -> Tuple[int, List]:
+        """Проверяет поток фолловеров пулом из max_concurrency обработчиков.
+        
+        on_result вызывается для каждого найденного микро-инфлюенсера
+        в порядке поступления фолловеров, как только проверены все
+        предыдущие. Возвращает число проверенных фолловеров и результаты
+        проверки в том же порядке.
+        """
+        queue = asyncio.Queue(maxsize=self.max_concurrency * 2)
+        usernames: List[str] = []
+        evaluations: Dict[int, Optional[Tuple]] = {}
+        stream_done = False
         micro_influencers_found = 0
+        next_to_emit = 0
         
-        for i, follower in enumerate(followers):
-            follower_username = follower.get('user', {}).get('uniqueId')
-            if not follower_username:
-                continue
-            
-            analyzed_count += 1
-            
-            if progress_callback:
-                progress_text = (
-                    f"🔍 Анализируем фолловера {analyzed_count}/{total_followers}\n"
-                    f"👤 @{follower_username}\n"
-                    f"✅ Найдено микро-инфлюенсеров: {micro_influencers_found}"
+        async def produce():
+            nonlocal stream_done
+            try:
+                async for follower in followers:
+                    follower_username = follower.get('user', {}).get('uniqueId')
+                    if not follower_username:
+                        continue
+                    usernames.append(follower_username)
+                    await queue.put((len(usernames) - 1, follower))
+            except UpstreamError as e:
+                # Проверяем уже полученных фолловеров, отчет будет неполным
+                stages['pages_failed'] += 1
+                logger.warning(f"Список фолловеров загружен не полностью: {e}")
+            stream_done = True
+            for _ in range(self.max_concurrency):
+                await queue.put(None)
+        
+        async def work():
+            nonlocal micro_influencers_found, next_to_emit
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                index, follower = item
+                evaluation = await self._evaluate_follower(
+                    follower, settings, stages, profile, checkpoint, raw
                 )
-                await progress_callback(progress_text)
-            
-            # Получаем подробную информацию о фолловере
-            follower_info = self.api.get_user_info(follower_username)
-            if not follower_info:
-                continue
-            
-            # Получаем видео фолловера
-            follower_videos = self.api.get_user_videos(follower_username, 20)
-            
+                evaluations[index] = evaluation
+                if evaluation:
+                    micro_influencers_found += 1
+                
+                while next_to_emit in evaluations:
+                    if on_result and evaluations[next_to_emit]:
+                        on_result(evaluations[next_to_emit])
+                    next_to_emit += 1
+                if checkpoint is not None:
+                    checkpoint.mark_emitted(next_to_emit)
+                
+                if progress_callback:
+                    total = f"{len(usernames)}" if stream_done else f"{len(usernames)}+"
+                    progress_text = (
+                        f"🔍 Проанализировано фолловеров: "
+                        f"{len(evaluations)}/{total}\n"
+                        f"👤 @{usernames[index]}\n"
+                        f"✅ Найдено микро-инфлюенсеров: {micro_influencers_found}"
+                    )
+                    await progress_callback(progress_text)
+        
+        tasks = [asyncio.ensure_future(produce())] + [
+            asyncio.ensure_future(work()) for _ in range(self.max_concurrency)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        return len(evaluations), [evaluations[i] for i in range(len(evaluations))]
+    
+    @staticmethod
+    def _skip_upstream(username: str, stages: Dict[str, int],
+                       error: UpstreamError) -> None:
+        """Фолловер не проверен из-за сбоя API (результат не запоминается,
+        поэтому повторный анализ проверит его снова)"""
+        stages['upstream_failed'] += 1
+        logger.warning(f"Фолловер @{username} пропущен: {error}")
+        return None
+    
+    def _restore_raw(self, username: str, raw: Optional[FollowerRawData]):
+        """Дописывает в raw профиль и просмотры видео из прошлой проверки
+        фолловера (без них повторная фильтрация его не проверит)"""
+        if raw is None or self.snapshots is None:
+            return
+        stored_info, stored_counts = self.snapshots.get_raw(username)
+        if stored_info is not None:
+            raw.set_info(username, stored_info)
+        if stored_counts is not None:
+            raw.set_play_counts(username, stored_counts)
+    
+    async def _evaluate_follower(self, follower: Dict, settings: Dict,
+                                 stages: Dict[str, int],
+                                 profile: StageProfile = None,
+                                 checkpoint: AnalysisCheckpoint = None,
+                                 raw: FollowerRawData = None) -> Optional[Tuple]:
+        """Проверяет одного фолловера по этапам, от дешевых к дорогим.
+        
+        Возвращает (информация, email, видео с высокими просмотрами)
+        для микро-инфлюенсера или None. Загруженные данные фолловера
+        сохраняются в raw для повторной фильтрации.
+        """
+        follower_username = follower['user']['uniqueId']
+        profile = profile or StageProfile()
+        list_followers, list_videos = self.api.extract_user_stats(follower)
+        if raw is not None:
+            raw.add(follower_username, list_followers, list_videos)
+        
+        # Этап 1: данные из списка фолловеров, без запросов к API
+        with profile.measure('criteria'):
+            passed = self.api.check_cheap_criteria(
+                follower, settings['max_followers'], settings['min_videos']
+            )
+        if not passed:
+            stages['rejected_by_list'] += 1
+            return None
+        
+        # Фолловер уже проверен до прерывания анализа
+        if checkpoint is not None and checkpoint.is_done(follower_username):
+            stages['resumed'] += 1
+            self._restore_raw(follower_username, raw)
+            return checkpoint.restore(follower_username)
+        
+        # Свежий результат прошлого анализа (если данные из списка
+        # заметно не изменились) заменяет этапы с запросами к API
+        if self.snapshots is not None:
+            settings_key = SnapshotStore.settings_key(settings)
+            found, stored = self.snapshots.get_evaluation(
+                follower_username, settings_key, list_followers, list_videos
+            )
+            if found:
+                stages['reused'] += 1
+                self._restore_raw(follower_username, raw)
+                if checkpoint is not None:
+                    checkpoint.record(follower_username, stored)
+                return stored
+        
+        follower_info = None
+        play_counts = None
+        
+        def remember(evaluation: Optional[Tuple]) -> Optional[Tuple]:
+            if checkpoint is not None:
+                checkpoint.record(follower_username, evaluation)
+            if self.snapshots is not None:
+                self.snapshots.save_evaluation(
+                    follower_username, settings_key,
+                    list_followers, list_videos, evaluation
+                )
+                self.snapshots.save_raw(
+                    follower_username, follower_info, play_counts
+                )
+            return evaluation
+        
+        # Этап 2: подробная информация о фолловере
+        try:
+            with profile.measure('info_fetch'):
+                follower_info = await self.api.get_user_info(follower_username)
+        except UpstreamError as e:
+            return self._skip_upstream(follower_username, stages, e)
+        if not follower_info:
+            return None
+        if raw is not None:
+            raw.set_info(follower_username, follower_info)
+        if not self.api.check_cheap_criteria(
+            follower_info, settings['max_followers'], settings['min_videos']
+        ):
+            stages['rejected_by_info'] += 1
+            return remember(None)
+        
+        # Этап 3: видео фолловера
+        stages['fully_checked'] += 1
+        try:
+            with profile.measure('video_fetch'):
+                follower_videos = await self.api.get_user_videos(
+                    follower_username, 20
+                )
+        except UpstreamError as e:
+            return self._skip_upstream(follower_username, stages, e)
+        play_counts = [video.get('playCount', 0) for video in follower_videos]
+        if raw is not None:
+            raw.set_play_counts(follower_username, play_counts)
+        
+        with profile.measure('criteria'):
             # Проверяем критерии микро-инфлюенсера
             is_micro_influencer = self.api.check_micro_influencer_criteria(
                 follower_info,
                 follower_videos,
-                self.search_settings['max_followers'],
-                self.search_settings['min_views'],
-                self.search_settings['min_videos']
+                settings['max_followers'],
+                settings['min_views'],
+                settings['min_videos']
             )
+            if not is_micro_influencer:
+                return remember(None)
             
-            if is_micro_influencer:
-                # Извлекаем email из био
-                bio = follower_info.get('signature', '')
-                email = self.api.extract_email_from_bio(bio)
-                
-                # Подсчитываем видео с высокими просмотрами
-                high_view_videos = sum(
-                    1 for video in follower_videos
-                    if video.get('playCount', 0) >= self.search_settings['min_views']
-                )
-                
-                # Добавляем в результаты
-                self.processor.add_micro_influencer(follower_info, email)
-                self.processor.update_video_stats(follower_username, high_view_videos)
-                
-                micro_influencers_found += 1
-                
-                logger.info(
-                    f"Найден микро-инфлюенсер: @{follower_username} "
-                    f"({follower_info.get('followerCount', 0)} фолловеров, "
-                    f"{high_view_videos} видео с высокими просмотрами)"
-                )
+            # Извлекаем email из био
+            bio = follower_info.get('signature', '')
+            email = self.api.extract_email_from_bio(bio)
             
-            # Небольшая задержка между запросами
-            await asyncio.sleep(0.5)
-        
-        # Создаем Excel файл
-        if progress_callback:
-            await progress_callback("📊 Создаем Excel файл с результатами...")
-        
-        excel_file = self.processor.create_excel_file()
+            # Подсчитываем видео с высокими просмотрами
+            high_view_videos = sum(
+                1 for video in follower_videos
+                if video.get('playCount', 0) >= settings['min_views']
+            )
         
-        return {
-            'success': True,
-            'total_followers_analyzed': analyzed_count,
-            'micro_influencers_found': micro_influencers_found,
-            'excel_file': excel_file,
-            'summary': self.processor.get_results_summary()
-        } 
\ No newline at end of file
+        logger.info(
+            f"Найден микро-инфлюенсер: @{follower_username} "
+            f"({follower_info.get('followerCount', 0)} фолловеров, "
+            f"{high_view_videos} видео с высокими просмотрами)"
+        )
+        return remember((follower_info, email, high_view_videos))
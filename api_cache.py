@@ -0,0 +1,124 @@
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+from config import Config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ApiCache:
+    """Персистентный кэш ответов TikTok API на SQLite.
+
+    Для каждого endpoint свой TTL, размер ограничен (LRU по времени
+    последнего обращения), ведутся счетчики попаданий и промахов.
+    """
+
+    def __init__(self, path: str = None, ttls: Dict[str, float] = None,
+                 max_entries: int = None):
+        self.path = path or Config.CACHE_PATH
+        self.ttls = ttls or {
+            'user_info': Config.CACHE_USER_INFO_TTL,
+            'user_videos': Config.CACHE_USER_VIDEOS_TTL
+        }
+        self.max_entries = max_entries or Config.CACHE_MAX_ENTRIES
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+        self._conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS api_cache ('
+            'key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, value TEXT NOT NULL, '
+            'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS api_cache_accessed '
+            'ON api_cache (accessed_at)'
+        )
+        self._size = self._conn.execute(
+            'SELECT COUNT(*) FROM api_cache'
+        ).fetchone()[0]
+
+    @staticmethod
+    def make_key(endpoint: str, params: Dict) -> str:
+        normalized = {
+            k: str(v).lower() if isinstance(v, str) else v
+            for k, v in params.items()
+        }
+        return f"{endpoint}:{json.dumps(normalized, sort_keys=True)}"
+
+    def get(self, endpoint: str, params: Dict) -> Optional[Any]:
+        """Возвращает значение из кэша или None, если его нет или оно устарело"""
+        key = self.make_key(endpoint, params)
+        row = self._conn.execute(
+            'SELECT value, created_at FROM api_cache WHERE key = ?', (key,)
+        ).fetchone()
+
+        now = time.time()
+        if row is None or now - row[1] > self.ttls.get(endpoint, 0):
+            self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+            metrics.inc('api_cache_requests_total', endpoint=endpoint, result='miss')
+            return None
+
+        self._conn.execute(
+            'UPDATE api_cache SET accessed_at = ? WHERE key = ?', (now, key)
+        )
+        self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+        metrics.inc('api_cache_requests_total', endpoint=endpoint, result='hit')
+        return json.loads(row[0])
+
+    def set(self, endpoint: str, params: Dict, value: Any):
+        """Сохраняет значение и при переполнении вытесняет давние записи"""
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        cursor = self._conn.execute(
+            'INSERT OR IGNORE INTO api_cache '
+            '(key, endpoint, value, created_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (key, endpoint, json.dumps(value, ensure_ascii=False), now, now)
+        )
+        if cursor.rowcount:
+            self._size += 1
+        else:
+            self._conn.execute(
+                'UPDATE api_cache SET value = ?, created_at = ?, accessed_at = ? '
+                'WHERE key = ?',
+                (json.dumps(value, ensure_ascii=False), now, now, key)
+            )
+
+        if self._size > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        # Удаляем с запасом (10%), чтобы не чистить кэш на каждой записи
+        target = int(self.max_entries * 0.9)
+        self._conn.execute(
+            'DELETE FROM api_cache WHERE key IN ('
+            'SELECT key FROM api_cache ORDER BY accessed_at LIMIT ?)',
+            (self._size - target,)
+        )
+        self._size = self._conn.execute(
+            'SELECT COUNT(*) FROM api_cache'
+        ).fetchone()[0]
+        logger.info(f"[ApiCache] Вытеснены старые записи, осталось {self._size}")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Счетчики попаданий/промахов и доля попаданий по endpoint"""
+        result = {}
+        for endpoint in set(self.hits) | set(self.misses):
+            hits = self.hits.get(endpoint, 0)
+            misses = self.misses.get(endpoint, 0)
+            result[endpoint] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': hits / (hits + misses) if hits + misses else 0.0
+            }
+        return result
+
+    def close(self):
+        self._conn.close()
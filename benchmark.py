@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Офлайн-бенчмарк анализа фолловеров.
+
+Поднимает локальный мок RapidAPI (/api/user/info, /api/user/followers,
+/user/videos) с настраиваемой задержкой, долей ошибок и лимитом запросов
+и прогоняет TikTokAnalyzer.analyze_account целиком, не расходуя квоту.
+Для каждого значения --concurrency выводит пропускную способность,
+задержки запросов и число запросов к API на найденного инфлюенсера.
+
+Пример:
+    python benchmark.py --followers 500 --concurrency 5 10 20 --latency 0.05
+    python benchmark.py --rate-limit 30 --error-rate 0.02 --json result.json
+    python benchmark.py --rate-limit 20 --keys 1 2 4
+    python benchmark.py --replay tiktok_traffic.jsonl.gz --username some_user
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from analyzer import TikTokAnalyzer
+from config import Config
+from metrics import metrics
+from profiling import StageProfile
+from key_pool import ApiKey, KeyPool
+from rate_limiter import AdaptiveRateLimiter
+from tiktok_api import TikTokAPI
+from traffic_archive import TrafficRecorder, TrafficReplayer
+
+SEED_USERNAME = 'benchmark_seed'
+SEED_SEC_UID = 'benchmark_seed_sec'
+
+LATENCY_STAGES = ('seed_lookup', 'follower_paging', 'info_fetch', 'video_fetch')
+
+HTTP_REASONS = {200: 'OK', 404: 'Not Found', 429: 'Too Many Requests',
+                500: 'Internal Server Error'}
+
+
+class MockRapidAPI:
+    """Локальный HTTP-сервер, имитирующий TikTok API на RapidAPI.
+
+    Профили, списки фолловеров и видео детерминированы (зависят только
+    от seed и номера пользователя), поэтому прогоны сравнимы между собой.
+    Лимит запросов - фиксированное окно rate_window секунд с заголовками
+    X-RateLimit-Requests-Remaining/Reset и ответом 429 при превышении;
+    как и на RapidAPI, квота своя у каждого ключа X-RapidAPI-Key.
+    """
+
+    def __init__(self, followers: int = 1000, latency: float = 0.05,
+                 jitter: float = 0.5, error_rate: float = 0.0,
+                 rate_limit: int = 0, rate_window: float = 1.0,
+                 seed: int = 42, host: str = '127.0.0.1', port: int = 0):
+        self.followers = followers
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.seed = seed
+        self.host = host
+        self.port = port
+
+        self.calls: Dict[str, int] = {}
+        self.statuses: Dict[int, int] = {}
+        self._random = random.Random(seed)
+        # Окно лимита по ключам: ключ -> [начало окна, использовано]
+        self._windows: Dict[str, List[float]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def start(self) -> 'MockRapidAPI':
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def reset_counters(self):
+        self.calls.clear()
+        self.statuses.clear()
+        self._windows.clear()
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    # --- Синтетические данные ---
+
+    def _user_random(self, index: int, salt: int = 0) -> random.Random:
+        return random.Random(self.seed * 1_000_003 + index * 7 + salt)
+
+    def _profile(self, index: int) -> Dict:
+        rnd = self._user_random(index)
+        username = f"user{index}"
+        bio = rnd.choice(['🍕 food lover', 'travel & vlogs', 'daily recipes', ''])
+        if rnd.random() < 0.3:
+            bio += f" 📩 {username}@example.com"
+        return {
+            'uniqueId': username,
+            'secUid': f"sec{index}",
+            'signature': bio,
+            'followerCount': int(rnd.lognormvariate(7.5, 1.2)),
+            'videoCount': rnd.randint(0, 60)
+        }
+
+    def _user_info(self, profile: Dict) -> Dict:
+        stats = {
+            'followerCount': profile['followerCount'],
+            'videoCount': profile['videoCount']
+        }
+        user = {
+            'uniqueId': profile['uniqueId'],
+            'secUid': profile['secUid'],
+            'signature': profile['signature']
+        }
+        return dict(profile, user=user, stats=stats)
+
+    def _videos(self, index: int, count: int) -> List[Dict]:
+        profile = self._profile(index)
+        rnd = self._user_random(index, salt=1)
+        typical_views = rnd.lognormvariate(8, 1)
+        return [
+            {'id': f"{index}_{n}", 'playCount': int(typical_views * rnd.lognormvariate(0, 0.8))}
+            for n in range(min(count, profile['videoCount']))
+        ]
+
+    @staticmethod
+    def _user_index(username: str) -> Optional[int]:
+        if username.startswith('user') and username[4:].isdigit():
+            return int(username[4:])
+        return None
+
+    # --- Маршруты ---
+
+    def _route(self, path: str, params: Dict[str, str]) -> Tuple[int, Dict]:
+        if path == Config.TIKTOK_USER_INFO_PATH:
+            username = params.get('uniqueId', '')
+            if username == SEED_USERNAME:
+                seed_profile = {
+                    'uniqueId': SEED_USERNAME, 'secUid': SEED_SEC_UID,
+                    'signature': '', 'followerCount': self.followers,
+                    'videoCount': 100
+                }
+                return 200, {'statusCode': 0, 'userInfo': self._user_info(seed_profile)}
+            index = self._user_index(username)
+            if index is None or index >= self.followers:
+                return 200, {'statusCode': 10202, 'statusMsg': 'user not exist'}
+            return 200, {'statusCode': 0, 'userInfo': self._user_info(self._profile(index))}
+
+        if path == Config.TIKTOK_USER_FOLLOWERS_PATH:
+            if params.get('secUid') != SEED_SEC_UID:
+                return 200, {'statusCode': 0, 'userList': [], 'hasMore': False}
+            cursor = int(params.get('minCursor') or 0)
+            count = int(params.get('count') or 50)
+            end = min(cursor + count, self.followers)
+            user_list = []
+            for index in range(cursor, end):
+                info = self._user_info(self._profile(index))
+                user_list.append({'user': info['user'], 'stats': info['stats']})
+            return 200, {
+                'statusCode': 0,
+                'userList': user_list,
+                'minCursor': end,
+                'hasMore': end < self.followers
+            }
+
+        if path == Config.TIKTOK_USER_VIDEOS_PATH:
+            index = self._user_index(params.get('username', ''))
+            if index is None:
+                return 200, {'success': False, 'message': 'user not found'}
+            count = int(params.get('count') or 10)
+            return 200, {'success': True, 'data': {'videos': self._videos(index, count)}}
+
+        return 404, {'message': 'not found'}
+
+    def _take_quota(self, key: str) -> Tuple[bool, Dict[str, str]]:
+        """Учитывает запрос в текущем окне лимита ключа;
+        возвращает (разрешен, заголовки)"""
+        if not self.rate_limit:
+            return True, {}
+        now = time.monotonic()
+        window = self._windows.setdefault(key, [now, 0])
+        if now - window[0] >= self.rate_window:
+            window[0] = now
+            window[1] = 0
+        window[1] += 1
+        reset = self.rate_window - (now - window[0])
+        headers = {
+            'X-RateLimit-Requests-Limit': str(self.rate_limit),
+            'X-RateLimit-Requests-Remaining': str(max(0, self.rate_limit - window[1])),
+            'X-RateLimit-Requests-Reset': f"{reset:.3f}"
+        }
+        if window[1] > self.rate_limit:
+            headers['Retry-After'] = f"{reset:.3f}"
+            return False, headers
+        return True, headers
+
+    async def _respond(self, target: str,
+                       key: str = '') -> Tuple[int, Dict, Dict[str, str]]:
+        url = urlsplit(target)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.calls[url.path] = self.calls.get(url.path, 0) + 1
+
+        delay = self.latency * (1 + self.jitter * (2 * self._random.random() - 1))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        allowed, headers = self._take_quota(key)
+        if not allowed:
+            return 429, {'message': 'You have exceeded the rate limit'}, headers
+        # Исходный аккаунт ошибкой не ломаем, иначе прогон не состоится
+        seed_lookup = params.get('uniqueId') == SEED_USERNAME
+        if self._random.random() < self.error_rate and not seed_lookup:
+            return 500, {'message': 'mock upstream error'}, headers
+        status, body = self._route(url.path, params)
+        return status, body, headers
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # keep-alive: клиент переиспользует соединения из пула, как с RapidAPI
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                key = ''
+                while True:
+                    header = (await reader.readline()).strip()
+                    if not header:
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    if name.strip().lower() == 'x-rapidapi-key':
+                        key = value.strip()
+                parts = request_line.decode('latin-1').split()
+                if len(parts) < 2:
+                    break
+
+                status, body, headers = await self._respond(parts[1], key)
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                head = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+                        "Content-Type: application/json; charset=utf-8",
+                        f"Content-Length: {len(payload)}"]
+                head += [f"{name}: {value}" for name, value in headers.items()]
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _counter_total(name: str, **match) -> float:
+    """Сумма счетчика по всем сериям, метки которых совпадают с match"""
+    return sum(
+        value for key, value in metrics.counters.get(name, {}).items()
+        if all(dict(key).get(label) == str(v) for label, v in match.items())
+    )
+
+
+async def run_benchmark(server: Optional[MockRapidAPI], concurrency: int,
+                        client_rps: float = None, traffic=None,
+                        username: str = SEED_USERNAME, keys: int = 1) -> Dict:
+    """Один прогон analyze_account против мок-сервера или архива трафика"""
+    if server is not None:
+        server.reset_counters()
+    metrics.reset()
+    key_pool = None
+    if server is not None:
+        # Синтетические ключи: у мока квота своя у каждого ключа
+        key_pool = KeyPool([
+            ApiKey(
+                f"benchmark-key-{number}", Config.RAPIDAPI_HOST, server.base_url,
+                AdaptiveRateLimiter(rate=client_rps, max_rate=client_rps)
+            )
+            for number in range(1, keys + 1)
+        ])
+    api = TikTokAPI(
+        pool_size=max(concurrency, Config.HTTP_POOL_SIZE),
+        base_url=server.base_url if server is not None else None,
+        traffic=traffic,
+        keys=key_pool
+    )
+    analyzer = TikTokAnalyzer(api=api, max_concurrency=concurrency)
+
+    started = time.perf_counter()
+    try:
+        result = await analyzer.analyze_account(username)
+    finally:
+        await api.close()
+    wall_time = time.perf_counter() - started
+
+    if not result['success']:
+        raise RuntimeError(result['error'])
+
+    analyzed = result['total_followers_analyzed']
+    found = result['micro_influencers_found']
+    calls = int(_counter_total('tiktok_api_requests_total'))
+    server_errors = sum(
+        value for key, value in
+        metrics.counters.get('tiktok_api_responses_total', {}).items()
+        if int(dict(key)['status']) >= 500
+    )
+    return {
+        'concurrency': concurrency,
+        'keys': len(api.keys.keys),
+        'wall_seconds': wall_time,
+        'followers_analyzed': analyzed,
+        'followers_per_second': analyzed / wall_time if wall_time else 0.0,
+        'influencers_found': found,
+        'api_calls': calls,
+        'api_calls_per_influencer': calls / found if found else None,
+        'requests_per_second': calls / wall_time if wall_time else 0.0,
+        'throttled': int(_counter_total('tiktok_api_responses_total', status=429)),
+        'server_errors': int(server_errors),
+        'upstream_skipped': result['stage_stats']['upstream_failed'],
+        'key_usage': api.keys.usage(),
+        'stage_timings': result['stage_timings']
+    }
+
+
+def format_report(results: List[Dict]) -> str:
+    """Таблица результатов для консоли"""
+    lines = [
+        f"{'ключи':>6} {'потоки':>7} {'время, с':>9} {'фолл/с':>8} {'запр/с':>8} "
+        f"{'запросов':>9} {'найдено':>8} {'запр/инфл':>10} {'429':>5} {'5xx':>5} {'пропуск':>8}"
+    ]
+    for r in results:
+        per_influencer = r['api_calls_per_influencer']
+        lines.append(
+            f"{r['keys']:>6} {r['concurrency']:>7} {r['wall_seconds']:>9.2f} "
+            f"{r['followers_per_second']:>8.1f} {r['requests_per_second']:>8.1f} "
+            f"{r['api_calls']:>9} {r['influencers_found']:>8} "
+            f"{(f'{per_influencer:.1f}' if per_influencer else '—'):>10} "
+            f"{r['throttled']:>5} {r['server_errors']:>5} {r['upstream_skipped']:>8}"
+        )
+        # Точные задержки по этапам (с ожиданием лимитера), а не по корзинам
+        for stage in LATENCY_STAGES:
+            stats = r['stage_timings'].get(stage)
+            if not stats:
+                continue
+            lines.append(
+                f"{'':>7}   {StageProfile.STAGE_LABELS[stage]}: "
+                f"p50 {stats['p50'] * 1000:.0f} мс, "
+                f"p95 {stats['p95'] * 1000:.0f} мс ({stats['count']} раз)"
+            )
+    return "\n".join(lines)
+
+
+async def run_suite(args: argparse.Namespace) -> List[Dict]:
+    results = []
+    if args.replay:
+        # Для каждого прогона архив читается заново с начала
+        print(f"Воспроизведение архива {args.replay} ({args.replay_timing})")
+        for concurrency in args.concurrency:
+            traffic = TrafficReplayer(args.replay, args.replay_timing)
+            results.append(await run_benchmark(
+                None, concurrency, args.client_rps, traffic, args.username
+            ))
+        return results
+
+    server = MockRapidAPI(
+        followers=args.followers, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, rate_limit=args.rate_limit,
+        rate_window=args.rate_window, seed=args.seed
+    )
+    async with server:
+        print(f"Мок RapidAPI: {server.base_url}, фолловеров: {args.followers}")
+        for keys in args.keys:
+            for concurrency in args.concurrency:
+                traffic = TrafficRecorder(args.record) if args.record else None
+                results.append(await run_benchmark(
+                    server, concurrency, args.client_rps, traffic, keys=keys
+                ))
+    return results
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Офлайн-бенчмарк analyze_account против локального мока RapidAPI"
+    )
+    parser.add_argument('--followers', type=int, default=300,
+                        help="фолловеров у тестового аккаунта")
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[Config.MAX_CONCURRENT_REQUESTS],
+                        help="одно или несколько значений параллельности")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="средняя задержка ответа мока, с")
+    parser.add_argument('--jitter', type=float, default=0.5,
+                        help="разброс задержки (доля от --latency)")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="доля ответов 500")
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help="лимит запросов мока на окно (0 - без лимита)")
+    parser.add_argument('--rate-window', type=float, default=1.0,
+                        help="длина окна лимита, с")
+    parser.add_argument('--client-rps', type=float, default=None,
+                        help="начальная и максимальная скорость лимитера клиента "
+                             "(по умолчанию RATE_LIMIT_RPS/RATE_LIMIT_MAX_RPS)")
+    parser.add_argument('--keys', type=int, nargs='+', default=[1],
+                        help="размеры пула ключей RapidAPI (у мока квота на ключ)")
+    parser.add_argument('--seed', type=int, default=42,
+                        help="seed синтетических данных")
+    parser.add_argument('--json', dest='json_path',
+                        help="сохранить результаты в JSON для сравнения прогонов")
+    parser.add_argument('--record', metavar='ARCHIVE',
+                        help="записать трафик прогона против мока в архив")
+    parser.add_argument('--replay', metavar='ARCHIVE',
+                        help="вместо мока воспроизвести записанный архив трафика")
+    parser.add_argument('--replay-timing', choices=('original', 'fast'),
+                        default='fast', help="темп воспроизведения архива")
+    parser.add_argument('--username', default=SEED_USERNAME,
+                        help="аккаунт, анализ которого записан в архиве")
+    parser.add_argument('--verbose', action='store_true', help="логи бота")
+    args = parser.parse_args(argv)
+    if args.record and args.replay:
+        parser.error("--record и --replay нельзя использовать вместе")
+    if args.record and (len(args.concurrency) > 1 or len(args.keys) > 1):
+        parser.error("для --record укажите одно значение --concurrency и --keys")
+    return args
+
+
+def main(argv: List[str] = None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO if args.verbose else logging.CRITICAL
+    )
+    # Кэш ответов сделал бы повторные прогоны бесплатными и несравнимыми
+    Config.CACHE_ENABLED = False
+    if not args.replay:
+        Config.MAX_FOLLOWERS_TOTAL = args.followers
+
+    results = asyncio.run(run_suite(args))
+    print(format_report(results))
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f,
+                      ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.json_path}")
+
+
+if __name__ == '__main__':
+    main()
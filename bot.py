@@ -1,10 +1,30 @@
+import asyncio
+import functools
+import io
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import multiprocessing
+import signal
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from telegram.ext import (Application, CommandHandler, MessageHandler,
-                          CallbackQueryHandler, filters, ContextTypes)
+                          CallbackQueryHandler, TypeHandler, filters,
+                          ContextTypes)
 from telegram.constants import ParseMode
 from analyzer import TikTokAnalyzer
+from checkpoints import AnalysisCheckpoint, CheckpointStore
 from config import Config
+from data_processor import EXPORTERS
+from jobs import AnalysisJob, JobManager, JobQueueFull
+from metrics import metrics, start_metrics_server
+from profiling import CProfileHook
+from snapshot_store import SnapshotStore
+from progress import ProgressReporter
+from report_pool import ReportPool
+from state_backend import StateBackend, StateMapping, create_state_backend
+from tiktok_api import TikTokAPI
+from webhook import UpdateQueue, serve_webhook
 
 # Настройка логирования
 logging.basicConfig(
@@ -13,11 +33,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Глобальный анализатор
-analyzer = TikTokAnalyzer()
+# Общие объекты процесса бота создает setup(): процессы, запущенные через
+# spawn (пул отчетов, BOT_PROCESSES), заново импортируют этот модуль,
+# и при импорте не должны открываться базы, архив трафика и соединения
 
-# Словарь для хранения состояний пользователей
-user_states = {}
+# Общий клиент API (пул соединений, лимитер, кэш) для всех чатов
+api: Optional[TikTokAPI] = None
+
+# Снимки прошлых анализов для повторных запусков
+snapshots: Optional[SnapshotStore] = None
+
+# Контрольные точки выполняющихся анализов (продолжение после перезапуска)
+checkpoints: Optional[CheckpointStore] = None
+
+# Общее состояние (диалоги, настройки чатов, очередь задач); с бэкендом
+# sqlite его разделяют все процессы бота на хосте
+state: Optional[StateBackend] = None
+
+# Пул процессов для сборки отчетов, общий для всех чатов
+report_pool: Optional[ReportPool] = None
+
+# Сессии анализатора по чатам (LRU на ANALYZER_CACHE_SIZE чатов): у каждого
+# чата свои настройки фильтров
+analyzers: 'OrderedDict[int, TikTokAnalyzer]' = OrderedDict()
+
+# Фоновые задачи анализа
+job_manager: Optional[JobManager] = None
+
+# Состояния диалогов пользователей
+user_states: Optional[StateMapping] = None
+
+# Максимальный размер файла со списком аккаунтов для /batch
+MAX_SEED_FILE_SIZE = 1024 * 1024
+
+
+def get_analyzer(chat_id: int) -> TikTokAnalyzer:
+    """Возвращает сессию анализатора для чата"""
+    if chat_id not in analyzers:
+        analyzers[chat_id] = TikTokAnalyzer(
+            api=api, snapshots=snapshots, state=state, chat_id=chat_id,
+            reports=report_pool
+        )
+        while len(analyzers) > Config.ANALYZER_CACHE_SIZE:
+            evicted, _ = analyzers.popitem(last=False)
+            # Настройки чата небольшие и остаются в бэкенде, а сырые данные
+            # последнего анализа в памяти процесса освобождаются
+            if not state.shared:
+                state.delete('last_run', evicted)
+    else:
+        analyzers.move_to_end(chat_id)
+        analyzers[chat_id].load_state()
+    return analyzers[chat_id]
+
+
+def job_message(bot, payload: Dict, message_id: int) -> Message:
+    """Сообщение чата задачи по номеру (задачу мог поставить другой процесс)"""
+    return Message.de_json(
+        {'message_id': message_id, 'date': 0, 'chat': payload['chat']}, bot
+    )
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -38,7 +111,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 📋 Доступные команды:
 /search - поиск новых аккаунтов по критериям (рекомендуется)
 /analyze @username - анализ фолловеров аккаунта
+/batch - пакетный анализ списка аккаунтов
+/jobs - ваши задачи анализа
 /settings - настройки фильтров
+/refilter - пересчитать последний анализ с новыми настройками
 /help - справка
 
 🚀 Для начала работы отправьте:
@@ -60,6 +136,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /help"""
+    analyzer = get_analyzer(update.effective_chat.id)
     help_text = """
 📚 Справка по использованию TikTok Analyzer Bot
 
@@ -67,7 +144,14 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • `/start` - запуск бота
 • `/search` - поиск новых аккаунтов по критериям (рекомендуется)
 • `/analyze @username` - анализ фолловеров аккаунта
+• `/batch user1 user2 ...` - пакетный анализ (или пришлите .txt/.csv со списком)
+• `/jobs` - список задач анализа
+• `/status 3` - статус задачи
+• `/cancel 3` - отмена задачи
+• `/profile 3` - время по этапам анализа
 • `/settings` - настройки критериев поиска
+• `/refilter` - применить новые настройки к последнему анализу без запросов к API
+• `/format` - формат отчета (xlsx, csv, jsonl, parquet)
 • `/help` - эта справка
 
 ⚙️ Текущие настройки поиска:
@@ -76,7 +160,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • Минимум подходящих видео: {min_videos}
 
 📊 Формат результата:
-Бот создаст Excel файл с данными:
+Бот пришлет файл (Excel, CSV, JSONL или Parquet - см. /format) с данными:
 • Никнейм пользователя
 • Email (если найден в био)
 • Количество фолловеров
@@ -90,7 +174,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ❗ Важно:
 • Используйте точный никнейм без символа @
 • Бот анализирует публичные аккаунты
-• Максимум 50 фолловеров за раз
+• Максимум {max_total:,} фолловеров за раз
 
 💡 Для начала работы отправьте:
 /search - для поиска новых аккаунтов
@@ -98,7 +182,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """.format(
         max_followers=analyzer.search_settings['max_followers'],
         min_views=analyzer.search_settings['min_views'],
-        min_videos=analyzer.search_settings['min_videos']
+        min_videos=analyzer.search_settings['min_videos'],
+        max_total=Config.MAX_FOLLOWERS_TOTAL
     )
     
     await update.message.reply_text(help_text)
@@ -106,6 +191,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /settings"""
+    analyzer = get_analyzer(update.effective_chat.id)
     settings_text = analyzer.get_current_settings()
     
     keyboard = [
@@ -125,6 +211,7 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /search - поиск новых аккаунтов"""
+    analyzer = get_analyzer(update.effective_chat.id)
     search_text = """
 🔍 Поиск аккаунтов по критериям
 
@@ -156,9 +243,19 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /analyze"""
-    if context.args:
-        username = ' '.join(context.args)
-        await start_analysis(update, username)
+    args = list(context.args or [])
+    cprofile = '--cprofile' in args
+    if cprofile:
+        args.remove('--cprofile')
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            await update.message.reply_text(
+                "⛔ Профилирование доступно только администраторам."
+            )
+            return
+    
+    if args:
+        username = ' '.join(args)
+        await start_analysis(update, username, cprofile)
     else:
         await update.message.reply_text(
             "❗ Укажите username для анализа.\n\n"
@@ -168,62 +265,613 @@ async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-async def start_analysis(update: Update, username: str):
-    """Запускает анализ аккаунта"""
-    progress_message = await update.message.reply_text(
-        f"🔄 Начинаем анализ аккаунта @{username}...\n"
-        "Это может занять несколько минут."
+async def batch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /batch - пакетный анализ нескольких аккаунтов"""
+    analyzer = get_analyzer(update.effective_chat.id)
+    if context.args:
+        await start_batch(update, analyzer.parse_seed_list(' '.join(context.args)))
+        return
+    
+    user_states[update.effective_user.id] = 'waiting_batch_list'
+    await update.message.reply_text(
+        "📚 Пакетный анализ\n\n"
+        "Отправьте список аккаунтов (никнеймы или ссылки через пробел, "
+        "запятую или с новой строки) либо файл .txt/.csv.\n\n"
+        f"Максимум аккаунтов: {Config.BATCH_MAX_SEEDS}. Общие фолловеры "
+        "проверяются один раз, в отчете указано, из каких аккаунтов "
+        "найден каждый инфлюенсер."
     )
+
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик загруженного .txt/.csv со списком аккаунтов"""
+    user_states.pop(update.effective_user.id, None)
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_SEED_FILE_SIZE:
+        await update.message.reply_text(
+            f"❗ Файл слишком большой (максимум {MAX_SEED_FILE_SIZE // 1024} КБ)."
+        )
+        return
     
-    async def update_progress(text: str):
+    file = await document.get_file()
+    content = await file.download_as_bytearray()
+    text = bytes(content).decode('utf-8-sig', errors='replace')
+    analyzer = get_analyzer(update.effective_chat.id)
+    await start_batch(update, analyzer.parse_seed_list(text))
+
+
+async def start_batch(update: Update, seeds: List[str]):
+    """Проверяет список аккаунтов и ставит пакетный анализ в очередь"""
+    if not seeds:
+        await update.message.reply_text(
+            "❗ В списке не найдено ни одного никнейма или ссылки TikTok."
+        )
+        return
+    if len(seeds) > Config.BATCH_MAX_SEEDS:
+        await update.message.reply_text(
+            f"❗ Слишком много аккаунтов: {len(seeds)} "
+            f"(максимум {Config.BATCH_MAX_SEEDS})."
+        )
+        return
+    await start_analysis(update, seeds[0], seeds=seeds)
+
+
+async def start_analysis(update: Update, username: str, cprofile: bool = False,
+                         seeds: List[str] = None):
+    """Ставит анализ аккаунта (или пакета аккаунтов) в очередь фоновых задач.
+    
+    Задача описывается данными (чат, сообщения, аккаунты), поэтому ее
+    может выполнить обработчик любого процесса бота (см. execute_job).
+    """
+    chat_id = update.effective_chat.id
+    payload = {
+        'seeds': seeds,
+        'cprofile': cprofile,
+        'chat': update.effective_chat.to_dict(),
+        'message_id': update.message.message_id
+    }
+    
+    if seeds and len(seeds) > 1:
+        label = f"{username} +{len(seeds) - 1}"
+        title = f"пакетный анализ {len(seeds)} аккаунтов"
+    else:
+        label = username
+        title = f"анализ аккаунта @{username}"
+    
+    try:
+        # Обработчики получат задачу, когда будет создано сообщение прогресса
+        job = job_manager.submit(chat_id, label, payload, hold=True)
+    except JobQueueFull as e:
+        await update.message.reply_text(f"❗ {e}")
+        return
+    
+    position = job_manager.queue_position(job)
+    try:
+        progress_message = await update.message.reply_text(
+            f"🔄 Задача #{job.id}: {title}\n"
+            f"Позиция в очереди: {position}. "
+            "Это может занять несколько минут.\n\n"
+            f"Статус: /status {job.id}\n"
+            f"Отмена: /cancel {job.id}"
+        )
+    except Exception:
+        job_manager.cancel(job.id)
+        raise
+    payload['progress_message_id'] = progress_message.message_id
+    job_manager.release(job)
+
+
+async def execute_job(bot, job: AnalysisJob):
+    """Выполняет задачу анализа из очереди (ее мог поставить любой процесс бота).
+    
+    Задача с номером контрольной точки уже запускалась, но бот был
+    остановлен или упал: анализ продолжается с сохраненного места,
+    прогресс выводится в новом сообщении.
+    """
+    payload = job.payload
+    checkpoint = None
+    if payload.get('checkpoint_id'):
+        if checkpoints is not None:
+            checkpoint = checkpoints.get(payload['checkpoint_id'])
         try:
-            await progress_message.edit_text(text)
-        except Exception:
-            pass  # Игнорируем ошибки редактирования
+            message = await bot.send_message(
+                job.chat_id,
+                f"♻️ Продолжаем прерванный анализ @{job.username} с сохраненного места..."
+            )
+        except Exception as e:
+            logger.error(f"Не удалось уведомить чат {job.chat_id} о продолжении: {e}")
+            if checkpoint is not None:
+                checkpoint.delete()
+            job.error = str(e)
+            return None
+        progress_message = message
+    else:
+        message = job_message(bot, payload, payload['message_id'])
+        progress_message = job_message(bot, payload, payload['progress_message_id'])
+    
+    return await run_analysis(
+        job, get_analyzer(job.chat_id), message, progress_message,
+        payload.get('cprofile', False), payload.get('seeds'), checkpoint
+    )
+
+
+async def run_analysis(job: AnalysisJob, analyzer: TikTokAnalyzer,
+                       message, progress_message, cprofile: bool = False,
+                       seeds: List[str] = None,
+                       checkpoint: AnalysisCheckpoint = None):
+    """Выполняет анализ в фоне и отправляет результаты в чат.
+    
+    Если передан seeds - пакетный анализ этих аккаунтов. Прогресс
+    сохраняется в контрольную точку; если бот остановится во время
+    анализа, после перезапуска он продолжится (см. resume_analyses).
+    """
+    # Правки сообщения прогресса не чаще PROGRESS_UPDATE_INTERVAL секунд
+    reporter = ProgressReporter(progress_message.edit_text)
+    
+    async def update_progress(text: str):
+        job.progress = text
+        await reporter.update(f"Задача #{job.id}\n{text}")
+    
+    if checkpoint is None and checkpoints is not None:
+        checkpoint = checkpoints.create(
+            job.chat_id,
+            AnalysisCheckpoint.BATCH if seeds else AnalysisCheckpoint.SINGLE,
+            seeds or [job.username],
+            analyzer.search_settings,
+            analyzer.report_format
+        )
+        # По номеру точки задачу продолжит любой процесс (см. execute_job)
+        job.payload['checkpoint_id'] = checkpoint.id
+        job_manager.save_payload(job)
+    if checkpoint is not None:
+        checkpoint.owner_check = functools.partial(job_manager.confirm, job)
     
     try:
-        # Запускаем анализ
-        result = await analyzer.analyze_account(username, update_progress)
+        # Запускаем анализ (по запросу администратора - под cProfile)
+        hook = None
+        if cprofile and not CProfileHook.is_busy():
+            hook = CProfileHook()
+        elif cprofile:
+            await message.reply_text(
+                "❗ cProfile уже запущен для другой задачи, "
+                "анализ выполняется без него."
+            )
+        
+        if seeds:
+            analysis = analyzer.analyze_accounts(
+                seeds, update_progress, checkpoint
+            )
+        else:
+            analysis = analyzer.analyze_account(
+                job.username, update_progress, checkpoint
+            )
+        if hook:
+            with hook:
+                result = await analysis
+        else:
+            result = await analysis
+        
+        if not job_manager.confirm(job):
+            # Задачу перезапустил другой обработчик: результаты отправит он,
+            # а контрольная точка теперь его
+            checkpoint = None
+            await reporter.finish(
+                f"⚠️ Задача #{job.id} передана другому обработчику бота."
+            )
+            return result
         
         if result['success']:
+            job.profile = result['profile'].format()
             # Отправляем сводку результатов
+            batch_text = ""
+            if seeds:
+                batch_text = (
+                    f"• Исходных аккаунтов: {result['seeds_total']}"
+                    f" (не найдено: {len(result['seeds_failed'])})\n"
+                    f"• Фолловеров в списках: {result['total_followers_listed']},"
+                    f" повторов пропущено: {result['duplicates_skipped']}\n"
+                )
+                if result['seeds_failed']:
+                    batch_text += "• Не удалось получить: " + ", ".join(
+                        f"@{seed}" for seed in result['seeds_failed'][:20]
+                    ) + "\n"
             summary_text = f"""
-✅ Анализ завершен!
+✅ Анализ завершен! (задача #{job.id})
 
 📊 Статистика:
-• Проанализировано фолловеров: {result['total_followers_analyzed']}
+{batch_text}• Проанализировано фолловеров: {result['total_followers_analyzed']}
 • Найдено микро-инфлюенсеров: {result['micro_influencers_found']}
-
+• Отсеяно без лишних запросов: {result['stage_stats']['rejected_by_list'] + result['stage_stats']['rejected_by_info']} (сэкономлено запросов: {result['api_calls_saved']})
+• Взято из прошлых анализов: {result['stage_stats']['reused']}
+{format_resumed(result['stage_stats'], checkpoint)}
+{format_upstream_failures(result['stage_stats'])}
+{format_changes(result['changes'])}
 {result['summary']}
             """
             
-            await progress_message.edit_text(summary_text)
+            await reporter.finish(summary_text)
             
-            # Отправляем Excel файл
-            if result['excel_file']:
+            # Отправляем отчет прямо из памяти
+            report = result['report']
+            if report:
                 try:
-                    with open(result['excel_file'], 'rb') as file:
-                        await update.message.reply_document(
-                            document=file,
-                            filename=result['excel_file'],
-                            caption="📋 Excel файл с результатами."
+                    with result['profile'].measure('upload'):
+                        await message.reply_document(
+                            document=report.buffer,
+                            filename=report.filename,
+                            caption=f"📋 Файл с результатами ({report.format})."
                         )
                 except Exception as e:
                     logger.error(f"Ошибка отправки файла: {e}")
-                    await update.message.reply_text(
-                        f"❗ Файл создан ({result['excel_file']}), "
+                    await message.reply_text(
+                        f"❗ Отчет создан ({report.filename}), "
                         "но произошла ошибка при отправке."
                     )
+            
+            diff_report = result['diff_report']
+            if diff_report:
+                try:
+                    await message.reply_document(
+                        document=diff_report.buffer,
+                        filename=diff_report.filename,
+                        caption="🔁 Изменения с прошлого анализа."
+                    )
+                except Exception as e:
+                    logger.error(f"Ошибка отправки отчета изменений: {e}")
         else:
-            await progress_message.edit_text(
-                f"❌ Ошибка анализа: {result['error']}"
+            job.error = result['error']
+            await reporter.finish(f"❌ Ошибка анализа: {result['error']}")
+        
+        if hook:
+            await message.reply_document(
+                document=io.BytesIO(hook.report()),
+                filename=f"profile_{job.id}.txt",
+                caption=f"🧪 cProfile задачи #{job.id}"
             )
-            
+        return result
+    
+    except asyncio.CancelledError:
+        if job.lost:
+            # Аренду перехватил другой обработчик (см. JobManager._abandon)
+            checkpoint = None
+            await reporter.finish(
+                f"⚠️ Задача #{job.id} передана другому обработчику бота."
+            )
+        elif checkpoint is not None and job_manager.stopping:
+            # Бот останавливается: анализ продолжится после перезапуска
+            checkpoint.save()
+            checkpoint = None
+            await reporter.finish(
+                f"⏸ Задача #{job.id} (@{job.username}) прервана остановкой бота "
+                "и продолжится после перезапуска."
+            )
+        else:
+            await reporter.finish(f"🚫 Задача #{job.id} (@{job.username}) отменена.")
+        raise
     except Exception as e:
         logger.error(f"Ошибка в анализе: {e}")
-        await progress_message.edit_text(
-            f"❌ Произошла ошибка при анализе: {str(e)}"
+        job.error = str(e)
+        await reporter.finish(f"❌ Произошла ошибка при анализе: {str(e)}")
+    finally:
+        if checkpoint is not None:
+            checkpoint.delete()
+
+
+async def resume_analyses():
+    """Продолжает анализы, прерванные остановкой или падением бота.
+    
+    Нужно только с бэкендом состояния в памяти: в общем бэкенде прерванные
+    задачи остаются в очереди вместе с номером контрольной точки.
+    """
+    for checkpoint in checkpoints.pending():
+        seeds = checkpoint.seeds if checkpoint.kind == AnalysisCheckpoint.BATCH else None
+        username = checkpoint.seeds[0]
+        label = f"{username} +{len(seeds) - 1}" if seeds and len(seeds) > 1 else username
+        payload = {
+            'seeds': seeds,
+            'chat': {'id': checkpoint.chat_id, 'type': 'private'},
+            'checkpoint_id': checkpoint.id
+        }
+        
+        try:
+            job = job_manager.submit(checkpoint.chat_id, label, payload)
+        except JobQueueFull as e:
+            logger.warning(f"Анализ @{label} не продолжен: {e}")
+            continue
+        logger.info(f"Задача #{job.id}: продолжение анализа @{label}")
+
+
+def format_upstream_failures(stage_stats) -> str:
+    """Строка сводки о фолловерах, пропущенных из-за сбоев API"""
+    lines = []
+    if stage_stats['upstream_failed']:
+        lines.append(
+            f"⚠️ Пропущено из-за сбоев API: {stage_stats['upstream_failed']} "
+            "фолловеров (повторный анализ проверит их снова)"
+        )
+    if stage_stats['pages_failed']:
+        lines.append(
+            "⚠️ Список фолловеров загружен не полностью из-за сбоев API"
+        )
+    if lines and snapshots is not None:
+        lines.append(
+            "⚠️ Результаты неполные: снимок для сравнения не обновлен, "
+            "изменения с прошлого анализа не посчитаны"
+        )
+    return "\n".join(lines)
+
+
+def format_resumed(stage_stats, checkpoint) -> str:
+    """Строка сводки о продолжении после перезапуска"""
+    if checkpoint is None or not checkpoint.resumed:
+        return ""
+    checked = checkpoint.listed_before + stage_stats['resumed']
+    return f"• Продолжен после перезапуска, проверено ранее: {checked}"
+
+
+def format_changes(changes) -> str:
+    """Строка сводки об изменениях с прошлого анализа"""
+    if changes is None:
+        return ""
+    if not changes:
+        return "🔁 С прошлого анализа изменений нет\n"
+    counts = {'new': 0, 'dropped': 0, 'changed': 0}
+    for change in changes:
+        counts[change['change']] += 1
+    return (
+        f"🔁 С прошлого анализа: новых {counts['new']}, "
+        f"выбыло {counts['dropped']}, изменилось {counts['changed']}\n"
+    )
+
+
+async def refilter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /refilter"""
+    await send_refilter(update.message, get_analyzer(update.effective_chat.id))
+
+
+async def offer_refilter(message, analyzer: TikTokAnalyzer):
+    """После смены настроек предлагает пересчитать последний анализ"""
+    if not analyzer.has_last_run():
+        return
+    keyboard = [[InlineKeyboardButton(
+        "🔁 Применить к последнему анализу", callback_data="refilter"
+    )]]
+    await message.reply_text(
+        "Новые настройки можно применить к данным последнего анализа "
+        "без повторных запросов к API.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def send_refilter(message, analyzer: TikTokAnalyzer):
+    """Пересчитывает последний анализ с текущими настройками и присылает отчет"""
+    result = await analyzer.refilter()
+    if not result['success']:
+        await message.reply_text(f"❗ {result['error']}")
+        return
+    
+    missing_text = ""
+    if result['missing_data']:
+        missing_text = (
+            f"\n• Не проверено (нужны данные, которых нет): {result['missing_data']}"
+            " - для них запустите анализ заново"
+        )
+    await message.reply_text(f"""
+🔁 Повторная фильтрация без запросов к API ({result['elapsed']:.2f} с)
+
+⚙️ Настройки: максимум фолловеров {analyzer.search_settings['max_followers']:,}, минимум просмотров {analyzer.search_settings['min_views']:,}, минимум видео {analyzer.search_settings['min_videos']}
+• Исходные аккаунты: {", ".join(f"@{seed}" for seed in result['seeds'][:20])}
+• Фолловеров в данных: {result['total_followers_analyzed']}
+• Найдено микро-инфлюенсеров: {result['micro_influencers_found']}{missing_text}
+
+{result['summary']}
+    """.strip())
+    
+    report = result['report']
+    if report:
+        await message.reply_document(
+            document=report.buffer,
+            filename=report.filename,
+            caption=f"📋 Файл с результатами ({report.format})."
+        )
+
+
+async def format_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /format [xlsx|csv|jsonl|parquet]"""
+    analyzer = get_analyzer(update.effective_chat.id)
+    if context.args:
+        await set_report_format(update.message, analyzer, context.args[0].lower())
+        return
+    
+    keyboard = [[
+        InlineKeyboardButton(report_format, callback_data=f"format_{report_format}")
+        for report_format in EXPORTERS
+    ]]
+    await update.message.reply_text(
+        f"📄 Текущий формат отчета: {analyzer.report_format}\n"
+        "Выберите новый формат:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def set_report_format(message, analyzer: TikTokAnalyzer,
+                            report_format: str):
+    """Меняет формат отчета для чата"""
+    try:
+        analyzer.set_report_format(report_format)
+    except ValueError:
+        await message.reply_text(
+            f"❗ Неизвестный формат. Доступны: {', '.join(EXPORTERS)}"
+        )
+        return
+    await message.reply_text(f"✅ Формат отчета обновлен: {report_format}")
+
+
+def build_stats_text() -> str:
+    """Сводка метрик процесса для /stats"""
+    lines = ["📈 Статистика бота", ""]
+    delay = metrics.histograms.get('telegram_update_delay_seconds', {}).get(
+        (('mode', Config.BOT_MODE),)
+    )
+    if delay and delay.count:
+        lines.append(
+            f"📨 Доставка сообщений ({Config.BOT_MODE}): {delay.count} сообщ., "
+            f"p50 {delay.quantile(0.5):.2f} с, p95 {delay.quantile(0.95):.2f} с"
+        )
+    if Config.BOT_MODE == 'webhook':
+        accepted = metrics.counter('telegram_webhook_requests_total', status=200)
+        rejected = metrics.counter('telegram_webhook_requests_total', status=503)
+        lines.append(
+            f"🪝 Вебхук: принято {accepted:.0f}, "
+            f"отклонено при заполненной очереди {rejected:.0f}"
+        )
+    lines.extend(["", "🌐 Запросы к RapidAPI:"])
+    for endpoint in metrics.label_values('tiktok_api_request_seconds', 'endpoint'):
+        histogram = metrics.histograms['tiktok_api_request_seconds'][
+            (('endpoint', endpoint),)
+        ]
+        requests_count = histogram.count
+        errors = sum(
+            value for key, value in
+            metrics.counters.get('tiktok_api_errors_total', {}).items()
+            if dict(key).get('endpoint') == endpoint
+        )
+        throttled = metrics.counter('tiktok_api_throttled_total', endpoint=endpoint)
+        received = metrics.counter('tiktok_api_received_bytes_total', endpoint=endpoint)
+        lines.append(
+            f"• {endpoint}: {requests_count} запр., "
+            f"p50 {histogram.quantile(0.5):.2f} с, "
+            f"p95 {histogram.quantile(0.95):.2f} с, "
+            f"ошибки {errors / requests_count:.1%}, "
+            f"429 {throttled / requests_count:.1%}, "
+            f"{received / 1024 / 1024:.1f} МБ"
+        )
+    
+    lines.append("")
+    lines.append("🔑 Ключи RapidAPI:")
+    for usage in api.keys.usage():
+        text = (
+            f"• {usage['key']}: {usage['requests']} запр., "
+            f"лимит {usage['rate']:.2f} запр/с, "
+            f"ошибки {usage['errors']}, 429 {usage['throttled']}"
+        )
+        if usage['remaining'] is not None:
+            text += f", осталось квоты {usage['remaining']:.0f}"
+        if usage['ejected_for']:
+            text += f", исключен еще на {usage['ejected_for']:.0f} с"
+        lines.append(text)
+    lines.append(
+        f"🔁 Объединено одинаковых запросов: {api.in_flight.shared_count}"
+    )
+    if api.cache:
+        for endpoint, stats in sorted(api.cache.stats().items()):
+            lines.append(
+                f"💾 Кэш {endpoint}: {stats['hit_ratio']:.1%} попаданий "
+                f"({stats['hits']}/{stats['hits'] + stats['misses']})"
+            )
+    
+    lines.append("")
+    lines.append("🧾 Задачи анализа:")
+    for status in metrics.label_values('analysis_jobs_total', 'status'):
+        count = metrics.counter('analysis_jobs_total', status=status)
+        text = f"• {AnalysisJob.STATUS_LABELS[status]}: {count:.0f}"
+        histogram = metrics.histograms.get('analysis_job_seconds', {}).get(
+            (('status', status),)
+        )
+        if histogram and histogram.count:
+            text += (
+                f", в среднем {histogram.sum / histogram.count:.0f} с, "
+                f"p95 {histogram.quantile(0.95):.0f} с"
+            )
+        lines.append(text)
+    active = [job for job in job_manager.list_jobs() if not job.finished]
+    lines.append(f"• Активных и в очереди: {len(active)}")
+    return "\n".join(lines)
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /stats (только для администраторов)"""
+    if update.effective_user.id not in Config.ADMIN_IDS:
+        await update.message.reply_text("⛔ Команда доступна только администраторам.")
+        return
+    await update.message.reply_text(build_stats_text())
+
+
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /jobs - задачи анализа в этом чате"""
+    jobs = job_manager.list_jobs(update.effective_chat.id)
+    if not jobs:
+        await update.message.reply_text(
+            "📭 Задач анализа пока нет.\n"
+            "Запустите анализ командой /analyze @username"
+        )
+        return
+    
+    lines = [job.describe().split('\n')[0] for job in jobs[-10:]]
+    await update.message.reply_text(
+        "📋 Задачи анализа:\n\n" + "\n".join(lines) +
+        "\n\nПодробнее: /status <номер>, отмена: /cancel <номер>"
+    )
+
+
+def find_chat_job(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ищет задачу чата по номеру из аргументов (по умолчанию - последнюю)"""
+    chat_id = update.effective_chat.id
+    if not context.args:
+        jobs = job_manager.list_jobs(chat_id)
+        return jobs[-1] if jobs else None
+    try:
+        job = job_manager.get(int(context.args[0].lstrip('#')))
+    except ValueError:
+        return None
+    return job if job and job.chat_id == chat_id else None
+
+
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /status [номер]"""
+    job = find_chat_job(update, context)
+    if job is None:
+        await update.message.reply_text("❗ Задача не найдена. Список: /jobs")
+        return
+    
+    text = job.describe()
+    position = job_manager.queue_position(job)
+    if position:
+        text += f"\nПозиция в очереди: {position}"
+    await update.message.reply_text(text)
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /profile [номер] - время по этапам анализа"""
+    job = find_chat_job(update, context)
+    if job is None:
+        await update.message.reply_text("❗ Задача не найдена. Список: /jobs")
+        return
+    
+    if job.profile is None:
+        await update.message.reply_text(
+            f"❗ Для задачи #{job.id} профиль пока недоступен "
+            "(задача не завершена или завершилась ошибкой)."
+        )
+        return
+    await update.message.reply_text(f"Задача #{job.id}\n{job.profile}")
+
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /cancel <номер>"""
+    if not context.args:
+        await update.message.reply_text(
+            "❗ Укажите номер задачи.\n\nПример: /cancel 3"
+        )
+        return
+    
+    job = find_chat_job(update, context)
+    if job is None or not job_manager.cancel(job.id):
+        await update.message.reply_text(
+            "❗ Задача не найдена или уже завершена. Список: /jobs"
         )
+        return
+    await update.message.reply_text(f"🚫 Задача #{job.id} отменяется...")
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -245,6 +893,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
+        elif state == 'waiting_batch_list':
+            del user_states[user_id]
+            analyzer = get_analyzer(update.effective_chat.id)
+            await start_batch(update, analyzer.parse_seed_list(text))
+            return
+        
         elif state.startswith('setting_'):
             # Пользователь изменяет настройки
             await handle_setting_input(update, context, state, text)
@@ -271,6 +925,7 @@ async def handle_setting_input(update: Update,
                                context: ContextTypes.DEFAULT_TYPE, 
                                state: str, text: str):
     """Обработчик ввода настроек"""
+    analyzer = get_analyzer(update.effective_chat.id)
     try:
         value = int(text)
         user_id = update.effective_user.id
@@ -292,6 +947,7 @@ async def handle_setting_input(update: Update,
             )
         
         del user_states[user_id]
+        await offer_refilter(update.message, analyzer)
         
     except ValueError:
         await update.message.reply_text(
@@ -301,6 +957,7 @@ async def handle_setting_input(update: Update,
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик callback кнопок"""
+    analyzer = get_analyzer(update.effective_chat.id)
     query = update.callback_query
     await query.answer()
     
@@ -341,6 +998,14 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "🎬 Введите минимальное количество видео с высокими просмотрами:"
         )
     
+    elif data == "refilter":
+        await send_refilter(query.message, analyzer)
+    
+    elif data.startswith("format_"):
+        await set_report_format(
+            query.message, analyzer, data[len("format_"):]
+        )
+    
     elif data == "reset_settings":
         analyzer.update_settings(
             max_followers=Config.DEFAULT_MAX_FOLLOWERS,
@@ -351,34 +1016,175 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "🔄 Настройки сброшены к значениям по умолчанию.\n\n" +
             analyzer.get_current_settings()
         )
+        await offer_refilter(query.message, analyzer)
 
 
-def main():
-    """Запуск бота"""
-    if not Config.TELEGRAM_BOT_TOKEN:
-        logger.error("TELEGRAM_BOT_TOKEN не найден в переменных окружения!")
-        return
-    
-    if not Config.RAPIDAPI_KEY:
-        logger.error("RAPIDAPI_KEY не найден в переменных окружения!")
-        return
-    
-    # Создаем приложение
-    app = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+async def track_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Задержка доставки новых сообщений и запись апдейтов (UPDATE_RECORD_PATH)"""
+    if update.message is not None and update.message.date:
+        # Дата сообщения в Telegram - с точностью до секунды
+        metrics.observe(
+            'telegram_update_delay_seconds',
+            max(0.0, time.time() - update.message.date.timestamp()),
+            mode=Config.BOT_MODE
+        )
+    if Config.UPDATE_RECORD_PATH:
+        with open(Config.UPDATE_RECORD_PATH, 'a', encoding='utf-8') as f:
+            f.write(update.to_json() + '\n')
+
+
+async def startup(app: Application):
+    """Запускает обработчики фоновых задач и эндпоинт метрик"""
+    job_manager.runner = functools.partial(execute_job, app.bot)
+    await job_manager.start()
+    app.bot_data['metrics_server'] = await start_metrics_server()
+    if checkpoints is not None and not state.shared:
+        await resume_analyses()
+
+
+async def shutdown(app: Application):
+    """Останавливает фоновые задачи и закрывает HTTP-соединения"""
+    await job_manager.stop()
+    await api.close()
+    report_pool.shutdown()
+    if snapshots is not None:
+        snapshots.close()
+    if checkpoints is not None:
+        checkpoints.close()
+    state.close()
+    metrics_server = app.bot_data.get('metrics_server')
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+
+
+def build_application() -> Application:
+    """Приложение Telegram с обработчиками"""
+    app = (
+        Application.builder()
+        .token(Config.TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(Config.UPDATE_CONCURRENCY)
+        .update_queue(UpdateQueue(Config.UPDATE_QUEUE_SIZE))
+        .post_init(startup)
+        .post_shutdown(shutdown)
+        .build()
+    )
     
     # Добавляем обработчики
+    app.add_handler(TypeHandler(Update, track_update), group=-1)
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("settings", settings_command))
     app.add_handler(CommandHandler("search", search_command))
     app.add_handler(CommandHandler("analyze", analyze_command))
+    app.add_handler(CommandHandler("batch", batch_command))
+    app.add_handler(CommandHandler("refilter", refilter_command))
+    app.add_handler(CommandHandler("format", format_command))
+    app.add_handler(CommandHandler("jobs", jobs_command))
+    app.add_handler(CommandHandler("status", status_command))
+    app.add_handler(CommandHandler("cancel", cancel_command))
+    app.add_handler(CommandHandler("profile", profile_command))
+    app.add_handler(CommandHandler("stats", stats_command))
     app.add_handler(CallbackQueryHandler(handle_callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, 
                                    handle_message))
+    app.add_handler(MessageHandler(
+        filters.Document.FileExtension("txt") | filters.Document.FileExtension("csv"),
+        handle_document
+    ))
+    return app
+
+
+def setup():
+    """Создает общие объекты процесса бота (вызывается один раз до запуска)"""
+    global api, snapshots, checkpoints, state, report_pool, job_manager, user_states
+    api = TikTokAPI()
+    snapshots = SnapshotStore() if Config.SNAPSHOTS_ENABLED else None
+    checkpoints = CheckpointStore() if Config.CHECKPOINTS_ENABLED else None
+    state = create_state_backend()
+    report_pool = ReportPool()
+    job_manager = JobManager(backend=state)
+    user_states = state.mapping('user_state')
+
+
+def run_bot(process_number: int = 0):
+    """Запускает один процесс бота"""
+    setup()
+    app = build_application()
+    logger.info(f"Запускаем TikTok Analyzer Bot ({Config.BOT_MODE})...")
+    if Config.BOT_MODE == 'webhook':
+        # Адрес вебхука в Telegram регистрирует только первый процесс
+        asyncio.run(serve_webhook(app, register=process_number == 0))
+    else:
+        app.run_polling()
+
+
+def run_worker_process(number: int):
+    """Точка входа дочернего процесса бота (BOT_PROCESSES > 1)"""
+    if Config.METRICS_PORT:
+        # У каждого процесса свой эндпоинт метрик: METRICS_PORT + номер
+        Config.METRICS_PORT += number
+    try:
+        run_bot(number)
+    except KeyboardInterrupt:
+        pass
+
+
+def run_processes():
+    """Запускает BOT_PROCESSES процессов бота на одном хосте.
+    
+    Все процессы слушают один порт вебхука (SO_REUSEPORT), и входящие
+    соединения Telegram распределяет между ними ядро. Задачи анализа
+    попадают в общую очередь (STATE_BACKEND=sqlite) и выполняются
+    свободными обработчиками любого процесса.
+    """
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=run_worker_process, args=(number,),
+                        name=f"bot-{number}")
+        for number in range(Config.BOT_PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Запущено процессов бота: {len(processes)}")
+    
+    def terminate(signum, frame):
+        for process in processes:
+            process.terminate()  # SIGTERM: процесс завершается штатно
+    
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # SIGINT из терминала получают и дочерние процессы
+        for process in processes:
+            process.join()
+
+
+def main():
+    """Запуск бота"""
+    if not Config.TELEGRAM_BOT_TOKEN:
+        logger.error("TELEGRAM_BOT_TOKEN не найден в переменных окружения!")
+        return
+    
+    if not Config.RAPIDAPI_KEY and not Config.RAPIDAPI_KEYS:
+        logger.error("RAPIDAPI_KEY (или RAPIDAPI_KEYS) не найден в переменных окружения!")
+        return
     
-    # Запускаем бота
-    logger.info("Запускаем TikTok Analyzer Bot...")
-    app.run_polling()
+    if Config.BOT_PROCESSES > 1:
+        if Config.BOT_MODE != 'webhook' or Config.STATE_BACKEND != 'sqlite':
+            logger.error(
+                "Для BOT_PROCESSES > 1 нужны BOT_MODE=webhook и STATE_BACKEND=sqlite"
+            )
+            return
+        if Config.TRAFFIC_MODE == 'record':
+            # Процессы перезаписывали бы один архив TRAFFIC_ARCHIVE
+            logger.error("TRAFFIC_MODE=record работает только с BOT_PROCESSES=1")
+            return
+        run_processes()
+    else:
+        run_bot()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,255 @@
+import json
+import logging
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from config import Config
+from snapshot_store import SnapshotStore
+from tiktok_api import TikTokAPI
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisCheckpoint:
+    """Состояние выполняющегося анализа, которое переживает перезапуск бота.
+
+    Хранит параметры задачи (аккаунты, снимок настроек, формат отчета)
+    и прогресс: результаты проверенных фолловеров, а для анализа одного
+    аккаунта - курсор страницы, с которой продолжать обход, и фолловеров
+    до нее (числа из списка и найденных инфлюенсеров). Пакетный анализ
+    при возобновлении заново обходит списки фолловеров, но не проверяет
+    уже проверенных.
+    """
+
+    SINGLE = 'single'
+    BATCH = 'batch'
+
+    def __init__(self, store: 'CheckpointStore', checkpoint_id: int, chat_id: int,
+                 kind: str, seeds: List[str], settings: Dict, report_format: str,
+                 state: Dict = None):
+        self.store = store
+        self.id = checkpoint_id
+        self.chat_id = chat_id
+        self.kind = kind
+        self.seeds = seeds
+        self.settings = settings
+        self.report_format = report_format
+
+        state = state or {}
+        self.resumed = bool(state)
+        self.cursor: int = state.get('cursor', 0)
+        self.listed_before: int = state.get('listed_before', 0)
+        self.results_before: List[list] = state.get('results_before', [])
+        # Никнейм, фолловеры и видео из списка для фолловеров до курсора
+        self.followers_before: List[list] = state.get('followers_before', [])
+        self.done: Dict[str, Optional[list]] = state.get('done', {})
+
+        # Прогресс текущего запуска: страницы (курсор, индекс первого
+        # фолловера), позиции и числа из списка фолловеров и сколько из них
+        # уже выдано по порядку
+        self._pages: List[Tuple[int, int]] = []
+        self._listed: Dict[str, Tuple[int, Optional[int], Optional[int]]] = {}
+        self._emitted = 0
+        # Фолловеры, изменившиеся после последнего сохранения
+        self._unsaved: Set[str] = set()
+        self._saved_at = time.monotonic()
+        # Проверка, что задача все еще за этим обработчиком: запуск,
+        # потерявший аренду, не пишет и не удаляет точку нового владельца
+        self.owner_check: Optional[Callable[[], bool]] = None
+
+    @property
+    def owned(self) -> bool:
+        return self.owner_check is None or self.owner_check()
+
+    # --- Прогресс анализа ---
+
+    def on_page(self, cursor: int, followers: List[Dict]):
+        """Вызывается перед выдачей страницы фолловеров (см. iter_user_followers)"""
+        self._pages.append((cursor, len(self._listed)))
+        for follower in followers:
+            user = follower.get('user', {})
+            username = user.get('uniqueId')
+            if username:
+                key = username.lower()
+                self._listed[key] = (
+                    self.listed_before + len(self._listed),
+                    *TikTokAPI.extract_user_stats(follower)
+                )
+                self._unsaved.add(key)
+
+    def mark_emitted(self, count: int):
+        """Первые count фолловеров текущего запуска проверены"""
+        self._emitted = count
+        if time.monotonic() - self._saved_at >= self.store.interval:
+            self.save()
+
+    def is_done(self, username: str) -> bool:
+        return username.lower() in self.done
+
+    def restore(self, username: str) -> Optional[Tuple]:
+        stored = self.done.get(username.lower())
+        return tuple(stored) if stored else None
+
+    def record(self, username: str, evaluation: Optional[Tuple]):
+        if evaluation:
+            info, email, high_view_videos = evaluation
+            self.done[username.lower()] = [
+                SnapshotStore.compact_info(info), email, high_view_videos
+            ]
+        else:
+            self.done[username.lower()] = None
+        self._unsaved.add(username.lower())
+
+    def restored_results(self) -> List[Tuple]:
+        """Инфлюенсеры, найденные до страницы, с которой продолжается обход"""
+        return [tuple(result) for result in self.results_before]
+
+    def state(self) -> Dict:
+        """Курсор, с которого продолжать обход, и число фолловеров до него"""
+        # Продолжать нужно со страницы первого еще не выданного фолловера
+        cursor, start = self.cursor, 0
+        for page_cursor, page_start in self._pages:
+            if page_start > self._emitted:
+                break
+            cursor, start = page_cursor, page_start
+        return {'cursor': cursor, 'listed_before': self.listed_before + start}
+
+    def unsaved_rows(self) -> List[Tuple]:
+        """Строки фолловеров, изменившихся после последнего сохранения:
+        (никнейм, позиция, фолловеры, видео, проверен, результат)"""
+        rows = []
+        for username in self._unsaved:
+            position, list_followers, list_videos = self._listed.get(
+                username, (None, None, None)
+            )
+            result = self.done.get(username)
+            rows.append((
+                username, position, list_followers, list_videos,
+                int(username in self.done),
+                None if result is None else json.dumps(result, ensure_ascii=False)
+            ))
+        self._unsaved = set()
+        return rows
+
+    def save(self):
+        if not self.owned:
+            return
+        self.store.save(self)
+        self._saved_at = time.monotonic()
+
+    def delete(self):
+        if self.owned:
+            self.store.delete(self)
+
+
+class CheckpointStore:
+    """Контрольные точки анализов в SQLite.
+
+    Проверенные фолловеры хранятся построчно (checkpoint_followers):
+    сохранение пишет только изменившиеся с прошлого раза строки.
+    """
+
+    def __init__(self, path: str = None, interval: float = None):
+        self.path = path or Config.CHECKPOINT_PATH
+        self.interval = Config.CHECKPOINT_INTERVAL if interval is None else interval
+
+        self._conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS analysis_checkpoints ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, '
+            'kind TEXT NOT NULL, seeds TEXT NOT NULL, settings TEXT NOT NULL, '
+            'report_format TEXT NOT NULL, state TEXT NOT NULL, '
+            'updated_at REAL NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS checkpoint_followers ('
+            'checkpoint_id INTEGER NOT NULL, username TEXT NOT NULL, '
+            'position INTEGER, list_followers INTEGER, list_videos INTEGER, '
+            'done INTEGER NOT NULL, result TEXT, '
+            'PRIMARY KEY (checkpoint_id, username));'
+        )
+
+    def create(self, chat_id: int, kind: str, seeds: List[str],
+               settings: Dict, report_format: str) -> AnalysisCheckpoint:
+        cursor = self._conn.execute(
+            'INSERT INTO analysis_checkpoints '
+            '(chat_id, kind, seeds, settings, report_format, state, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (chat_id, kind, json.dumps(seeds), json.dumps(settings),
+             report_format, '{}', time.time())
+        )
+        return AnalysisCheckpoint(
+            self, cursor.lastrowid, chat_id, kind, seeds, dict(settings),
+            report_format
+        )
+
+    def save(self, checkpoint: AnalysisCheckpoint):
+        state = checkpoint.state()
+        with self._conn:
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO checkpoint_followers '
+                '(checkpoint_id, username, position, list_followers, list_videos, '
+                'done, result) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(checkpoint.id, *row) for row in checkpoint.unsaved_rows()]
+            )
+            self._conn.execute(
+                'UPDATE analysis_checkpoints SET state = ?, updated_at = ? WHERE id = ?',
+                (json.dumps(state), time.time(), checkpoint.id)
+            )
+        logger.debug(f"[Checkpoint] Сохранена контрольная точка #{checkpoint.id}")
+
+    def delete(self, checkpoint: AnalysisCheckpoint):
+        with self._conn:
+            self._conn.execute('BEGIN')
+            self._conn.execute(
+                'DELETE FROM checkpoint_followers WHERE checkpoint_id = ?',
+                (checkpoint.id,)
+            )
+            self._conn.execute(
+                'DELETE FROM analysis_checkpoints WHERE id = ?', (checkpoint.id,)
+            )
+
+    def get(self, checkpoint_id: int) -> Optional[AnalysisCheckpoint]:
+        row = self._conn.execute(
+            'SELECT id, chat_id, kind, seeds, settings, report_format, state '
+            'FROM analysis_checkpoints WHERE id = ?', (checkpoint_id,)
+        ).fetchone()
+        return self._checkpoint(row) if row else None
+
+    def pending(self) -> List[AnalysisCheckpoint]:
+        """Анализы, прерванные остановкой или падением процесса"""
+        rows = self._conn.execute(
+            'SELECT id, chat_id, kind, seeds, settings, report_format, state '
+            'FROM analysis_checkpoints ORDER BY id'
+        ).fetchall()
+        return [self._checkpoint(row) for row in rows]
+
+    def _checkpoint(self, row) -> AnalysisCheckpoint:
+        state = json.loads(row[6])
+        if state:
+            listed_before = state.get('listed_before', 0)
+            results_before = state.setdefault('results_before', [])
+            followers_before = state.setdefault('followers_before', [])
+            done = state.setdefault('done', {})
+            # Фолловеры до курсора (по позиции в списке) заново не загружаются
+            for username, position, list_followers, list_videos, checked, result in (
+                    self._conn.execute(
+                        'SELECT username, position, list_followers, list_videos, '
+                        'done, result FROM checkpoint_followers '
+                        'WHERE checkpoint_id = ? ORDER BY position', (row[0],))):
+                result = json.loads(result) if result else None
+                if position is not None and position < listed_before:
+                    followers_before.append([username, list_followers, list_videos])
+                    if result:
+                        results_before.append(result)
+                elif checked:
+                    done[username] = result
+        return AnalysisCheckpoint(
+            self, row[0], row[1], row[2], json.loads(row[3]),
+            json.loads(row[4]), row[5], state
+        )
+
+    def close(self):
+        self._conn.close()
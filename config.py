@@ -11,6 +11,39 @@ class Config:
     # RapidAPI - хост можна налаштувати через .env
     RAPIDAPI_KEY = os.getenv('RAPIDAPI_KEY')
     RAPIDAPI_HOST = os.getenv('RAPIDAPI_HOST', 'tiktok-api23.p.rapidapi.com')
+    # Базова адреса API; для бенчмарку її можна направити на локальний мок-сервер
+    RAPIDAPI_BASE_URL = os.getenv(
+        'RAPIDAPI_BASE_URL', f"https://{RAPIDAPI_HOST}"
+    ).rstrip('/')
+    # Пул ключів через кому (замість RAPIDAPI_KEY): кожен ключ має власну квоту,
+    # ключ для іншого сумісного хоста записується як key@host
+    RAPIDAPI_KEYS = os.getenv('RAPIDAPI_KEYS', '')
+    # Ключ з нижчим залишком квоти отримує менше запитів
+    KEY_POOL_LOW_QUOTA = int(os.getenv('KEY_POOL_LOW_QUOTA', 100))
+    # Ключ з такою часткою помилок (після KEY_POOL_MIN_REQUESTS запитів)
+    # тимчасово виключається з пулу на KEY_POOL_EJECT_SECONDS
+    KEY_POOL_MAX_ERROR_RATE = float(os.getenv('KEY_POOL_MAX_ERROR_RATE', 0.5))
+    KEY_POOL_MIN_REQUESTS = int(os.getenv('KEY_POOL_MIN_REQUESTS', 10))
+    KEY_POOL_EJECT_SECONDS = float(os.getenv('KEY_POOL_EJECT_SECONDS', 60))
+    
+    # Прийом апдейтів Telegram: 'polling' або 'webhook'
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    # Локальний HTTP-слухач вебхука (TLS завершує зворотний проксі)
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+    # Публічна HTTPS-адреса для Telegram; без неї апдейти приймаються лише локально
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+    # Скільки з'єднань Telegram одночасно відкриває до вебхука (1-100)
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+    # Скільки секунд з'єднання вебхука може простоювати або передавати запит
+    WEBHOOK_IDLE_TIMEOUT = float(os.getenv('WEBHOOK_IDLE_TIMEOUT', 60))
+    # Скільки апдейтів обробляється одночасно і скільки може чекати обробки
+    UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 256))
+    UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', 1000))  # 0 - без обмеження
+    # Запис вхідних апдейтів (JSONL) для відтворення через webhook.py
+    UPDATE_RECORD_PATH = os.getenv('UPDATE_RECORD_PATH', '')
     
     # Налаштування аналізу за замовчуванням
     DEFAULT_MAX_FOLLOWERS = int(os.getenv('DEFAULT_MAX_FOLLOWERS', 3000))
@@ -18,9 +51,119 @@ class Config:
     DEFAULT_MIN_VIDEOS = int(os.getenv('DEFAULT_MIN_VIDEOS', 2))
     
     # Обмеження
-    MAX_FOLLOWERS_PER_SEARCH = int(os.getenv('MAX_FOLLOWERS_PER_SEARCH', 50))
+    MAX_FOLLOWERS_PER_SEARCH = int(os.getenv('MAX_FOLLOWERS_PER_SEARCH', 50))  # на сторінку
+    MAX_FOLLOWERS_TOTAL = int(os.getenv('MAX_FOLLOWERS_TOTAL', 1000))  # на один аналіз
+    BATCH_MAX_SEEDS = int(os.getenv('BATCH_MAX_SEEDS', 200))  # акаунтів у пакетному аналізі
+    
+    # HTTP-клієнт (пул keep-alive з'єднань до RapidAPI)
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 20))
+    HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_KEEPALIVE_CONNECTIONS', 10))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 20))
+    HTTP_POOL_TIMEOUT = float(os.getenv('HTTP_POOL_TIMEOUT', 30))
+    
+    # Скільки фолловерів аналізується одночасно
+    MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', 10))
+    
+    # Формат звіту за замовчуванням: xlsx, csv, jsonl або parquet
+    DEFAULT_REPORT_FORMAT = os.getenv('DEFAULT_REPORT_FORMAT', 'xlsx')
+    REPORT_PARQUET_BATCH_SIZE = int(os.getenv('REPORT_PARQUET_BATCH_SIZE', 5000))
+    
+    # Скільки перших рядків звіту враховується при підборі ширини колонок
+    REPORT_WIDTH_SAMPLE_ROWS = int(os.getenv('REPORT_WIDTH_SAMPLE_ROWS', 200))
+    # Пул процесів для збирання звітів (0 - збирати в процесі бота)
+    REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', 2))
+    # Скільки звітів може чекати на вільний процес пулу
+    REPORT_QUEUE_SIZE = int(os.getenv('REPORT_QUEUE_SIZE', 20))
+    # Розмір топу за фолловерами, що підтримується під час аналізу
+    SUMMARY_TOP_SIZE = int(os.getenv('SUMMARY_TOP_SIZE', 10))
+    
+    # Мінімальний інтервал між редагуваннями повідомлення з прогресом (сек)
+    PROGRESS_UPDATE_INTERVAL = float(os.getenv('PROGRESS_UPDATE_INTERVAL', 3))
+    
+    # Фонові задачі аналізу
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+    JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', 100))
+    JOB_HISTORY_SIZE = int(os.getenv('JOB_HISTORY_SIZE', 200))
+    # Скільки останніх активних чатів тримають сесію аналізатора в пам'яті
+    # (з STATE_BACKEND=memory у решти звільняються дані для /refilter)
+    ANALYZER_CACHE_SIZE = int(os.getenv('ANALYZER_CACHE_SIZE', 1000))
+    # Оренда задачі обробником: задачі процесу, що впав, після неї виконуються знову.
+    # Має бути набагато довшою за найдовше блокування event loop (збірка звіту
+    # з REPORT_WORKERS=0, cProfile), інакше задачу перезапустить інший процес
+    JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 120))
+    # Як часто вільні обробники перевіряють задачі інших процесів (сек)
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+    
+    # Спільний стан (діалоги, налаштування чатів, черга задач):
+    # 'memory' - один процес, 'sqlite' - кілька процесів бота на одному хості
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+    STATE_PATH = os.getenv('STATE_PATH', 'tiktok_state.sqlite3')
+    STATE_BUSY_TIMEOUT = float(os.getenv('STATE_BUSY_TIMEOUT', 5))
+    # Кількість процесів бота (більше одного - лише з webhook і STATE_BACKEND=sqlite)
+    BOT_PROCESSES = int(os.getenv('BOT_PROCESSES', 1))
+    
+    # Адаптивний ліміт запитів до RapidAPI (запитів на секунду)
+    RATE_LIMIT_RPS = float(os.getenv('RATE_LIMIT_RPS', 5))
+    RATE_LIMIT_MIN_RPS = float(os.getenv('RATE_LIMIT_MIN_RPS', 0.5))
+    RATE_LIMIT_MAX_RPS = float(os.getenv('RATE_LIMIT_MAX_RPS', 20))
+    RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 5))
+    RATE_LIMIT_INCREASE_STEP = float(os.getenv('RATE_LIMIT_INCREASE_STEP', 0.2))
+    RATE_LIMIT_PACING_WINDOW = float(os.getenv('RATE_LIMIT_PACING_WINDOW', 120))
+    RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', 5))
+    
+    # Стійкість до збоїв API: граничний час запиту по endpoint (сек),
+    # повтори тимчасових помилок (таймаут, мережа, 5xx) з експоненційною паузою
+    API_USER_INFO_TIMEOUT = float(os.getenv('API_USER_INFO_TIMEOUT', 15))
+    API_USER_FOLLOWERS_TIMEOUT = float(os.getenv('API_USER_FOLLOWERS_TIMEOUT', 30))
+    API_USER_VIDEOS_TIMEOUT = float(os.getenv('API_USER_VIDEOS_TIMEOUT', 20))
+    API_MAX_RETRIES = int(os.getenv('API_MAX_RETRIES', 3))
+    API_RETRY_BASE_DELAY = float(os.getenv('API_RETRY_BASE_DELAY', 0.5))
+    API_RETRY_MAX_DELAY = float(os.getenv('API_RETRY_MAX_DELAY', 8))
+    # Після стількох помилок поспіль запити не виконуються CIRCUIT_RESET_TIMEOUT секунд
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 10))
+    CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))
+    
+    # Локальний кеш відповідей API (SQLite), TTL у секундах
+    CACHE_ENABLED = os.getenv('CACHE_ENABLED', '1') == '1'
+    CACHE_PATH = os.getenv('CACHE_PATH', 'tiktok_cache.sqlite3')
+    CACHE_USER_INFO_TTL = int(os.getenv('CACHE_USER_INFO_TTL', 24 * 3600))
+    CACHE_USER_VIDEOS_TTL = int(os.getenv('CACHE_USER_VIDEOS_TTL', 6 * 3600))
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 50000))
+    
+    # Знімки попередніх аналізів для повторних запусків (SQLite)
+    SNAPSHOTS_ENABLED = os.getenv('SNAPSHOTS_ENABLED', '1') == '1'
+    SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'tiktok_snapshots.sqlite3')
+    SNAPSHOT_EVALUATION_TTL = int(os.getenv('SNAPSHOT_EVALUATION_TTL', 30 * 24 * 3600))
+    # Відносна зміна кількості фолловерів, після якої фолловер перевіряється знову
+    SNAPSHOT_CHANGE_THRESHOLD = float(os.getenv('SNAPSHOT_CHANGE_THRESHOLD', 0.1))
+    # Скільки перевірених фолловерів записується в знімки однією транзакцією
+    SNAPSHOT_WRITE_BATCH = int(os.getenv('SNAPSHOT_WRITE_BATCH', 200))
+    
+    # Контрольні точки аналізів: перерваний аналіз продовжується після перезапуску
+    CHECKPOINTS_ENABLED = os.getenv('CHECKPOINTS_ENABLED', '1') == '1'
+    CHECKPOINT_PATH = os.getenv('CHECKPOINT_PATH', 'tiktok_checkpoints.sqlite3')
+    # Як часто зберігати прогрес (секунди)
+    CHECKPOINT_INTERVAL = float(os.getenv('CHECKPOINT_INTERVAL', 15))
+    
+    # Метрики та логування
+    ADMIN_IDS = {
+        int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',')
+        if user_id.strip()
+    }
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 0))  # 0 - ендпоінт вимкнено
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.01))
+    LOG_BODY_LIMIT = int(os.getenv('LOG_BODY_LIMIT', 500))
+    
+    # Запис і відтворення трафіку API: '' (вимкнено), 'record' або 'replay'
+    TRAFFIC_MODE = os.getenv('TRAFFIC_MODE', '')
+    TRAFFIC_ARCHIVE = os.getenv('TRAFFIC_ARCHIVE', 'tiktok_traffic.jsonl.gz')
+    # 'original' - з записаними затримками, 'fast' - якнайшвидше
+    TRAFFIC_REPLAY_TIMING = os.getenv('TRAFFIC_REPLAY_TIMING', 'original')
     
-    # TikTok API endpoints
-    TIKTOK_USER_INFO_URL = f"https://{RAPIDAPI_HOST}/api/user/info"
-    TIKTOK_USER_FOLLOWERS_URL = f"https://{RAPIDAPI_HOST}/user/followers"
-    TIKTOK_USER_VIDEOS_URL = f"https://{RAPIDAPI_HOST}/user/videos"
+    # TikTok API endpoints (шляхи відносно RAPIDAPI_BASE_URL)
+    TIKTOK_USER_INFO_PATH = "/api/user/info"
+    TIKTOK_USER_FOLLOWERS_PATH = "/api/user/followers"
+    TIKTOK_USER_VIDEOS_PATH = "/user/videos"
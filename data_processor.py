@@ -1,104 +1,549 @@
-import pandas as pd
+import csv
+import heapq
+import io
+import json
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import logging
+from config import Config
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet-экспорт необязателен
+    pa = None
+    pq = None
 
 logger = logging.getLogger(__name__)
 
+# Колонки отчета в порядке вывода
+COLUMNS = [
+    'Никнейм',
+    'Email',
+    'Количество фолловеров',
+    'Биография',
+    'Ссылка на профиль',
+    'Всего видео',
+    'Видео с высоким просмотром'
+]
+# Пакетный анализ: дополнительно - из каких исходных аккаунтов найден
+SEEDS_COLUMN = 'Исходные аккаунты'
+BATCH_COLUMNS = COLUMNS + [SEEDS_COLUMN]
+# Отчет изменений между повторными анализами
+DIFF_COLUMNS = [
+    'Изменение',
+    'Никнейм',
+    'Email',
+    'Количество фолловеров',
+    'Было фолловеров',
+    'Видео с высоким просмотром',
+    'Было видео с высоким просмотром',
+    'Ссылка на профиль'
+]
+DIFF_LABELS = {
+    'new': 'новый',
+    'dropped': 'выбыл',
+    'changed': 'изменился'
+}
+INTEGER_COLUMNS = {
+    'Количество фолловеров',
+    'Всего видео',
+    'Видео с высоким просмотром',
+    'Было фолловеров',
+    'Было видео с высоким просмотром'
+}
 
-class DataProcessor:
-    def __init__(self):
-        self.results = []
-    
-    def add_micro_influencer(self, user_data: Dict, email: str = None):
-        """Добавляет микро-инфлюенсера в результаты"""
-        result = {
-            'Никнейм': user_data.get('uniqueId', ''),
-            'Email': email or '',
-            'Количество фолловеров': user_data.get('followerCount', 0),
-            'Биография': user_data.get('signature', ''),
-            'Ссылка на профиль': f"https://www.tiktok.com/@{user_data.get('uniqueId', '')}",
-            'Всего видео': user_data.get('videoCount', 0),
-            'Видео с высоким просмотром': 0  # Будет обновлено при анализе
+
+class ReportExporter:
+    """Базовый потоковый экспортер: строки пишутся в target по мере
+    поступления через append(), close() завершает файл.
+    
+    target - путь к файлу или бинарный файловый объект (например, BytesIO).
+    """
+    
+    extension = ''
+    
+    def __init__(self, target, columns: List[str] = None):
+        self.target = target
+        self.columns = columns or COLUMNS
+        self.rows_written = 0
+    
+    def append(self, row: List):
+        self.rows_written += 1
+        self._write_row(row)
+    
+    def _write_row(self, row: List):
+        raise NotImplementedError
+    
+    def close(self):
+        raise NotImplementedError
+
+
+class ExcelExporter(ReportExporter):
+    """Потоковая запись Excel-отчета в режиме write-only openpyxl.
+    
+    Память не растет с размером отчета. Ширина колонок должна быть
+    известна до первой строки данных, поэтому она считается по заголовку
+    и первым width_sample_rows строкам, которые до этого копятся в буфере.
+    """
+    
+    extension = 'xlsx'
+    SHEET_TITLE = 'Результаты поиска'
+    MAX_COLUMN_WIDTH = 50
+    
+    def __init__(self, target, columns: List[str] = None,
+                 width_sample_rows: int = None):
+        super().__init__(target, columns)
+        self.width_sample_rows = (
+            width_sample_rows or Config.REPORT_WIDTH_SAMPLE_ROWS
+        )
+        
+        self._workbook = openpyxl.Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet(self.SHEET_TITLE)
+        self._widths = [len(column) for column in self.columns]
+        self._buffer: List[List] = []
+        self._header_written = False
+    
+    def _write_row(self, row: List):
+        if self._header_written:
+            self._sheet.append(row)
+            return
+        
+        self._track_widths(row)
+        self._buffer.append(row)
+        if len(self._buffer) >= self.width_sample_rows:
+            self._flush_buffer()
+    
+    def close(self):
+        """Дописывает буфер и сохраняет книгу"""
+        self._flush_buffer()
+        last_column = get_column_letter(len(self.columns))
+        self._sheet.merged_cells.ranges.add(f'A1:{last_column}1')
+        self._sheet.merged_cells.ranges.add(f'A2:{last_column}2')
+        self._workbook.save(self.target)
+    
+    def _track_widths(self, row: List):
+        for i, value in enumerate(row):
+            length = len(str(value)) if value is not None else 0
+            if length > self._widths[i]:
+                self._widths[i] = length
+    
+    def _flush_buffer(self):
+        if not self._header_written:
+            self._write_header()
+        for row in self._buffer:
+            self._sheet.append(row)
+        self._buffer = []
+    
+    def _write_header(self):
+        # Ширина колонок записывается в файл до первой строки
+        for i, width in enumerate(self._widths, 1):
+            self._sheet.column_dimensions[get_column_letter(i)].width = min(
+                width + 2, self.MAX_COLUMN_WIDTH
+            )
+        
+        title = WriteOnlyCell(
+            self._sheet, value="Результаты поиска микро-инфлюенсеров TikTok"
+        )
+        title.font = openpyxl.styles.Font(size=14, bold=True)
+        self._sheet.append([title])
+        self._sheet.append([
+            f"Дата поиска: {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+        ])
+        self._sheet.append([])  # Пустая строка
+        self._sheet.append(self.columns)
+        self._header_written = True
+
+
+class CsvExporter(ReportExporter):
+    """CSV в UTF-8 с BOM, чтобы Excel правильно открывал кириллицу"""
+    
+    extension = 'csv'
+    
+    def __init__(self, target, columns: List[str] = None):
+        super().__init__(target, columns)
+        self._owns_file = isinstance(target, str)
+        raw = open(target, 'wb') if self._owns_file else target
+        self._text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(self.columns)
+    
+    def _write_row(self, row: List):
+        self._writer.writerow(row)
+    
+    def close(self):
+        self._text.flush()
+        if self._owns_file:
+            self._text.close()
+        else:
+            # Отсоединяем обертку, чтобы она не закрыла буфер
+            self._text.detach()
+
+
+class JsonlExporter(ReportExporter):
+    """JSON Lines: одна запись-объект на строку"""
+    
+    extension = 'jsonl'
+    
+    def __init__(self, target, columns: List[str] = None):
+        super().__init__(target, columns)
+        self._owns_file = isinstance(target, str)
+        self._file = open(target, 'wb') if self._owns_file else target
+    
+    def _write_row(self, row: List):
+        line = json.dumps(dict(zip(self.columns, row)), ensure_ascii=False)
+        self._file.write(line.encode('utf-8') + b'\n')
+    
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+
+
+class ParquetExporter(ReportExporter):
+    """Parquet через pyarrow (необязательная зависимость).
+    
+    Строки копятся пачками по batch_size и записываются row group'ами.
+    """
+    
+    extension = 'parquet'
+    
+    def __init__(self, target, columns: List[str] = None,
+                 batch_size: int = None):
+        if pa is None:
+            raise RuntimeError("Для экспорта в Parquet установите pyarrow")
+        super().__init__(target, columns)
+        self.batch_size = batch_size or Config.REPORT_PARQUET_BATCH_SIZE
+        self._schema = pa.schema([
+            (column, pa.int64() if column in INTEGER_COLUMNS else pa.string())
+            for column in self.columns
+        ])
+        self._writer = pq.ParquetWriter(target, self._schema)
+        self._batch: List[List] = []
+    
+    def _write_row(self, row: List):
+        self._batch.append(row)
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+    
+    def _flush(self):
+        if not self._batch:
+            return
+        table = pa.Table.from_pylist(
+            [dict(zip(self.columns, row)) for row in self._batch],
+            schema=self._schema
+        )
+        self._writer.write_table(table)
+        self._batch = []
+    
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+# Доступные форматы отчета
+EXPORTERS = {
+    exporter.extension: exporter
+    for exporter in (ExcelExporter, CsvExporter, JsonlExporter, ParquetExporter)
+    if exporter is not ParquetExporter or pa is not None
+}
+
+
+def create_exporter(report_format: str, target,
+                    columns: List[str] = None) -> ReportExporter:
+    exporter_class = EXPORTERS.get(report_format)
+    if exporter_class is None:
+        raise ValueError(
+            f"Неизвестный формат отчета: {report_format}. "
+            f"Доступны: {', '.join(EXPORTERS)}"
+        )
+    return exporter_class(target, columns)
+
+
+def build_report(report_format: str, columns: List[str],
+                 rows: Iterable[List]) -> Tuple[bytes, int]:
+    """Строит файл отчета из готовых строк: (содержимое, число строк).
+    
+    Работает только с простыми значениями, поэтому выполняется и в
+    процессе пула отчетов (см. ReportPool).
+    """
+    buffer = io.BytesIO()
+    exporter = create_exporter(report_format, buffer, columns)
+    for row in rows:
+        exporter.append(row)
+    exporter.close()
+    return buffer.getvalue(), exporter.rows_written
+
+
+class ExportedReport:
+    """Готовый отчет в памяти: буфер можно сразу передать в reply_document"""
+    
+    def __init__(self, filename: str, buffer: io.BytesIO, rows: int):
+        self.filename = filename
+        self.buffer = buffer
+        self.rows = rows
+        self.buffer.seek(0)
+    
+    @property
+    def format(self) -> str:
+        return self.filename.rsplit('.', 1)[-1]
+    
+    @property
+    def size(self) -> int:
+        return self.buffer.getbuffer().nbytes
+    
+    def save(self, path: str = None) -> str:
+        """Записывает отчет на диск (например, для отладки)"""
+        path = path or self.filename
+        with open(path, 'wb') as file:
+            file.write(self.buffer.getvalue())
+        return path
+
+
+class InfluencerRecord:
+    """Компактная запись о найденном микро-инфлюенсере"""
+    
+    __slots__ = ('username', 'email', 'follower_count', 'bio',
+                 'video_count', 'high_view_videos', 'seeds')
+    
+    def __init__(self, username: str, email: str, follower_count: int,
+                 bio: str, video_count: int, high_view_videos: int = 0,
+                 seeds: List[str] = None):
+        self.username = username
+        self.email = email
+        self.follower_count = follower_count
+        self.bio = bio
+        self.video_count = video_count
+        self.high_view_videos = high_view_videos
+        self.seeds = list(seeds) if seeds else []
+    
+    @property
+    def profile_url(self) -> str:
+        return f"https://www.tiktok.com/@{self.username}"
+    
+    def row(self) -> List:
+        """Значения в порядке COLUMNS"""
+        return [
+            self.username,
+            self.email,
+            self.follower_count,
+            self.bio,
+            self.profile_url,
+            self.video_count,
+            self.high_view_videos
+        ]
+    
+    def snapshot(self) -> Dict:
+        """Данные для снимка повторного анализа"""
+        return {
+            'email': self.email,
+            'follower_count': self.follower_count,
+            'high_view_videos': self.high_view_videos,
+            'video_count': self.video_count,
+            'bio': self.bio
         }
-        self.results.append(result)
-        logger.info(f"Добавлен микро-инфлюенсер: {result['Никнейм']}")
+    
+    def seeds_text(self) -> str:
+        return ', '.join(f"@{seed}" for seed in self.seeds)
+    
+    def as_dict(self) -> Dict:
+        result = dict(zip(COLUMNS, self.row()))
+        if self.seeds:
+            result[SEEDS_COLUMN] = self.seeds_text()
+        return result
+
+
+class DataProcessor:
+    def __init__(self, top_size: int = None, with_seeds: bool = False):
+        # with_seeds - отчет пакетного анализа с колонкой исходных аккаунтов
+        self.with_seeds = with_seeds
+        self.columns = BATCH_COLUMNS if with_seeds else COLUMNS
+        
+        # Записи в порядке добавления и индекс по никнейму
+        self.records: List[InfluencerRecord] = []
+        self._index: Dict[str, InfluencerRecord] = {}
+        self._with_email = 0
+        
+        # Топ по фолловерам поддерживается инкрементально (min-heap)
+        self.top_size = top_size or Config.SUMMARY_TOP_SIZE
+        self._top: List = []
+        self._top_dirty = False
+        self._seq = 0
+    
+    @property
+    def results(self) -> List[Dict]:
+        """Результаты в виде словарей с колонками отчета"""
+        return [record.as_dict() for record in self.records]
+    
+    def add_micro_influencer(self, user_data: Dict, email: str = None,
+                             high_view_videos: int = 0,
+                             seeds: List[str] = None):
+        """Добавляет микро-инфлюенсера в результаты.
+        
+        Повторное добавление того же никнейма обновляет существующую запись.
+        """
+        username = user_data.get('uniqueId', '')
+        follower_count = user_data.get('followerCount', 0)
+        existing = self._index.get(username)
+        if existing is not None:
+            self._with_email -= bool(existing.email)
+            if existing.follower_count != follower_count:
+                self._top_dirty = True
+            existing.email = email or ''
+            existing.follower_count = follower_count
+            existing.bio = user_data.get('signature', '')
+            existing.video_count = user_data.get('videoCount', 0)
+            existing.high_view_videos = high_view_videos
+            self._with_email += bool(existing.email)
+            for seed in seeds or []:
+                self.add_seed(username, seed)
+            return
+        
+        record = InfluencerRecord(
+            username,
+            email or '',
+            follower_count,
+            user_data.get('signature', ''),
+            user_data.get('videoCount', 0),
+            high_view_videos,
+            seeds
+        )
+        self.records.append(record)
+        self._index[username] = record
+        self._with_email += bool(record.email)
+        self._push_top(record)
+        logger.info(f"Добавлен микро-инфлюенсер: {username}")
     
     def update_video_stats(self, username: str, high_view_videos: int):
         """Обновляет статистику видео для пользователя"""
-        for result in self.results:
-            if result['Никнейм'] == username:
-                result['Видео с высоким просмотром'] = high_view_videos
-                break
+        record = self._index.get(username)
+        if record is not None:
+            record.high_view_videos = high_view_videos
     
-    def create_excel_file(self, filename: str = None) -> str:
-        """Создает Excel файл с результатами"""
-        if not self.results:
-            logger.warning("Нет данных для создания Excel файла")
+    def add_seed(self, username: str, seed: str) -> bool:
+        """Отмечает, что инфлюенсер найден и среди фолловеров seed"""
+        record = self._index.get(username)
+        if record is None:
+            return False
+        if seed not in record.seeds:
+            record.seeds.append(seed)
+        return True
+    
+    def get(self, username: str) -> Optional[InfluencerRecord]:
+        return self._index.get(username)
+    
+    def _row(self, record: InfluencerRecord) -> List:
+        row = record.row()
+        if self.with_seeds:
+            row.append(record.seeds_text())
+        return row
+    
+    def _push_top(self, record: InfluencerRecord):
+        self._seq += 1
+        # При равенстве фолловеров выше тот, кто добавлен раньше
+        item = (record.follower_count, -self._seq, record.username)
+        if len(self._top) < self.top_size:
+            heapq.heappush(self._top, item)
+        elif item > self._top[0]:
+            heapq.heapreplace(self._top, item)
+    
+    def top_by_followers(self, count: int = None) -> List[InfluencerRecord]:
+        """Топ записей по количеству фолловеров (по убыванию)"""
+        count = count or self.top_size
+        if self._top_dirty or count > self.top_size:
+            return heapq.nlargest(
+                count, self.records, key=lambda r: r.follower_count
+            )
+        return [self._index[username]
+                for _, _, username in sorted(self._top, reverse=True)][:count]
+    
+    @staticmethod
+    def report_filename(report_format: str = 'xlsx') -> str:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return f"tiktok_analysis_search_results_{timestamp}.{report_format}"
+    
+    @staticmethod
+    def diff_filename(report_format: str) -> str:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return f"tiktok_analysis_changes_{timestamp}.{report_format}"
+    
+    def report_rows(self) -> Iterator[List]:
+        """Строки отчета по убыванию фолловеров"""
+        for record in sorted(self.records, key=lambda r: r.follower_count,
+                             reverse=True):
+            yield self._row(record)
+    
+    @staticmethod
+    def diff_rows(changes: List[Dict]) -> List[List]:
+        """Строки отчета изменений (колонки DIFF_COLUMNS)"""
+        rows = []
+        for change in sorted(changes, key=lambda c: (c['change'], c['username'])):
+            now = change['now'] or {}
+            before = change['before'] or {}
+            rows.append([
+                DIFF_LABELS[change['change']],
+                change['username'],
+                now.get('email', before.get('email', '')),
+                now.get('follower_count'),
+                before.get('follower_count'),
+                now.get('high_view_videos'),
+                before.get('high_view_videos'),
+                f"https://www.tiktok.com/@{change['username']}"
+            ])
+        return rows
+    
+    def export(self, report_format: str = None) -> Optional[ExportedReport]:
+        """Выгружает все текущие результаты (по убыванию фолловеров) в память"""
+        if not self.records:
+            logger.warning("Нет данных для создания отчета")
             return None
         
-        if not filename:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"tiktok_analysis_search_results_{timestamp}.xlsx"
+        report_format = report_format or Config.DEFAULT_REPORT_FORMAT
+        try:
+            data, rows = build_report(report_format, self.columns, self.report_rows())
+            return ExportedReport(
+                self.report_filename(report_format), io.BytesIO(data), rows
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при создании отчета: {str(e)}")
+            return None
+    
+    def export_diff(self, changes: List[Dict],
+                    report_format: str = None) -> Optional[ExportedReport]:
+        """Выгружает отчет изменений с прошлого анализа (см. SnapshotStore.diff)"""
+        if not changes:
+            return None
         
+        report_format = report_format or Config.DEFAULT_REPORT_FORMAT
         try:
-            df = pd.DataFrame(self.results)
-            
-            # Сортируем по количеству фолловеров (по убыванию)
-            df = df.sort_values('Количество фолловеров', ascending=False)
-            
-            # Создаем Excel файл с форматированием
-            with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Результаты поиска', index=False)
-                
-                # Получаем workbook и worksheet для форматирования
-                workbook = writer.book
-                worksheet = writer.sheets['Результаты поиска']
-                
-                # Автоподбор ширины колонок
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
-                
-                # Добавляем заголовок
-                worksheet.insert_rows(1)
-                worksheet['A1'] = f"Результаты поиска микро-инфлюенсеров TikTok"
-                worksheet['A1'].font = openpyxl.styles.Font(size=14, bold=True)
-                worksheet.merge_cells('A1:G1')
-                
-                # Добавляем информацию о поиске
-                worksheet.insert_rows(2)
-                search_info = f"Дата поиска: {datetime.now().strftime('%d.%m.%Y %H:%M')}"
-                worksheet['A2'] = search_info
-                worksheet.merge_cells('A2:G2')
-                
-                worksheet.insert_rows(3)  # Пустая строка
-            
-            logger.info(f"Excel файл создан: {filename}")
-            return filename
-            
+            data, rows = build_report(
+                report_format, DIFF_COLUMNS, self.diff_rows(changes)
+            )
+            return ExportedReport(
+                self.diff_filename(report_format), io.BytesIO(data), rows
+            )
         except Exception as e:
-            logger.error(f"Ошибка при создании Excel файла: {str(e)}")
+            logger.error(f"Ошибка при создании отчета изменений: {str(e)}")
             return None
     
+    def create_excel_file(self, filename: str = None) -> str:
+        """Создает Excel файл со всеми текущими результатами на диске"""
+        report = self.export('xlsx')
+        if report is None:
+            return None
+        filename = report.save(filename)
+        logger.info(f"Excel файл создан: {filename}")
+        return filename
+    
     def get_results_summary(self) -> str:
         """Возвращает краткую сводку результатов"""
-        if not self.results:
+        if not self.records:
             return "❌ Микро-инфлюенсеры не найдены"
         
-        total_found = len(self.results)
-        with_email = len([r for r in self.results if r['Email']])
+        total_found = len(self.records)
+        with_email = self._with_email
         
         summary = f"""
 📊 Результаты поиска микро-инфлюенсеров TikTok
@@ -110,17 +555,17 @@ class DataProcessor:
 📱 Топ-3 по фолловерам:
 """
         
-        # Сортируем и показываем топ-3
-        sorted_results = sorted(self.results, 
-                              key=lambda x: x['Количество фолловеров'], 
-                              reverse=True)[:3]
-        
-        for i, result in enumerate(sorted_results, 1):
-            summary += f"{i}. @{result['Никнейм']} - {result['Количество фолловеров']} фолловеров\n"
+        # Показываем топ-3
+        for i, record in enumerate(self.top_by_followers(3), 1):
+            summary += f"{i}. @{record.username} - {record.follower_count} фолловеров\n"
         
         return summary.strip()
     
     def clear_results(self):
         """Очищает результаты"""
-        self.results = []
+        self.records = []
+        self._index = {}
+        self._with_email = 0
+        self._top = []
+        self._top_dirty = False
         logger.info("Результаты очищены") 
\ No newline at end of file
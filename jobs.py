@@ -0,0 +1,346 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+from config import Config
+from metrics import metrics, DURATION_BUCKETS
+from state_backend import MemoryStateBackend, StateBackend
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    """Очередь задач переполнена"""
+
+
+class AnalysisJob:
+    """Фоновая задача анализа одного аккаунта (или пакета аккаунтов).
+
+    Задача описывается данными (payload), а не замыканием, поэтому ее
+    может выполнить обработчик любого процесса бота.
+    """
+
+    # Поставлена, но еще не отдана обработчикам (см. JobManager.release)
+    NEW = 'new'
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    STATUS_LABELS = {
+        NEW: '⏳ в очереди',
+        QUEUED: '⏳ в очереди',
+        RUNNING: '🔄 выполняется',
+        DONE: '✅ завершена',
+        FAILED: '❌ ошибка',
+        CANCELLED: '🚫 отменена'
+    }
+
+    def __init__(self, job_id: Optional[int], chat_id: int, username: str,
+                 payload: Dict = None):
+        self.id = job_id
+        self.chat_id = chat_id
+        self.username = username
+        self.payload = payload or {}
+        self.status = self.QUEUED
+        self.progress = ''
+        self.error: Optional[str] = None
+        # Время по этапам (StageProfile.format) для /profile
+        self.profile: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Токен аренды этого запуска задачи (см. JobManager.confirm)
+        self.lease_token: Optional[str] = None
+        # Аренду перехватил другой обработчик: этот запуск ничего не
+        # сохраняет и не отправляет
+        self.lost = False
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.DONE, self.FAILED, self.CANCELLED)
+
+    def describe(self) -> str:
+        """Строка для /jobs и /status"""
+        text = f"#{self.id} @{self.username} — {self.STATUS_LABELS[self.status]}"
+        if self.started_at:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            text += f" ({elapsed:.0f} с)"
+        if self.status == self.RUNNING and self.progress:
+            text += f"\n{self.progress}"
+        if self.error:
+            text += f"\n{self.error}"
+        return text
+
+    def to_record(self) -> Dict:
+        return {
+            'chat_id': self.chat_id,
+            'username': self.username,
+            'status': self.status,
+            'payload': self.payload,
+            'created_at': self.created_at
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict) -> 'AnalysisJob':
+        job = cls(record['id'], record['chat_id'], record['username'],
+                  record['payload'])
+        job.status = record['status']
+        job.progress = record.get('progress') or ''
+        job.error = record.get('error')
+        job.profile = record.get('profile')
+        job.created_at = record['created_at']
+        job.started_at = record.get('started_at')
+        job.finished_at = record.get('finished_at')
+        job.lease_token = record.get('worker')
+        return job
+
+
+class JobManager:
+    """Очередь задач анализа и пул обработчиков.
+
+    Очередь хранится в бэкенде состояния: с общим бэкендом (SQLite)
+    задачи, поставленные любым процессом бота, забирают свободные
+    обработчики всех процессов. Обработчик продлевает аренду своих задач;
+    задачи упавшего процесса после истечения аренды выполняются заново
+    (с контрольной точкой - с места остановки). Одновременно в процессе
+    выполняется не больше workers задач.
+    """
+
+    def __init__(self, workers: int = None, max_queue: int = None,
+                 history_size: int = None, backend: StateBackend = None):
+        self.workers = workers or Config.JOB_WORKERS
+        self.max_queue = max_queue or Config.JOB_QUEUE_SIZE
+        self.history_size = history_size or Config.JOB_HISTORY_SIZE
+        self.backend = backend or MemoryStateBackend()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # Выполняет задачу; задается до start()
+        self.runner: Optional[Callable[[AnalysisJob], Awaitable]] = None
+        # Задачи, выполняющиеся в этом процессе
+        self._running: Dict[int, AnalysisJob] = {}
+        self._wakeup = asyncio.Event()
+        self._worker_tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    @property
+    def stopping(self) -> bool:
+        """Идет остановка: задачи отменяются не пользователем"""
+        return self._stopping
+
+    async def start(self):
+        """Запускает обработчики (нужен работающий event loop)"""
+        if self._worker_tasks:
+            return
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(n)) for n in range(self.workers)
+        ]
+        self._worker_tasks.append(asyncio.create_task(self._heartbeat()))
+        logger.info(f"Запущено обработчиков задач: {self.workers}")
+
+    async def stop(self):
+        """Отменяет выполняющиеся задачи и останавливает обработчики"""
+        self._stopping = True
+        for job in self._running.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+        for worker in self._worker_tasks:
+            worker.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(self, chat_id: int, username: str, payload: Dict,
+               hold: bool = False) -> AnalysisJob:
+        """Ставит задачу в очередь; при переполнении бросает JobQueueFull.
+        
+        С hold=True задача занимает место в очереди, но обработчики не
+        получат ее до release() (например, пока не создано сообщение
+        для прогресса).
+        """
+        job = AnalysisJob(None, chat_id, username, payload)
+        if hold:
+            job.status = AnalysisJob.NEW
+        job.id = self.backend.add_job(job.to_record(), self.max_queue)
+        if job.id is None:
+            raise JobQueueFull(
+                f"В очереди уже {self.max_queue} задач, попробуйте позже"
+            )
+        self.backend.prune_jobs(
+            self.history_size,
+            (AnalysisJob.DONE, AnalysisJob.FAILED, AnalysisJob.CANCELLED)
+        )
+        self._wakeup.set()
+        logger.info(f"Задача #{job.id} (@{username}) поставлена в очередь")
+        return job
+
+    def release(self, job: AnalysisJob):
+        """Отдает обработчикам задачу, поставленную с hold=True"""
+        job.status = AnalysisJob.QUEUED
+        self.backend.update_job(job.id, status=job.status, payload=job.payload)
+        self._wakeup.set()
+
+    def save_payload(self, job: AnalysisJob):
+        """Сохраняет изменения payload (например, номер контрольной точки)"""
+        self.backend.update_job(job.id, payload=job.payload)
+
+    def get(self, job_id: int) -> Optional[AnalysisJob]:
+        if job_id in self._running:
+            return self._running[job_id]
+        record = self.backend.get_job(job_id)
+        return AnalysisJob.from_record(record) if record else None
+
+    def list_jobs(self, chat_id: int = None) -> List[AnalysisJob]:
+        return [
+            self._running.get(record['id']) or AnalysisJob.from_record(record)
+            for record in self.backend.list_jobs(chat_id)
+        ]
+
+    def queue_position(self, job: AnalysisJob) -> int:
+        """Позиция задачи в очереди (1 - следующая), 0 если уже не в очереди"""
+        return self.backend.queue_position(job.id)
+
+    def confirm(self, job: AnalysisJob) -> bool:
+        """Проверяет, что задача все еще за этим запуском, и продлевает
+        аренду. Если цикл событий простоял дольше аренды, задачу мог
+        забрать и выполнить заново другой обработчик: тогда результаты
+        отправит и сохранит он.
+        """
+        if job.lost:
+            return False
+        if self.backend.confirm_job(job.id, job.lease_token, Config.JOB_LEASE_SECONDS):
+            return True
+        logger.warning(
+            f"Задача #{job.id} (@{job.username}): аренда истекла, "
+            "задачу выполняет другой обработчик"
+        )
+        job.lost = True
+        return False
+
+    def cancel(self, job_id: int) -> bool:
+        """Отменяет задачу в очереди или выполняющуюся задачу (в том числе
+        в другом процессе - она отменится при следующем продлении аренды)"""
+        job = self._running.get(job_id)
+        if job is not None and job.task is not None:
+            job.task.cancel()
+            return True
+        result = self.backend.cancel_job(job_id)
+        if result == 'cancelled':
+            metrics.inc('analysis_jobs_total', status=AnalysisJob.CANCELLED)
+            logger.info(f"Задача #{job_id}: {AnalysisJob.CANCELLED}")
+        return result is not None
+
+    async def _worker(self, number: int):
+        while True:
+            self._wakeup.clear()
+            # Токен у каждого забора свой: задачу, перехваченную другим
+            # обработчиком того же процесса, прежний запуск тоже не тронет
+            record = self.backend.claim_job(
+                f"{self.worker_id}:{uuid.uuid4().hex[:12]}", Config.JOB_LEASE_SECONDS
+            )
+            if record is None:
+                # Задачи других процессов появляются без уведомления
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), Config.JOB_POLL_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(AnalysisJob.from_record(record))
+
+    async def _heartbeat(self):
+        """Продлевает аренду своих задач, сохраняет их прогресс
+        и отменяет задачи, отмену которых запросили другие процессы,
+        и задачи, аренду которых уже перехватил другой обработчик"""
+        interval = Config.JOB_LEASE_SECONDS / 3
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            stalled = time.monotonic() - started - interval
+            if stalled > interval:
+                # Еще немного - и аренду заберут другие процессы
+                logger.warning(
+                    f"[Jobs] Цикл событий был занят {stalled:.1f} с, "
+                    f"аренда задач - {Config.JOB_LEASE_SECONDS:.0f} с; "
+                    "увеличьте JOB_LEASE_SECONDS"
+                )
+            cancelled, lost = self.backend.renew_jobs(
+                {job_id: (job.lease_token, job.progress)
+                 for job_id, job in self._running.items()},
+                Config.JOB_LEASE_SECONDS
+            )
+            for job_id in lost:
+                job = self._running.get(job_id)
+                if job is not None:
+                    self._abandon(job)
+            for job_id in cancelled:
+                job = self._running.get(job_id)
+                if job is not None and job.task is not None:
+                    job.task.cancel()
+
+    def _abandon(self, job: AnalysisJob):
+        """Останавливает запуск задачи, аренду которой забрал другой обработчик"""
+        if not job.lost:
+            logger.warning(
+                f"Задача #{job.id} (@{job.username}): аренда истекла, "
+                "задачу выполняет другой обработчик"
+            )
+            job.lost = True
+        if job.task is not None:
+            job.task.cancel()
+
+    async def _execute(self, job: AnalysisJob):
+        previous = self._running.get(job.id)
+        if previous is not None:
+            # Прежний запуск в этом процессе простоял дольше аренды
+            self._abandon(previous)
+        self._running[job.id] = job
+        job.task = asyncio.ensure_future(self.runner(job))
+        try:
+            await job.task
+            if self.confirm(job):
+                self._finish(
+                    job, AnalysisJob.FAILED if job.error else AnalysisJob.DONE
+                )
+        except asyncio.CancelledError:
+            # Задачу, перехваченную другим процессом, не трогаем
+            owned = self.confirm(job)
+            if owned and (self._stopping and self.backend.shared
+                          and job.payload.get('checkpoint_id')):
+                # Продолжит другой процесс или этот после перезапуска
+                self.backend.update_job(
+                    job.id, status=AnalysisJob.QUEUED, worker=None,
+                    started_at=None, progress='', payload=job.payload
+                )
+                logger.info(f"Задача #{job.id} (@{job.username}) возвращена в очередь")
+            elif owned:
+                self._finish(job, AnalysisJob.CANCELLED)
+            if self._stopping:
+                raise  # останавливается сам обработчик
+        except Exception as e:
+            logger.error(f"Ошибка в задаче #{job.id}: {e}")
+            job.error = str(e)
+            if self.confirm(job):
+                self._finish(job, AnalysisJob.FAILED)
+        finally:
+            if self._running.get(job.id) is job:
+                del self._running[job.id]
+
+    def _finish(self, job: AnalysisJob, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        self.backend.update_job(
+            job.id, status=status, finished_at=job.finished_at,
+            progress=job.progress, error=job.error, profile=job.profile,
+            worker=None
+        )
+        metrics.inc('analysis_jobs_total', status=status)
+        if job.started_at:
+            metrics.observe('analysis_job_seconds',
+                            job.finished_at - job.started_at,
+                            DURATION_BUCKETS, status=status)
+        logger.info(f"Задача #{job.id} (@{job.username}): {status}")
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Mapping, Optional
+from config import Config
+from rate_limiter import AdaptiveRateLimiter, parse_quota
+
+logger = logging.getLogger(__name__)
+
+# Доля новой попытки в скользящей оценке доли ошибок ключа
+ERROR_RATE_WEIGHT = 0.2
+# Ниже этой доли пропускной способности ключ не опускается при выборе
+MIN_CAPACITY_FACTOR = 0.05
+# Ответы, означающие, что ключ не подходит (неверный или без подписки)
+KEY_REJECTED_STATUS_CODES = {401, 403}
+
+
+class ApiKey:
+    """Ключ RapidAPI: свой хост, лимитер квоты и статистика использования"""
+
+    def __init__(self, key: Optional[str], host: str, base_url: str,
+                 rate_limiter: AdaptiveRateLimiter = None):
+        self.key = key
+        self.host = host
+        self.base_url = base_url.rstrip('/')
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        # Сам ключ в отчеты и логи не попадает
+        self.name = f"…{key[-4:]}@{host}" if key else f"без ключа@{host}"
+
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.ejections = 0
+        self.pending = 0
+        self.error_rate = 0.0
+        self.remaining: Optional[float] = None
+        self.ejected_until = 0.0
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {"X-RapidAPI-Host": self.host}
+        if self.key:
+            headers["X-RapidAPI-Key"] = self.key
+        return headers
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+    def capacity(self) -> float:
+        """Ожидаемая пропускная способность ключа (запросов в секунду)
+        с учетом доли ошибок и остатка квоты"""
+        factor = 1.0 - self.error_rate
+        if self.remaining is not None and Config.KEY_POOL_LOW_QUOTA:
+            factor *= min(1.0, self.remaining / Config.KEY_POOL_LOW_QUOTA)
+        return self.rate_limiter.rate * max(factor, MIN_CAPACITY_FACTOR)
+
+    def eject(self, seconds: float, reason: str):
+        self.ejected_until = max(self.ejected_until, time.monotonic() + seconds)
+        self.ejections += 1
+        logger.warning(
+            f"[KeyPool] Ключ {self.name} исключен на {seconds:.1f} с: {reason}"
+        )
+
+    def _record(self, failed: bool):
+        self.error_rate += ERROR_RATE_WEIGHT * (float(failed) - self.error_rate)
+        if failed:
+            self.errors += 1
+
+
+class KeyPool:
+    """Пул ключей RapidAPI (и совместимых хостов).
+
+    У каждого ключа свой лимитер, поэтому с каждым ключом растет общая
+    пропускная способность. Запрос получает ключ с наименьшей очередью
+    относительно его пропускной способности (см. ApiKey.capacity).
+    Исчерпавший квоту, получивший 429 или часто ошибающийся ключ временно
+    исключается из выбора.
+    """
+
+    def __init__(self, keys: List[ApiKey]):
+        if not keys:
+            raise ValueError("Пул ключей RapidAPI пуст")
+        self.keys = keys
+
+    @classmethod
+    def from_config(cls, base_url: str = None, rate: float = None,
+                    max_rate: float = None) -> 'KeyPool':
+        """Ключи из RAPIDAPI_KEYS (или RAPIDAPI_KEY).
+
+        Ключ для другого совместимого хоста задается как key@host.
+        base_url (мок, тесты) заменяет адрес для всех ключей.
+        """
+        entries = [
+            entry.strip() for entry in Config.RAPIDAPI_KEYS.split(',')
+            if entry.strip()
+        ] or [Config.RAPIDAPI_KEY]
+
+        keys = []
+        for entry in entries:
+            key, _, host = (entry or '').partition('@')
+            host = host or Config.RAPIDAPI_HOST
+            if base_url:
+                key_base_url = base_url
+            elif host == Config.RAPIDAPI_HOST:
+                key_base_url = Config.RAPIDAPI_BASE_URL
+            else:
+                key_base_url = f"https://{host}"
+            keys.append(ApiKey(
+                key or None, host, key_base_url,
+                AdaptiveRateLimiter(rate=rate, max_rate=max_rate)
+            ))
+        return cls(keys)
+
+    def _choose(self) -> Optional[ApiKey]:
+        now = time.monotonic()
+        available = [key for key in self.keys if not key.is_ejected(now)]
+        if not available:
+            return None
+        return min(available, key=lambda key: (key.pending + 1) / key.capacity())
+
+    async def acquire(self) -> ApiKey:
+        """Выбирает ключ и ждет его лимитер; после запроса нужен release()"""
+        while True:
+            key = self._choose()
+            if key is not None:
+                break
+            # Все ключи исключены - ждем, пока вернется первый
+            wait = min(key.ejected_until for key in self.keys) - time.monotonic()
+            await asyncio.sleep(max(wait, 0.01))
+
+        key.pending += 1
+        try:
+            await key.rate_limiter.acquire()
+        except BaseException:
+            key.pending -= 1
+            raise
+        key.requests += 1
+        return key
+
+    def release(self, key: ApiKey):
+        key.pending -= 1
+
+    def on_response(self, key: ApiKey, status_code: int,
+                    headers: Mapping[str, str]) -> bool:
+        """Учитывает ответ (не 429): квоту из заголовков и ошибки ключа.
+
+        Возвращает True, если ключ отклонен API (401/403) и запрос стоит
+        повторить с другим ключом пула. Последний доступный ключ не
+        исключается: ошибка сразу возвращается вызывающему, а не
+        задерживает все запросы на KEY_POOL_EJECT_SECONDS.
+        """
+        if status_code in KEY_REJECTED_STATUS_CODES:
+            key._record(True)
+            now = time.monotonic()
+            if not any(other is not key and not other.is_ejected(now)
+                       for other in self.keys):
+                return False
+            key.eject(Config.KEY_POOL_EJECT_SECONDS, f"ответ {status_code}")
+            return True
+
+        key.rate_limiter.on_response(headers)
+        remaining, reset = parse_quota(headers)
+        if remaining is not None:
+            key.remaining = remaining
+            if remaining <= 0:
+                key.eject(reset or Config.KEY_POOL_EJECT_SECONDS, "квота исчерпана")
+        key._record(False)
+        return False
+
+    def on_throttled(self, key: ApiKey, headers: Mapping[str, str]) -> float:
+        """Обрабатывает 429: ключ исключается до конца паузы"""
+        key.throttled += 1
+        delay = key.rate_limiter.on_throttled(headers)
+        key.eject(delay, "429")
+        return delay
+
+    def on_failure(self, key: ApiKey):
+        """Временная ошибка (таймаут, сетевой сбой, 5xx) при запросе с ключом"""
+        key._record(True)
+        if (key.requests >= Config.KEY_POOL_MIN_REQUESTS
+                and key.error_rate >= Config.KEY_POOL_MAX_ERROR_RATE
+                and len(self.keys) > 1):
+            key.eject(
+                Config.KEY_POOL_EJECT_SECONDS,
+                f"доля ошибок {key.error_rate:.0%}"
+            )
+            # После возвращения ключ получает шанс восстановиться
+            key.error_rate = Config.KEY_POOL_MAX_ERROR_RATE / 2
+
+    def usage(self) -> List[Dict]:
+        """Использование ключей для /stats и бенчмарка"""
+        now = time.monotonic()
+        return [
+            {
+                'key': key.name,
+                'requests': key.requests,
+                'errors': key.errors,
+                'throttled': key.throttled,
+                'error_rate': key.error_rate,
+                'remaining': key.remaining,
+                'rate': key.rate_limiter.rate,
+                'ejections': key.ejections,
+                'ejected_for': max(0.0, key.ejected_until - now)
+            }
+            for key in self.keys
+        ]
@@ -0,0 +1,173 @@
+import asyncio
+import bisect
+import logging
+import random
+from typing import Dict, List, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _render_labels(key: LabelKey, extra: str = '') -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин (как в Prometheus)"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя - +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower  # выше последней границы точнее не оценить
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """Реестр счетчиков и гистограмм процесса"""
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self.help: Dict[str, str] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float,
+                buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = _label_key(labels)
+        if key not in series:
+            series[key] = Histogram(buckets)
+        series[key].observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        return self.counters.get(name, {}).get(_label_key(labels), 0)
+
+    def label_values(self, name: str, label: str) -> List[str]:
+        """Все значения метки у счетчиков и гистограмм с этим именем"""
+        keys = list(self.counters.get(name, {})) + list(self.histograms.get(name, {}))
+        values = {dict(key).get(label) for key in keys}
+        return sorted(v for v in values if v is not None)
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+    def render_prometheus(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{_render_labels(key)} {value}")
+
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in series.items():
+                cumulative = 0
+                bounds = [str(b) for b in histogram.buckets] + ['+Inf']
+                for bound, bucket_count in zip(bounds, histogram.counts):
+                    cumulative += bucket_count
+                    labels = _render_labels(key, f'le="{bound}"')
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                lines.append(f"{name}_sum{_render_labels(key)} {histogram.sum}")
+                lines.append(f"{name}_count{_render_labels(key)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+# Метрики процесса бота
+metrics = Metrics()
+
+
+def log_sampled(log: logging.Logger, message: str, body: str = None):
+    """Пишет в DEBUG-лог только часть сообщений (LOG_SAMPLE_RATE),
+    обрезая тело ответа до LOG_BODY_LIMIT символов"""
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= Config.LOG_SAMPLE_RATE:
+        return
+    if body is not None:
+        message = f"{message}, body={truncate(body)}"
+    log.debug(message)
+
+
+def truncate(text, limit: int = None) -> str:
+    """Обрезает длинный текст (тело ответа API) для логов"""
+    limit = limit or Config.LOG_BODY_LIMIT
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... (+{len(text) - limit} символов)"
+
+
+async def start_metrics_server(host: str = None,
+                               port: int = None) -> Optional[asyncio.AbstractServer]:
+    """Запускает локальный HTTP-эндпоинт /metrics (если задан METRICS_PORT)"""
+    host = host or Config.METRICS_HOST
+    port = port if port is not None else Config.METRICS_PORT
+    if not port:
+        return None
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            # Заголовки запроса не нужны, но их надо дочитать
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1] == '/metrics':
+                status, body = '200 OK', metrics.render_prometheus()
+            else:
+                status, body = '404 Not Found', 'not found\n'
+            payload = body.encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"Ошибка эндпоинта метрик: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Метрики Prometheus: http://{host}:{port}/metrics")
+    return server
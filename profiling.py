@@ -0,0 +1,127 @@
+import cProfile
+import io
+import pstats
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, List
+
+
+class StageProfile:
+    """Время по этапам одного анализа: каждое измерение сохраняется,
+    в сводке - количество, сумма, p50 и p95 по этапу"""
+
+    STAGE_LABELS = {
+        'seed_lookup': 'Поиск аккаунта',
+        'follower_paging': 'Ожидание страниц фолловеров',
+        'info_fetch': 'Профили фолловеров',
+        'video_fetch': 'Видео фолловеров',
+        'criteria': 'Проверка критериев',
+        'report_write': 'Запись отчета',
+        'upload': 'Отправка отчета'
+    }
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    def record(self, stage: str, seconds: float):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def measure(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    async def measure_stream(self, stage: str,
+                             stream: AsyncIterator) -> AsyncIterator:
+        """Оборачивает асинхронный поток, измеряя ожидание каждого элемента"""
+        iterator = stream.__aiter__()
+        while True:
+            started = time.perf_counter()
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                self.record(stage, time.perf_counter() - started)
+                return
+            self.record(stage, time.perf_counter() - started)
+            yield item
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    @property
+    def wall_time(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @staticmethod
+    def _percentile(sorted_values: List[float], q: float) -> float:
+        index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+        return sorted_values[index]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for stage, values in self.samples.items():
+            ordered = sorted(values)
+            result[stage] = {
+                'count': len(ordered),
+                'total': sum(ordered),
+                'p50': self._percentile(ordered, 0.5),
+                'p95': self._percentile(ordered, 0.95)
+            }
+        return result
+
+    def format(self) -> str:
+        """Текст для /profile"""
+        lines = [f"⏱ Профиль анализа (всего {self.wall_time:.1f} с):"]
+        summary = self.summary()
+        for stage, label in self.STAGE_LABELS.items():
+            if stage not in summary:
+                continue
+            stats = summary[stage]
+            lines.append(
+                f"• {label}: {stats['count']} раз, сумма {stats['total']:.2f} с, "
+                f"p50 {stats['p50'] * 1000:.0f} мс, p95 {stats['p95'] * 1000:.0f} мс"
+            )
+        return "\n".join(lines)
+
+
+class CProfileHook:
+    """cProfile на время одной задачи.
+
+    Профилировщик работает на уровне потока, поэтому в отчет попадает
+    весь код event loop за это время, включая другие задачи. Одновременно
+    может быть включен только один профилировщик.
+    """
+
+    _active = False
+
+    def __init__(self, limit: int = 40):
+        self.limit = limit
+        self._profile = cProfile.Profile()
+
+    @classmethod
+    def is_busy(cls) -> bool:
+        return cls._active
+
+    def __enter__(self):
+        if CProfileHook._active:
+            raise RuntimeError("cProfile уже запущен для другой задачи")
+        CProfileHook._active = True
+        self._profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self._profile.disable()
+        CProfileHook._active = False
+        return False
+
+    def report(self) -> bytes:
+        """Топ функций по накопленному времени в текстовом виде"""
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(self.limit)
+        return stream.getvalue().encode('utf-8')
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressReporter:
+    """Объединяет частые обновления прогресса в редкие правки сообщения.
+
+    Отправляется не больше одной правки за interval секунд, всегда
+    последний текст; правка пропускается, если текст не изменился.
+    finish() отменяет отложенную правку и гарантированно доставляет
+    итоговый текст (с повтором при flood-ограничении Telegram).
+    """
+
+    FINAL_ATTEMPTS = 3
+
+    def __init__(self, send: Callable[[str], Awaitable], interval: float = None):
+        self._send = send
+        self.interval = Config.PROGRESS_UPDATE_INTERVAL if interval is None else interval
+        self._latest: Optional[str] = None
+        self._last_sent: Optional[str] = None
+        self._next_allowed = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+        self.updates_count = 0
+        self.sent_count = 0
+
+    async def update(self, text: str):
+        """Запоминает новый текст; правка будет отправлена не раньше интервала"""
+        self.updates_count += 1
+        self._latest = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._flush_later())
+
+    async def finish(self, text: str = None):
+        """Отправляет итоговый текст (или последний накопленный)"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if text is not None:
+            self._latest = text
+
+        for _ in range(self.FINAL_ATTEMPTS):
+            retry_after = await self._send_latest()
+            if not retry_after:
+                return
+            await asyncio.sleep(retry_after)
+
+    async def _flush_later(self):
+        delay = self._next_allowed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._send_latest()
+
+    async def _send_latest(self) -> Optional[float]:
+        """Отправляет последний текст; при flood-ограничении возвращает паузу"""
+        text = self._latest
+        if text is None or text == self._last_sent:
+            return None
+
+        retry_after = None
+        try:
+            await self._send(text)
+            self._last_sent = text
+            self.sent_count += 1
+        except Exception as e:
+            # telegram.error.RetryAfter сообщает, сколько ждать
+            retry_after = getattr(e, 'retry_after', None)
+            if hasattr(retry_after, 'total_seconds'):
+                retry_after = retry_after.total_seconds()
+            logger.debug(f"Не удалось обновить прогресс: {e}")
+        finally:
+            self._next_allowed = time.monotonic() + max(
+                self.interval, retry_after or 0
+            )
+        return retry_after
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def parse_quota(headers: Mapping[str, str]):
+    """Возвращает (остаток запросов, секунд до сброса) самой узкой квоты"""
+    buckets = {}
+    for name, value in headers.items():
+        name = name.lower()
+        if not name.startswith('x-ratelimit'):
+            continue
+        prefix, _, field = name.rpartition('-')
+        if field not in ('remaining', 'reset'):
+            continue
+        try:
+            buckets.setdefault(prefix, {})[field] = float(value)
+        except (TypeError, ValueError):
+            continue
+
+    quotas = [b for b in buckets.values() if 'remaining' in b]
+    if not quotas:
+        return None, None
+    tightest = min(quotas, key=lambda b: b['remaining'])
+    return tightest['remaining'], tightest.get('reset')
+
+
+class AdaptiveRateLimiter:
+    """Token bucket, скорость которого подстраивается под квоту RapidAPI.
+
+    После каждого ответа читаются заголовки X-RateLimit-*-Remaining/Reset:
+    для коротких окон оставшиеся запросы равномерно распределяются до сброса
+    квоты, при исчерпании квоты запросы ждут ее сброса. Ответ 429
+    вдвое снижает скорость и приостанавливает запросы на Retry-After,
+    а успешные ответы без заголовков постепенно возвращают скорость вверх.
+    """
+
+    def __init__(self, rate: float = None, max_rate: float = None,
+                 min_rate: float = None, burst: int = None):
+        self.max_rate = max_rate or Config.RATE_LIMIT_MAX_RPS
+        self.min_rate = min_rate or Config.RATE_LIMIT_MIN_RPS
+        self.rate = min(rate or Config.RATE_LIMIT_RPS, self.max_rate)
+        self.burst = burst or Config.RATE_LIMIT_BURST
+        self.increase_step = Config.RATE_LIMIT_INCREASE_STEP
+        self.pacing_window = Config.RATE_LIMIT_PACING_WINDOW
+
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+        self.throttled_count = 0
+
+    def _refill(self, now: float):
+        elapsed = max(0.0, now - self._updated_at)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        """Ждет свободный токен (очередь ожидающих обслуживается по порядку)"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_response(self, headers: Mapping[str, str]):
+        """Подстраивает скорость по заголовкам успешного ответа"""
+        remaining, reset = parse_quota(headers)
+
+        if remaining is not None and remaining <= 0:
+            # Квота исчерпана - ждем ее сброса
+            self._pause(reset or 1.0 / self.min_rate)
+            self._set_rate(self.min_rate)
+        elif remaining is not None and reset and reset <= self.pacing_window:
+            # Короткое окно (секунды/минуты): распределяем остаток равномерно
+            self._set_rate(remaining / reset)
+        else:
+            self._set_rate(self.rate + self.increase_step)
+
+    def on_throttled(self, headers: Mapping[str, str]) -> float:
+        """Обрабатывает 429: снижает скорость и возвращает паузу в секундах"""
+        self.throttled_count += 1
+        self._set_rate(self.rate / 2)
+
+        delay = self._parse_retry_after(headers.get('Retry-After'))
+        if delay is None:
+            _, reset = parse_quota(headers)
+            delay = reset if reset else 1.0 / self.rate
+        self._pause(delay)
+
+        logger.warning(
+            f"[RateLimiter] 429 от API, пауза {delay:.1f} с, "
+            f"скорость снижена до {self.rate:.2f} запр/с"
+        )
+        return delay
+
+    def _set_rate(self, rate: float):
+        self._refill(time.monotonic())
+        self.rate = max(self.min_rate, min(self.max_rate, rate))
+
+    def _pause(self, delay: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        self._tokens = 0.0
+        self._updated_at = self._paused_until
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
@@ -0,0 +1,103 @@
+import time
+from typing import Dict, List, Optional, Tuple
+from snapshot_store import SnapshotStore
+
+
+class FollowerRawData:
+    """Сырые данные фолловеров последнего анализа.
+
+    Для каждого фолловера хранятся числа из списка фолловеров, профиль
+    (если его запрашивали) и просмотры видео (если их запрашивали).
+    По ним можно заново применить критерии с другими настройками,
+    не обращаясь к API. Фолловеры, которые при новых настройках требуют
+    еще не загруженных данных, считаются отдельно.
+    """
+
+    def __init__(self, seeds: List[str], batch: bool = False):
+        self.seeds = seeds
+        self.batch = batch
+        self.created_at = time.time()
+        # Исходные аккаунты каждого фолловера (только для пакетного анализа)
+        self.follower_seeds: Dict[str, List[str]] = {}
+        # Никнейм в нижнем регистре -> [никнейм, фолловеры, видео, профиль, просмотры]
+        self._followers: Dict[str, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._followers)
+
+    def to_state(self) -> Dict:
+        """Данные для бэкенда состояния (сериализуются в JSON)"""
+        return {
+            'seeds': self.seeds,
+            'batch': self.batch,
+            'created_at': self.created_at,
+            'follower_seeds': self.follower_seeds,
+            'followers': self._followers
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'FollowerRawData':
+        raw = cls(state['seeds'], state['batch'])
+        raw.created_at = state['created_at']
+        raw.follower_seeds = state['follower_seeds']
+        raw._followers = state['followers']
+        return raw
+
+    def add(self, username: str, list_followers: Optional[int],
+            list_videos: Optional[int]):
+        self._followers[username.lower()] = [
+            username, list_followers, list_videos, None, None
+        ]
+
+    def set_info(self, username: str, follower_info: Dict):
+        entry = self._followers.get(username.lower())
+        if entry is not None:
+            entry[3] = SnapshotStore.compact_info(follower_info)
+
+    def set_play_counts(self, username: str, play_counts: List[int]):
+        entry = self._followers.get(username.lower())
+        if entry is not None:
+            entry[4] = list(play_counts)
+
+    def get(self, username: str) -> Tuple[Optional[Dict], Optional[List[int]]]:
+        """Профиль и просмотры видео фолловера (None - не загружались)"""
+        entry = self._followers.get(username.lower())
+        if entry is None:
+            return None, None
+        return entry[3], entry[4]
+
+    def evaluate(self, api, settings: Dict) -> Tuple[List[Tuple], int]:
+        """Применяет критерии к сохраненным данным.
+
+        Возвращает найденных микро-инфлюенсеров в исходном порядке
+        ((профиль, email, видео с высокими просмотрами), как при анализе)
+        и число фолловеров, для проверки которых данных не хватает.
+        """
+        max_followers = settings['max_followers']
+        min_views = settings['min_views']
+        min_videos = settings['min_videos']
+
+        evaluations = []
+        missing = 0
+        for _, list_followers, list_videos, info, play_counts in self._followers.values():
+            list_stats = {'followerCount': list_followers, 'videoCount': list_videos}
+            if not api.check_cheap_criteria(list_stats, max_followers, min_videos):
+                continue
+            if info is None:
+                missing += 1
+                continue
+            if not api.check_cheap_criteria(info, max_followers, min_videos):
+                continue
+            if play_counts is None:
+                missing += 1
+                continue
+
+            videos = [{'playCount': count} for count in play_counts]
+            if not api.check_micro_influencer_criteria(
+                info, videos, max_followers, min_views, min_videos
+            ):
+                continue
+            email = api.extract_email_from_bio(info.get('signature', ''))
+            high_view_videos = sum(1 for count in play_counts if count >= min_views)
+            evaluations.append((info, email, high_view_videos))
+        return evaluations, missing
@@ -0,0 +1,160 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import Config
+from data_processor import (
+    DataProcessor, ExportedReport, DIFF_COLUMNS, build_report
+)
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Строк в одном сериализованном блоке; между блоками event loop
+# успевает обработать другие задачи
+ROW_CHUNK_SIZE = 2000
+
+
+async def pack_rows(rows: Iterable[List]) -> List[bytes]:
+    """Сериализует строки отчета блоками по ROW_CHUNK_SIZE.
+    
+    Пулу передаются готовые байты: их пересылка почти не занимает
+    event loop и поток отправки задач пула.
+    """
+    chunks, chunk = [], []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= ROW_CHUNK_SIZE:
+            chunks.append(pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL))
+            chunk = []
+            await asyncio.sleep(0)
+    if chunk:
+        chunks.append(pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL))
+    return chunks
+
+
+def build_packed_report(report_format: str, columns: List[str],
+                        chunks: List[bytes]) -> Tuple[bytes, int]:
+    """Строит отчет из блоков pack_rows (выполняется в процессе пула)"""
+    rows = (row for chunk in chunks for row in pickle.loads(chunk))
+    return build_report(report_format, columns, rows)
+
+
+class ReportPool:
+    """Пул процессов для сборки отчетов.
+
+    Сборка xlsx (openpyxl) занимает процессор на секунды и блокировала бы
+    event loop бота: апдейты и прогресс других задач ждали бы ее
+    окончания. В процесс пула передаются только строки отчета (списки
+    простых значений, см. pack_rows), обратно возвращается готовый файл.
+
+    Одновременно собирается не больше workers отчетов, еще queue_size
+    ждут свободного процесса; остальные вызовы ждут места в очереди.
+    С workers=0 отчеты собираются в текущем процессе, как раньше.
+    """
+
+    def __init__(self, workers: int = None, queue_size: int = None):
+        self.workers = Config.REPORT_WORKERS if workers is None else workers
+        self.queue_size = (
+            Config.REPORT_QUEUE_SIZE if queue_size is None else queue_size
+        )
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Процессы создаются при первом отчете; spawn - чтобы не копировать
+        # в них event loop и соединения бота
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            logger.info(f"[Reports] Запущен пул отчетов: {self.workers} процессов")
+        return self._executor
+
+    async def _build(self, report_format: str, columns: List[str],
+                     rows: Iterable[List]) -> Optional[Tuple[bytes, int]]:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+        async with self._slots:
+            # Строки сериализуются только после получения места: в памяти
+            # не больше workers + queue_size подготовленных отчетов
+            chunks = await pack_rows(rows)
+            started = time.perf_counter()
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._get_executor(), build_packed_report,
+                    report_format, columns, chunks
+                )
+            except BrokenProcessPool:
+                # Процесс пула упал (например, нехватка памяти): следующий
+                # отчет запустит пул заново
+                logger.error("[Reports] Пул отчетов остановлен из-за сбоя процесса")
+                self._executor = None
+                return None
+            metrics.observe('report_build_seconds', time.perf_counter() - started,
+                            format=report_format)
+            return result
+
+    async def export(self, processor: DataProcessor,
+                     report_format: str = None) -> Optional[ExportedReport]:
+        """Отчет по результатам processor (см. DataProcessor.export)"""
+        report_format = report_format or Config.DEFAULT_REPORT_FORMAT
+        if not self.enabled:
+            return processor.export(report_format)
+        if not processor.records:
+            logger.warning("Нет данных для создания отчета")
+            return None
+
+        try:
+            result = await self._build(
+                report_format, processor.columns, processor.report_rows()
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при создании отчета: {str(e)}")
+            return None
+        if result is None:
+            return None
+        data, rows = result
+        exported = ExportedReport(
+            processor.report_filename(report_format), io.BytesIO(data), rows
+        )
+        logger.info(f"Отчет создан: {exported.filename} ({exported.size} байт)")
+        return exported
+
+    async def export_diff(self, processor: DataProcessor, changes: List[Dict],
+                          report_format: str = None) -> Optional[ExportedReport]:
+        """Отчет изменений (см. DataProcessor.export_diff)"""
+        report_format = report_format or Config.DEFAULT_REPORT_FORMAT
+        if not self.enabled:
+            return processor.export_diff(changes, report_format)
+        if not changes:
+            return None
+
+        try:
+            result = await self._build(
+                report_format, DIFF_COLUMNS, processor.diff_rows(changes)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при создании отчета изменений: {str(e)}")
+            return None
+        if result is None:
+            return None
+        data, rows = result
+        return ExportedReport(
+            processor.diff_filename(report_format), io.BytesIO(data), rows
+        )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
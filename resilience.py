@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import random
+import time
+import httpx
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Ответы сервера, которые имеет смысл повторить
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """API недоступен: временные ошибки не прошли после всех повторов"""
+
+
+class CircuitOpenError(UpstreamError):
+    """Запрос не выполнялся: автомат отключен после серии ошибок"""
+
+
+def is_transient(error: Exception = None, response: httpx.Response = None) -> bool:
+    """Временная ли ошибка: таймаут, сетевой сбой или 5xx от шлюза.
+
+    Ошибки клиента (4xx) не повторяются - повтор даст тот же ответ;
+    429 обрабатывает лимитер запросов.
+    """
+    if error is not None:
+        return isinstance(error, (httpx.TimeoutException, httpx.TransportError,
+                                  asyncio.TimeoutError, TimeoutError))
+    return response is not None and response.status_code in TRANSIENT_STATUS_CODES
+
+
+class RetryPolicy:
+    """Экспоненциальные паузы между повторами со случайным разбросом.
+
+    Пауза перед n-м повтором выбирается равномерно от 0 до
+    min(max_delay, base_delay * 2**n) (full jitter), чтобы параллельные
+    запросы не повторялись одновременно.
+    """
+
+    def __init__(self, max_retries: int = None, base_delay: float = None,
+                 max_delay: float = None):
+        self.max_retries = (
+            Config.API_MAX_RETRIES if max_retries is None else max_retries
+        )
+        self.base_delay = base_delay or Config.API_RETRY_BASE_DELAY
+        self.max_delay = max_delay or Config.API_RETRY_MAX_DELAY
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Автомат: после failure_threshold ошибок подряд запросы не выполняются
+    reset_timeout секунд, затем пропускается один пробный запрос.
+
+    Успешный пробный запрос снова включает автомат, ошибка - отключает
+    еще на reset_timeout.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = None, reset_timeout: float = None):
+        self.failure_threshold = (
+            failure_threshold or Config.CIRCUIT_FAILURE_THRESHOLD
+        )
+        self.reset_timeout = reset_timeout or Config.CIRCUIT_RESET_TIMEOUT
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_count = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        # Пробный запрос мог быть отменен, не дав ответа, - тогда через
+        # reset_timeout пропускаем новый
+        now = time.monotonic()
+        if self._probe_in_flight and now - self._probe_started < self.reset_timeout:
+            return False
+        self._probe_in_flight = True
+        self._probe_started = now
+        return True
+
+    def on_success(self):
+        if self.state != self.CLOSED:
+            logger.info("[CircuitBreaker] API снова отвечает, запросы возобновлены")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def on_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened_count += 1
+                logger.warning(
+                    f"[CircuitBreaker] {self.failures} ошибок подряд, запросы "
+                    f"к API приостановлены на {self.reset_timeout:.0f} с"
+                )
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
@@ -0,0 +1,36 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом.
+
+    Пока запрос по ключу выполняется, остальные вызывающие ждут его
+    результат вместо того, чтобы отправлять свой HTTP-запрос.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.calls_count = 0
+        self.shared_count = 0
+
+    async def do(self, key: Hashable,
+                 factory: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared_count += 1
+        else:
+            self.calls_count += 1
+            future = asyncio.ensure_future(factory())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._forget(key, future))
+
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,235 @@
+import json
+import logging
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotStore:
+    """Снимки прошлых анализов для повторных запусков (SQLite).
+
+    follower_evaluations - результат проверки каждого фолловера при данных
+    настройках: при повторном анализе свежий результат используется вместо
+    запросов к API, если данные фолловера из списка заметно не изменились.
+    seed_snapshots/seed_influencers - какие инфлюенсеры были найдены
+    у исходного аккаунта в прошлый раз; по ним строится отчет изменений.
+    follower_raw - профиль и просмотры видео, по которым фолловер
+    проверялся; нужны для повторной фильтрации с другими настройками.
+
+    Результаты проверок и сырые данные копятся в памяти и пишутся одной
+    транзакцией на write_batch фолловеров (и в flush() в конце анализа),
+    а не двумя транзакциями на каждого фолловера в event loop.
+    """
+
+    def __init__(self, path: str = None, ttl: float = None,
+                 change_threshold: float = None, write_batch: int = None):
+        self.path = path or Config.SNAPSHOT_PATH
+        self.ttl = ttl or Config.SNAPSHOT_EVALUATION_TTL
+        self.change_threshold = (
+            Config.SNAPSHOT_CHANGE_THRESHOLD
+            if change_threshold is None else change_threshold
+        )
+        self.write_batch = write_batch or Config.SNAPSHOT_WRITE_BATCH
+        self._pending_evaluations: List[Tuple] = []
+        self._pending_raw: List[Tuple] = []
+
+        self._conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS follower_evaluations ('
+            'username TEXT PRIMARY KEY, settings_key TEXT NOT NULL, '
+            'follower_count INTEGER, video_count INTEGER, '
+            'result TEXT, evaluated_at REAL NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS seed_snapshots ('
+            'seed TEXT PRIMARY KEY, settings_key TEXT NOT NULL, '
+            'followers_count INTEGER NOT NULL, analyzed_at REAL NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS seed_influencers ('
+            'seed TEXT NOT NULL, username TEXT NOT NULL, data TEXT NOT NULL, '
+            'PRIMARY KEY (seed, username));'
+            'CREATE TABLE IF NOT EXISTS follower_raw ('
+            'username TEXT PRIMARY KEY, info TEXT NOT NULL, play_counts TEXT, '
+            'fetched_at REAL NOT NULL);'
+        )
+
+    @staticmethod
+    def settings_key(settings: Dict) -> str:
+        return json.dumps(settings, sort_keys=True)
+
+    @staticmethod
+    def compact_info(follower_info: Dict) -> Dict:
+        """Поля профиля, нужные для отчета"""
+        return {
+            'uniqueId': follower_info.get('uniqueId', ''),
+            'followerCount': follower_info.get('followerCount', 0),
+            'videoCount': follower_info.get('videoCount', 0),
+            'signature': follower_info.get('signature', '')
+        }
+
+    def _changed(self, old: Optional[int], new: Optional[int]) -> bool:
+        if old is None or new is None:
+            return old != new
+        return abs(new - old) > self.change_threshold * max(old, 1)
+
+    def get_evaluation(self, username: str, settings_key: str,
+                       follower_count: Optional[int],
+                       video_count: Optional[int]) -> Tuple[bool, Optional[Tuple]]:
+        """Возвращает (найдено, результат проверки).
+
+        Результат не используется, если он устарел, получен при других
+        настройках или у фолловера заметно изменилось число фолловеров
+        или видео (новые видео могут изменить итог проверки).
+        """
+        row = self._conn.execute(
+            'SELECT settings_key, follower_count, video_count, result, evaluated_at '
+            'FROM follower_evaluations WHERE username = ?', (username.lower(),)
+        ).fetchone()
+        if row is None or row[0] != settings_key:
+            return False, None
+        if time.time() - row[4] > self.ttl:
+            return False, None
+        if self._changed(row[1], follower_count) or row[2] != video_count:
+            return False, None
+        if row[3] is None:
+            return True, None
+        info, email, high_view_videos = json.loads(row[3])
+        return True, (info, email, high_view_videos)
+
+    def save_evaluation(self, username: str, settings_key: str,
+                        follower_count: Optional[int], video_count: Optional[int],
+                        evaluation: Optional[Tuple]):
+        result = None
+        if evaluation:
+            info, email, high_view_videos = evaluation
+            result = json.dumps(
+                [self.compact_info(info), email, high_view_videos],
+                ensure_ascii=False
+            )
+        self._pending_evaluations.append(
+            (username.lower(), settings_key, follower_count, video_count,
+             result, time.time())
+        )
+        self._flush_if_full()
+
+    def save_raw(self, username: str, follower_info: Dict,
+                 play_counts: Optional[List[int]]):
+        self._pending_raw.append(
+            (username.lower(),
+             json.dumps(self.compact_info(follower_info), ensure_ascii=False),
+             None if play_counts is None else json.dumps(play_counts),
+             time.time())
+        )
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+        if max(len(self._pending_evaluations), len(self._pending_raw)) >= self.write_batch:
+            self.flush()
+
+    def flush(self):
+        """Записывает накопленные результаты проверок и сырые данные"""
+        if not self._pending_evaluations and not self._pending_raw:
+            return
+        evaluations, self._pending_evaluations = self._pending_evaluations, []
+        raw, self._pending_raw = self._pending_raw, []
+        with self._conn:
+            self._conn.execute('BEGIN')
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO follower_evaluations '
+                '(username, settings_key, follower_count, video_count, result, evaluated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)', evaluations
+            )
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO follower_raw '
+                '(username, info, play_counts, fetched_at) VALUES (?, ?, ?, ?)', raw
+            )
+
+    def get_raw(self, username: str) -> Tuple[Optional[Dict], Optional[List[int]]]:
+        """Профиль и просмотры видео фолловера из прошлой проверки"""
+        row = self._conn.execute(
+            'SELECT info, play_counts FROM follower_raw WHERE username = ?',
+            (username.lower(),)
+        ).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), None if row[1] is None else json.loads(row[1])
+
+    def previous_influencers(self, seeds: List[str], settings_key: str = None
+                             ) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+        """Инфлюенсеры прошлых снимков этих аккаунтов и сами снимки.
+        
+        С settings_key снимки, сделанные при других настройках, не
+        возвращаются: разница в порогах выглядела бы как новые и выбывшие
+        инфлюенсеры.
+        """
+        influencers: Dict[str, Dict] = {}
+        snapshots: Dict[str, Dict] = {}
+        for seed in seeds:
+            row = self._conn.execute(
+                'SELECT settings_key, followers_count, analyzed_at '
+                'FROM seed_snapshots WHERE seed = ?', (seed.lower(),)
+            ).fetchone()
+            if row is None or (settings_key is not None and row[0] != settings_key):
+                continue
+            snapshots[seed] = {
+                'settings_key': row[0],
+                'followers_count': row[1],
+                'analyzed_at': row[2]
+            }
+            for username, data in self._conn.execute(
+                'SELECT username, data FROM seed_influencers WHERE seed = ?',
+                (seed.lower(),)
+            ):
+                influencers.setdefault(username, json.loads(data))
+        return influencers, snapshots
+
+    def save_seed_snapshot(self, seed: str, settings_key: str,
+                           followers_count: int, influencers: Dict[str, Dict]):
+        """Заменяет снимок исходного аккаунта результатами текущего анализа"""
+        seed_key = seed.lower()
+        with self._conn:
+            self._conn.execute('BEGIN')
+            self._conn.execute(
+                'INSERT OR REPLACE INTO seed_snapshots '
+                '(seed, settings_key, followers_count, analyzed_at) '
+                'VALUES (?, ?, ?, ?)',
+                (seed_key, settings_key, followers_count, time.time())
+            )
+            self._conn.execute(
+                'DELETE FROM seed_influencers WHERE seed = ?', (seed_key,)
+            )
+            self._conn.executemany(
+                'INSERT INTO seed_influencers (seed, username, data) VALUES (?, ?, ?)',
+                [(seed_key, username, json.dumps(data, ensure_ascii=False))
+                 for username, data in influencers.items()]
+            )
+
+    def diff(self, previous: Dict[str, Dict], current: Dict[str, Dict]) -> List[Dict]:
+        """Изменения между снимками: новые, выбывшие и изменившиеся инфлюенсеры.
+
+        Изменившимися считаются записи с другим email или числом видео
+        с высокими просмотрами, либо с заметно изменившимся числом фолловеров.
+        """
+        changes = []
+        for username, now in current.items():
+            before = previous.get(username)
+            if before is None:
+                changes.append({'change': 'new', 'username': username,
+                                'before': None, 'now': now})
+            elif (before['email'] != now['email']
+                  or before['high_view_videos'] != now['high_view_videos']
+                  or self._changed(before['follower_count'], now['follower_count'])):
+                changes.append({'change': 'changed', 'username': username,
+                                'before': before, 'now': now})
+        for username, before in previous.items():
+            if username not in current:
+                changes.append({'change': 'dropped', 'username': username,
+                                'before': before, 'now': None})
+        return changes
+
+    def close(self):
+        self.flush()
+        self._conn.close()
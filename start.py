@@ -13,6 +13,9 @@ def check_environment():
     missing_vars = []
     
     for var in required_vars:
+        # Вместо одного ключа может быть задан пул RAPIDAPI_KEYS
+        if var == 'RAPIDAPI_KEY' and os.getenv('RAPIDAPI_KEYS'):
+            continue
         if not os.getenv(var):
             missing_vars.append(var)
     
@@ -0,0 +1,450 @@
+import itertools
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from config import Config
+
+# Статусы задач, ожидающих обработчика (см. AnalysisJob)
+WAITING_STATUSES = ('new', 'queued')
+
+# Поля записи задачи (см. AnalysisJob.to_record)
+JOB_FIELDS = ('id', 'chat_id', 'username', 'status', 'payload', 'progress',
+              'error', 'profile', 'worker', 'lease_until', 'cancel_requested',
+              'created_at', 'started_at', 'finished_at')
+
+
+class StateMapping:
+    """Словарь поверх пространства имен бэкенда (например, user_states)"""
+
+    def __init__(self, backend: 'StateBackend', namespace: str):
+        self.backend = backend
+        self.namespace = namespace
+
+    def __contains__(self, key) -> bool:
+        return self.backend.exists(self.namespace, key)
+
+    def __getitem__(self, key):
+        value = self.backend.get(self.namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.backend.set(self.namespace, key, value)
+
+    def __delitem__(self, key):
+        self.backend.delete(self.namespace, key)
+
+    def get(self, key, default=None):
+        value = self.backend.get(self.namespace, key)
+        return default if value is None else value
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        self.backend.delete(self.namespace, key)
+        return value
+
+
+class StateBackend:
+    """Общее состояние бота: значения по пространствам имен (состояния
+    диалогов, настройки чатов, данные последнего анализа) и очередь задач.
+
+    Значения должны сериализоваться в JSON. Задача в очереди - запись
+    со статусом (см. AnalysisJob); обработчик забирает ее claim_job и
+    продлевает аренду renew_jobs, пока выполняет. Аренда принадлежит
+    одному забору задачи: worker - токен, уникальный для каждого
+    claim_job. Задача с истекшей арендой (процесс упал) снова выдается
+    обработчикам общего бэкенда.
+    """
+
+    # Видят ли состояние другие процессы
+    shared = False
+
+    def get(self, namespace: str, key, default=None) -> Any:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key, value: Any):
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key):
+        raise NotImplementedError
+
+    def exists(self, namespace: str, key) -> bool:
+        """Есть ли значение (без чтения и разбора самого значения)"""
+        raise NotImplementedError
+
+    def mapping(self, namespace: str) -> StateMapping:
+        return StateMapping(self, namespace)
+
+    def add_job(self, record: Dict, max_queued: int) -> Optional[int]:
+        """Добавляет задачу в очередь; None, если в очереди уже max_queued задач"""
+        raise NotImplementedError
+
+    def claim_job(self, worker: str, lease: float) -> Optional[Dict]:
+        """Забирает первую задачу из очереди (или с истекшей арендой)
+        под токеном аренды worker"""
+        raise NotImplementedError
+
+    def update_job(self, job_id: int, **fields):
+        raise NotImplementedError
+
+    def renew_jobs(self, leases: Dict[int, Tuple[str, str]],
+                   lease: float) -> Tuple[List[int], List[int]]:
+        """Продлевает аренду выполняющихся задач и сохраняет их прогресс.
+
+        leases - номер задачи: (токен аренды, прогресс). Возвращает задачи,
+        отмену которых запросил другой процесс, и задачи, аренду которых
+        уже забрал другой обработчик.
+        """
+        raise NotImplementedError
+
+    def confirm_job(self, job_id: int, worker: str, lease: float) -> bool:
+        """Продлевает аренду задачи, если она все еще под токеном worker.
+
+        False - аренда истекла и задачу забрал другой обработчик.
+        """
+        raise NotImplementedError
+
+    def cancel_job(self, job_id: int) -> Optional[str]:
+        """Отменяет задачу в очереди ('cancelled') или запрашивает отмену
+        выполняющейся ('requested'); None - задача уже завершена"""
+        raise NotImplementedError
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def list_jobs(self, chat_id: int = None) -> List[Dict]:
+        raise NotImplementedError
+
+    def queue_position(self, job_id: int) -> int:
+        raise NotImplementedError
+
+    def prune_jobs(self, history_size: int, finished: Iterable[str]):
+        """Оставляет не больше history_size завершенных задач"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """Состояние в памяти процесса (один процесс бота)"""
+
+    def __init__(self):
+        self._values: Dict[str, Dict[str, Any]] = {}
+        self._jobs: 'OrderedDict[int, Dict]' = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def get(self, namespace: str, key, default=None) -> Any:
+        return self._values.get(namespace, {}).get(str(key), default)
+
+    def set(self, namespace: str, key, value: Any):
+        self._values.setdefault(namespace, {})[str(key)] = value
+
+    def delete(self, namespace: str, key):
+        self._values.get(namespace, {}).pop(str(key), None)
+
+    def exists(self, namespace: str, key) -> bool:
+        return str(key) in self._values.get(namespace, {})
+
+    def add_job(self, record: Dict, max_queued: int) -> Optional[int]:
+        queued = sum(
+            1 for job in self._jobs.values() if job['status'] in WAITING_STATUSES
+        )
+        if queued >= max_queued:
+            return None
+        job_id = next(self._ids)
+        self._jobs[job_id] = dict(
+            dict.fromkeys(JOB_FIELDS), progress='', cancel_requested=0,
+            **record, id=job_id
+        )
+        return job_id
+
+    def claim_job(self, worker: str, lease: float) -> Optional[Dict]:
+        # Других процессов нет: задача с истекшей арендой все еще
+        # выполняется здесь, и повторно ее не выдаем
+        now = time.time()
+        for job in self._jobs.values():
+            if job['status'] == 'queued':
+                job.update(status='running', worker=worker, lease_until=now + lease,
+                           started_at=now, cancel_requested=0)
+                return dict(job)
+        return None
+
+    def update_job(self, job_id: int, **fields):
+        if job_id in self._jobs:
+            self._jobs[job_id].update(fields)
+
+    def renew_jobs(self, leases: Dict[int, Tuple[str, str]],
+                   lease: float) -> Tuple[List[int], List[int]]:
+        lease_until = time.time() + lease
+        cancelled, lost = [], []
+        for job_id, (worker, text) in leases.items():
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != 'running' or job['worker'] != worker:
+                lost.append(job_id)
+                continue
+            job.update(progress=text, lease_until=lease_until)
+            if job['cancel_requested']:
+                cancelled.append(job_id)
+        return cancelled, lost
+
+    def confirm_job(self, job_id: int, worker: str, lease: float) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job['status'] != 'running' or job['worker'] != worker:
+            return False
+        job['lease_until'] = time.time() + lease
+        return True
+
+    def cancel_job(self, job_id: int) -> Optional[str]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job['status'] in WAITING_STATUSES:
+            job.update(status='cancelled', finished_at=time.time())
+            return 'cancelled'
+        if job['status'] == 'running':
+            job['cancel_requested'] = 1
+            return 'requested'
+        return None
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    def list_jobs(self, chat_id: int = None) -> List[Dict]:
+        return [
+            dict(job) for job in self._jobs.values()
+            if chat_id is None or job['chat_id'] == chat_id
+        ]
+
+    def queue_position(self, job_id: int) -> int:
+        job = self._jobs.get(job_id)
+        if job is None or job['status'] not in WAITING_STATUSES:
+            return 0
+        return sum(
+            1 for other in self._jobs.values()
+            if other['status'] in WAITING_STATUSES and other['id'] <= job_id
+        )
+
+    def prune_jobs(self, history_size: int, finished: Iterable[str]):
+        finished = set(finished)
+        done = [job_id for job_id, job in self._jobs.items()
+                if job['status'] in finished]
+        for job_id in done[:max(0, len(done) - history_size)]:
+            del self._jobs[job_id]
+
+
+class SqliteStateBackend(StateBackend):
+    """Состояние в локальном файле SQLite, общее для процессов бота на хосте.
+
+    Забор задачи выполняется в транзакции BEGIN IMMEDIATE, поэтому одну
+    задачу получает только один обработчик.
+    """
+
+    shared = True
+
+    # Задача, которую можно забрать: в очереди или с истекшей арендой
+    _CLAIMABLE = (
+        "SELECT id FROM jobs WHERE status = 'queued' "
+        "OR (status = 'running' AND lease_until < ?) ORDER BY id LIMIT 1"
+    )
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.STATE_PATH
+        self._conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False,
+            timeout=Config.STATE_BUSY_TIMEOUT
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS state_values ('
+            'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+            'updated_at REAL NOT NULL, PRIMARY KEY (namespace, key))'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, '
+            'username TEXT NOT NULL, status TEXT NOT NULL, payload TEXT NOT NULL, '
+            "progress TEXT NOT NULL DEFAULT '', error TEXT, profile TEXT, "
+            'worker TEXT, lease_until REAL, cancel_requested INTEGER NOT NULL DEFAULT 0, '
+            'created_at REAL NOT NULL, started_at REAL, finished_at REAL)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)'
+        )
+
+    def get(self, namespace: str, key, default=None) -> Any:
+        row = self._conn.execute(
+            'SELECT value FROM state_values WHERE namespace = ? AND key = ?',
+            (namespace, str(key))
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, namespace: str, key, value: Any):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO state_values (namespace, key, value, updated_at) '
+            'VALUES (?, ?, ?, ?)',
+            (namespace, str(key), json.dumps(value, ensure_ascii=False), time.time())
+        )
+
+    def delete(self, namespace: str, key):
+        self._conn.execute(
+            'DELETE FROM state_values WHERE namespace = ? AND key = ?',
+            (namespace, str(key))
+        )
+
+    def exists(self, namespace: str, key) -> bool:
+        return self._conn.execute(
+            'SELECT 1 FROM state_values WHERE namespace = ? AND key = ?',
+            (namespace, str(key))
+        ).fetchone() is not None
+
+    @staticmethod
+    def _job(row) -> Dict:
+        job = dict(zip(JOB_FIELDS, row))
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    def _select_jobs(self, where: str = '', params: tuple = ()) -> List[Dict]:
+        rows = self._conn.execute(
+            f"SELECT {', '.join(JOB_FIELDS)} FROM jobs {where} ORDER BY id", params
+        ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def add_job(self, record: Dict, max_queued: int) -> Optional[int]:
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            queued = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('new', 'queued')"
+            ).fetchone()[0]
+            if queued >= max_queued:
+                return None
+            cursor = self._conn.execute(
+                'INSERT INTO jobs (chat_id, username, status, payload, created_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (record['chat_id'], record['username'], record['status'],
+                 json.dumps(record['payload'], ensure_ascii=False),
+                 record['created_at'])
+            )
+            return cursor.lastrowid
+        finally:
+            self._conn.execute('COMMIT')
+
+    def claim_job(self, worker: str, lease: float) -> Optional[Dict]:
+        now = time.time()
+        # Свободные обработчики опрашивают очередь постоянно: блокировка
+        # на запись берется, только если есть что забрать
+        if self._conn.execute(self._CLAIMABLE, (now,)).fetchone() is None:
+            return None
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Задачу мог забрать другой процесс до блокировки
+            row = self._conn.execute(self._CLAIMABLE, (now,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, "
+                'started_at = ?, cancel_requested = 0 WHERE id = ?',
+                (worker, now + lease, now, row[0])
+            )
+        finally:
+            self._conn.execute('COMMIT')
+        return self.get_job(row[0])
+
+    def update_job(self, job_id: int, **fields):
+        if 'payload' in fields:
+            fields['payload'] = json.dumps(fields['payload'], ensure_ascii=False)
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._conn.execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ?",
+            (*fields.values(), job_id)
+        )
+
+    def renew_jobs(self, leases: Dict[int, Tuple[str, str]],
+                   lease: float) -> Tuple[List[int], List[int]]:
+        if not leases:
+            return [], []
+        lease_until = time.time() + lease
+        renewed, lost = [], []
+        with self._conn:
+            self._conn.execute('BEGIN')
+            for job_id, (worker, text) in leases.items():
+                cursor = self._conn.execute(
+                    'UPDATE jobs SET progress = ?, lease_until = ? '
+                    "WHERE id = ? AND worker = ? AND status = 'running'",
+                    (text, lease_until, job_id, worker)
+                )
+                (renewed if cursor.rowcount else lost).append(job_id)
+        if not renewed:
+            return [], lost
+        placeholders = ', '.join('?' * len(renewed))
+        rows = self._conn.execute(
+            f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({placeholders})",
+            tuple(renewed)
+        ).fetchall()
+        return [row[0] for row in rows], lost
+
+    def confirm_job(self, job_id: int, worker: str, lease: float) -> bool:
+        # Проверка и продление одним запросом: claim_job другого процесса
+        # не может вклиниться между ними
+        cursor = self._conn.execute(
+            "UPDATE jobs SET lease_until = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + lease, job_id, worker)
+        )
+        return cursor.rowcount == 1
+
+    def cancel_job(self, job_id: int) -> Optional[str]:
+        cursor = self._conn.execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+            "WHERE id = ? AND status IN ('new', 'queued')",
+            (time.time(), job_id)
+        )
+        if cursor.rowcount:
+            return 'cancelled'
+        cursor = self._conn.execute(
+            "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'",
+            (job_id,)
+        )
+        return 'requested' if cursor.rowcount else None
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        jobs = self._select_jobs('WHERE id = ?', (job_id,))
+        return jobs[0] if jobs else None
+
+    def list_jobs(self, chat_id: int = None) -> List[Dict]:
+        if chat_id is None:
+            return self._select_jobs()
+        return self._select_jobs('WHERE chat_id = ?', (chat_id,))
+
+    def queue_position(self, job_id: int) -> int:
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('new', 'queued') AND id <= ? "
+            "AND EXISTS (SELECT 1 FROM jobs WHERE id = ? AND status IN ('new', 'queued'))",
+            (job_id, job_id)
+        ).fetchone()[0]
+
+    def prune_jobs(self, history_size: int, finished: Iterable[str]):
+        finished = tuple(finished)
+        placeholders = ', '.join('?' * len(finished))
+        self._conn.execute(
+            f"DELETE FROM jobs WHERE status IN ({placeholders}) AND id NOT IN ("
+            f"SELECT id FROM jobs WHERE status IN ({placeholders}) "
+            "ORDER BY id DESC LIMIT ?)",
+            (*finished, *finished, history_size)
+        )
+
+    def close(self):
+        self._conn.close()
+
+
+def create_state_backend() -> StateBackend:
+    """Бэкенд из STATE_BACKEND: memory (по умолчанию) или sqlite"""
+    if Config.STATE_BACKEND == 'sqlite':
+        return SqliteStateBackend()
+    if Config.STATE_BACKEND != 'memory':
+        raise ValueError(f"Неизвестный STATE_BACKEND: {Config.STATE_BACKEND}")
+    return MemoryStateBackend()
@@ -0,0 +1,79 @@
+"""Контрольные точки: сохранение прогресса и продолжение анализа"""
+
+import pytest
+from checkpoints import AnalysisCheckpoint, CheckpointStore
+
+
+def follower(number):
+    return {'user': {'uniqueId': f"user{number}"},
+            'stats': {'followerCount': 100 * number, 'videoCount': number}}
+
+
+def evaluation(number):
+    info = {'uniqueId': f"user{number}", 'followerCount': 100 * number,
+            'videoCount': number, 'signature': ''}
+    return info, f"user{number}@example.com", 2
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite3'), interval=0)
+    yield store
+    store.close()
+
+
+def run_two_pages(checkpoint):
+    """Две страницы по три фолловера; проверены первая страница и user3"""
+    checkpoint.on_page(0, [follower(n) for n in (0, 1, 2)])
+    checkpoint.on_page(3, [follower(n) for n in (3, 4, 5)])
+    checkpoint.record('user0', None)
+    checkpoint.record('user1', evaluation(1))
+    checkpoint.record('user2', None)
+    checkpoint.record('user3', evaluation(3))
+    checkpoint.mark_emitted(3)
+
+
+def test_resume_from_saved_checkpoint(store):
+    checkpoint = store.create(1, AnalysisCheckpoint.SINGLE, ['seed'],
+                              {'max_followers': 3000}, 'csv')
+    run_two_pages(checkpoint)
+
+    resumed = store.get(checkpoint.id)
+    assert resumed.resumed
+    assert resumed.settings == {'max_followers': 3000}
+    # Обход продолжается со второй страницы
+    assert resumed.cursor == 3
+    assert resumed.listed_before == 3
+    assert resumed.followers_before == [
+        ['user0', 0, 0], ['user1', 100, 1], ['user2', 200, 2]
+    ]
+    assert [result[1] for result in resumed.restored_results()] == [
+        'user1@example.com'
+    ]
+    # Проверенный фолловер второй страницы заново не проверяется
+    assert resumed.is_done('user3') and not resumed.is_done('user4')
+    assert resumed.restore('user3')[1] == 'user3@example.com'
+    assert [c.id for c in store.pending()] == [checkpoint.id]
+
+
+def test_save_writes_only_changed_rows(store):
+    checkpoint = store.create(1, AnalysisCheckpoint.SINGLE, ['seed'], {}, 'csv')
+    run_two_pages(checkpoint)
+    assert checkpoint.unsaved_rows() == []
+    checkpoint.record('user4', None)
+    assert [row[0] for row in checkpoint.unsaved_rows()] == ['user4']
+
+
+def test_lost_lease_does_not_touch_checkpoint(store):
+    checkpoint = store.create(1, AnalysisCheckpoint.SINGLE, ['seed'], {}, 'csv')
+    run_two_pages(checkpoint)
+
+    # Задачу перехватил другой обработчик
+    checkpoint.owner_check = lambda: False
+    checkpoint.record('user4', evaluation(4))
+    checkpoint.save()
+    checkpoint.delete()
+
+    resumed = store.get(checkpoint.id)
+    assert resumed is not None
+    assert not resumed.is_done('user4')
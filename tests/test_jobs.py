@@ -0,0 +1,89 @@
+"""Аренда задач: StateBackend (память и SQLite) и JobManager"""
+
+import asyncio
+import time
+import pytest
+from config import Config
+from jobs import AnalysisJob, JobManager
+from state_backend import MemoryStateBackend, SqliteStateBackend
+
+
+def add_job(backend, username='seed'):
+    job = AnalysisJob(None, 1, username, {})
+    return backend.add_job(job.to_record(), 10)
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    backend = SqliteStateBackend(str(tmp_path / 'state.sqlite3'))
+    yield backend
+    backend.close()
+
+
+def test_memory_backend_does_not_reissue_expired_lease():
+    backend = MemoryStateBackend()
+    job_id = add_job(backend)
+    assert backend.claim_job('a', lease=0)['id'] == job_id
+    time.sleep(0.01)
+    # Других процессов нет: задача все еще выполняется здесь
+    assert backend.claim_job('b', lease=0) is None
+    assert backend.confirm_job(job_id, 'a', 10)
+
+
+def test_sqlite_backend_reissues_expired_lease_to_new_token(sqlite_backend):
+    job_id = add_job(sqlite_backend)
+    assert sqlite_backend.claim_job('a', lease=0)['id'] == job_id
+    time.sleep(0.01)
+    assert sqlite_backend.claim_job('b', lease=10)['id'] == job_id
+
+    assert not sqlite_backend.confirm_job(job_id, 'a', 10)
+    assert sqlite_backend.confirm_job(job_id, 'b', 10)
+    assert sqlite_backend.renew_jobs({job_id: ('a', '')}, 10) == ([], [job_id])
+    assert sqlite_backend.renew_jobs({job_id: ('b', '')}, 10) == ([], [])
+
+
+def test_sqlite_backend_does_not_reissue_live_lease(sqlite_backend):
+    add_job(sqlite_backend)
+    assert sqlite_backend.claim_job('a', lease=10) is not None
+    assert sqlite_backend.claim_job('b', lease=10) is None
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_stale_run_does_not_finish_job(shared, tmp_path, monkeypatch):
+    """Задачу, перехваченную после простоя, завершает только новый запуск"""
+    monkeypatch.setattr(Config, 'JOB_LEASE_SECONDS', 0.3)
+    monkeypatch.setattr(Config, 'JOB_POLL_INTERVAL', 0.02)
+    backend = (SqliteStateBackend(str(tmp_path / 'state.sqlite3')) if shared
+               else MemoryStateBackend())
+    runs, confirmed = [], []
+
+    async def main():
+        manager = JobManager(workers=2, max_queue=10, backend=backend)
+
+        async def runner(job):
+            runs.append(job.lease_token)
+            if len(runs) == 1:
+                # Аренда истекла, пока процесс простаивал
+                backend.update_job(job.id, lease_until=0)
+                await asyncio.sleep(0.2)
+            if manager.confirm(job):
+                confirmed.append(job.lease_token)
+
+        manager.runner = runner
+        job = manager.submit(1, 'seed', {})
+        await manager.start()
+        for _ in range(100):
+            if manager.get(job.id).finished:
+                break
+            await asyncio.sleep(0.02)
+        await manager.stop()
+        return manager.get(job.id)
+
+    job = asyncio.run(main())
+    backend.close()
+    assert job.status == AnalysisJob.DONE
+    assert len(confirmed) == 1
+    # В памяти задача не выдается повторно, в SQLite ее забирает второй
+    # обработчик, и результат подтверждает только он
+    assert len(runs) == (2 if shared else 1)
+    assert confirmed == runs[-1:]
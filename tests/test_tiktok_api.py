@@ -0,0 +1,47 @@
+"""TikTokAPI._get против офлайн-мока RapidAPI из benchmark.py"""
+
+import asyncio
+import pytest
+from benchmark import MockRapidAPI, SEED_USERNAME
+from config import Config
+from key_pool import ApiKey, KeyPool
+from resilience import UpstreamError
+from tiktok_api import TikTokAPI
+
+
+class ThrottlingMock(MockRapidAPI):
+    """Мок, который на каждый запрос отвечает 429 с короткой паузой"""
+
+    def _take_quota(self, key):
+        return False, {'Retry-After': '0.01'}
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    monkeypatch.setattr(Config, 'CACHE_ENABLED', False)
+    monkeypatch.setattr(Config, 'TRAFFIC_MODE', '')
+
+
+async def fetch_user_info(server, username):
+    async with server:
+        keys = KeyPool([ApiKey('test-key', Config.RAPIDAPI_HOST, server.base_url)])
+        api = TikTokAPI(base_url=server.base_url, keys=keys)
+        try:
+            return await api.get_user_info(username)
+        finally:
+            await api.close()
+
+
+def test_user_info_from_mock():
+    info = asyncio.run(fetch_user_info(MockRapidAPI(followers=10, latency=0),
+                                       SEED_USERNAME))
+    assert info['user']['uniqueId'] == SEED_USERNAME
+
+
+def test_exhausted_429_retries_raise_upstream_error(monkeypatch):
+    monkeypatch.setattr(Config, 'RATE_LIMIT_MAX_RETRIES', 2)
+    server = ThrottlingMock(followers=10, latency=0)
+    with pytest.raises(UpstreamError, match='429'):
+        asyncio.run(fetch_user_info(server, SEED_USERNAME))
+    # Первый запрос и RATE_LIMIT_MAX_RETRIES повторов
+    assert server.statuses == {429: 3}
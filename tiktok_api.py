@@ -1,19 +1,204 @@
-import requests
+import asyncio
+import time
+import httpx
 import re
 import logging
-from typing import List, Dict, Optional
+from typing import AsyncIterator, Callable, List, Dict, Optional, Tuple
 from config import Config
+from key_pool import ApiKey, KeyPool
+from resilience import (CircuitBreaker, CircuitOpenError, RetryPolicy,
+                        UpstreamError, is_transient)
+from api_cache import ApiCache
+from single_flight import SingleFlight
+from traffic_archive import open_traffic_archive
+from metrics import metrics, log_sampled, truncate
 
 logger = logging.getLogger(__name__)
 
 
 class TikTokAPI:
-    def __init__(self):
-        self.headers = {
-            "X-RapidAPI-Key": Config.RAPIDAPI_KEY,
-            "X-RapidAPI-Host": Config.RAPIDAPI_HOST
+    # Лимитер без ограничений для быстрого воспроизведения архива
+    REPLAY_FAST_RPS = 1e6
+    
+    def __init__(self, pool_size: int = None, timeout: float = None,
+                 base_url: str = None, traffic=None, keys: KeyPool = None):
+        self.pool_size = pool_size or Config.HTTP_POOL_SIZE
+        self.timeout = httpx.Timeout(
+            timeout or Config.HTTP_READ_TIMEOUT,
+            connect=Config.HTTP_CONNECT_TIMEOUT,
+            pool=Config.HTTP_POOL_TIMEOUT
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        # Запись/воспроизведение трафика (TRAFFIC_MODE); кэш при этом
+        # отключен, чтобы в архив попадали и из него читались все запросы
+        self.traffic = traffic if traffic is not None else open_traffic_archive()
+        # Пул ключей RapidAPI: у каждого ключа свой лимитер квоты
+        if keys is not None:
+            self.keys = keys
+        elif self.traffic is not None and self.traffic.fast:
+            self.keys = KeyPool.from_config(
+                base_url, rate=self.REPLAY_FAST_RPS, max_rate=self.REPLAY_FAST_RPS
+            )
+        else:
+            self.keys = KeyPool.from_config(base_url)
+        self.cache = (
+            ApiCache() if Config.CACHE_ENABLED and self.traffic is None else None
+        )
+        self.in_flight = SingleFlight()
+        # Повторы временных ошибок и автомат на случай недоступности API
+        self.retry_policy = RetryPolicy()
+        self.breaker = CircuitBreaker()
+        # Предельное время запроса целиком, по endpoint
+        self.endpoint_timeouts = {
+            'user_info': Config.API_USER_INFO_TIMEOUT,
+            'user_followers': Config.API_USER_FOLLOWERS_TIMEOUT,
+            'user_videos': Config.API_USER_VIDEOS_TIMEOUT
         }
     
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Общий асинхронный клиент с пулом keep-alive соединений"""
+        if self._client is None or self._client.is_closed:
+            limits = httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=min(
+                    Config.HTTP_KEEPALIVE_CONNECTIONS, self.pool_size
+                ),
+                keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+            )
+            transport = httpx.AsyncHTTPTransport(limits=limits)
+            if self.traffic is not None:
+                transport = self.traffic.wrap(transport)
+            # Заголовки RapidAPI передаются с каждым запросом - по его ключу
+            self._client = httpx.AsyncClient(
+                transport=transport,
+                timeout=self.timeout
+            )
+        return self._client
+    
+    async def close(self):
+        """Закрывает HTTP-клиент, кэш и архив трафика"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+        if self.traffic is not None:
+            self.traffic.close()
+    
+    @staticmethod
+    def endpoint_name(url: str) -> str:
+        """Короткое имя endpoint для метрик: .../api/user/info -> user_info"""
+        path = httpx.URL(url).path.strip('/').split('/')
+        return '_'.join(path[-2:])
+    
+    async def _get(self, path: str, params: Dict) -> httpx.Response:
+        """GET-запрос через пул ключей и автомат.
+        
+        Запрос уходит с ключом, выбранным пулом, и ждет его лимитер;
+        при 429 ключ временно исключается и запрос повторяется. Временные ошибки (таймаут, сетевой сбой,
+        5xx) повторяет с экспоненциальной паузой; если они (или повторы
+        после 429) не прошли или автомат отключен после серии ошибок,
+        бросает UpstreamError.
+        """
+        endpoint = self.endpoint_name(path)
+        throttled = 0
+        failed = 0
+        while True:
+            if not self.breaker.allow():
+                metrics.inc('tiktok_api_circuit_rejected_total', endpoint=endpoint)
+                raise CircuitOpenError(f"API временно недоступен ({endpoint})")
+            
+            key = await self.keys.acquire()
+            try:
+                response = await self._timed_get(endpoint, key, path, params)
+            except Exception as e:
+                if not is_transient(e):
+                    # Ошибка не связана с доступностью API
+                    self.breaker.on_success()
+                    raise
+                failure = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code == 429:
+                    self.breaker.on_success()
+                    delay = self.keys.on_throttled(key, response.headers)
+                    if throttled >= Config.RATE_LIMIT_MAX_RETRIES:
+                        # Как и исчерпанные повторы 5xx: вызывающий код
+                        # учтет запрос как сбой API, а не как пустой ответ
+                        raise UpstreamError(
+                            f"{endpoint}: HTTP 429 (повторов: {throttled})"
+                        )
+                    throttled += 1
+                    logger.warning(
+                        f"[TikTokAPI] 429 для {endpoint} (ключ {key.name}), "
+                        f"ключ отдыхает {delay:.1f} с "
+                        f"(попытка {throttled}/{Config.RATE_LIMIT_MAX_RETRIES})"
+                    )
+                    continue
+                if not is_transient(response=response):
+                    self.breaker.on_success()
+                    if self.keys.on_response(
+                        key, response.status_code, response.headers
+                    ):
+                        continue  # ключ отклонен, пробуем другой
+                    return response
+                failure = f"HTTP {response.status_code}"
+            finally:
+                self.keys.release(key)
+            
+            self.keys.on_failure(key)
+            self.breaker.on_failure()
+            if failed >= self.retry_policy.max_retries:
+                raise UpstreamError(
+                    f"{endpoint}: {failure} (повторов: {failed})"
+                )
+            failed += 1
+            delay = self.retry_policy.delay(failed)
+            metrics.inc('tiktok_api_retries_total', endpoint=endpoint)
+            logger.warning(
+                f"[TikTokAPI] {endpoint}: {failure}, повтор через {delay:.1f} с "
+                f"(попытка {failed}/{self.retry_policy.max_retries})"
+            )
+            await asyncio.sleep(delay)
+    
+    async def _timed_get(self, endpoint: str, key: ApiKey, path: str,
+                         params: Dict) -> httpx.Response:
+        """Выполняет запрос с ключом и записывает метрики по endpoint"""
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self.client.get(
+                    key.base_url + path, params=params, headers=key.headers
+                ),
+                self.endpoint_timeouts.get(endpoint)
+            )
+        except Exception as e:
+            metrics.inc('tiktok_api_errors_total', endpoint=endpoint,
+                        reason=type(e).__name__)
+            raise
+        finally:
+            metrics.inc('tiktok_api_requests_total', endpoint=endpoint)
+            metrics.observe('tiktok_api_request_seconds',
+                            time.perf_counter() - started, endpoint=endpoint)
+        
+        metrics.inc('tiktok_api_responses_total', endpoint=endpoint,
+                    status=response.status_code)
+        metrics.inc('tiktok_api_received_bytes_total', len(response.content),
+                    endpoint=endpoint)
+        if response.status_code == 429:
+            metrics.inc('tiktok_api_throttled_total', endpoint=endpoint)
+        elif response.status_code >= 400:
+            metrics.inc('tiktok_api_errors_total', endpoint=endpoint,
+                        reason=f"http_{response.status_code}")
+        log_sampled(
+            logger,
+            f"[TikTokAPI] {endpoint}: params={params}, "
+            f"status={response.status_code}",
+            response.text
+        )
+        return response
+    
     def extract_username_from_url(self, url: str) -> Optional[str]:
         """Извлекает username из TikTok URL"""
         patterns = [
@@ -28,86 +213,203 @@ class TikTokAPI:
                 return match.group(1)
         return None
     
-    def get_user_info(self, username: str) -> Optional[Dict]:
-        """Получает информацию о пользователе"""
+    async def get_user_info(self, username: str) -> Optional[Dict]:
+        """Получает информацию о пользователе (с учетом кэша)"""
+        return await self._cached_call(
+            'user_info',
+            {"uniqueId": username},
+            lambda: self._fetch_user_info(username)
+        )
+    
+    async def _cached_call(self, endpoint: str, params: Dict, fetch):
+        """Кэш -> общий запрос для одинаковых одновременных вызовов -> API"""
+        if self.cache:
+            cached = self.cache.get(endpoint, params)
+            if cached is not None:
+                return cached
+        
+        async def fetch_and_store():
+            value = await fetch()
+            if self.cache and value:
+                self.cache.set(endpoint, params, value)
+            return value
+        
+        key = ApiCache.make_key(endpoint, params)
+        return await self.in_flight.do(key, fetch_and_store)
+    
+    async def _fetch_user_info(self, username: str) -> Optional[Dict]:
+        """Запрашивает информацию о пользователе у API"""
         try:
-            url = Config.TIKTOK_USER_INFO_URL
+            path = Config.TIKTOK_USER_INFO_PATH
             params = {"uniqueId": username}
-            logger.info(f"[TikTokAPI] get_user_info: URL={url}, headers={self.headers}, params={params}")
-            response = requests.get(url, headers=self.headers, params=params)
-            logger.info(f"[TikTokAPI] get_user_info: status={response.status_code}, text={response.text}")
+            response = await self._get(path, params)
             response.raise_for_status()
             
             data = response.json()
             if (data.get('statusCode', data.get('status_code', 1)) == 0 and 'userInfo' in data):
                 return data['userInfo']
             else:
-                logger.error(f"API error for user {username}: {data}")
+                logger.error(f"API error for user {username}: {truncate(data)}")
                 return None
                 
+        except UpstreamError:
+            raise
         except Exception as e:
             logger.error(f"Error getting user info for {username}: {str(e)}")
             return None
     
-    def get_user_followers(self, sec_uid: str, max_count: int = 50, min_cursor: int = 0) -> List[Dict]:
-        """Получает список фолловеров пользователя по secUid"""
+    async def get_user_followers(self, sec_uid: str, max_count: int = 50, min_cursor: int = 0) -> List[Dict]:
+        """Получает одну страницу фолловеров пользователя по secUid"""
+        followers, _ = await self.get_user_followers_page(
+            sec_uid, max_count, min_cursor
+        )
+        return followers
+    
+    async def iter_user_followers(self, sec_uid: str, limit: int = None,
+                                  page_size: int = None, start_cursor: int = 0,
+                                  on_page: Callable[[int, List[Dict]], None] = None
+                                  ) -> AsyncIterator[Dict]:
+        """Постранично обходит фолловеров по курсору и отдает их по мере загрузки.
+        
+        Следующая страница запрашивается, пока потребитель обрабатывает
+        уже полученную. on_page(курсор страницы, фолловеры) вызывается
+        перед выдачей каждой страницы - по нему обход можно продолжить
+        с той же страницы (start_cursor) после перезапуска.
+        """
+        limit = limit or Config.MAX_FOLLOWERS_TOTAL
+        page_size = min(
+            page_size or Config.MAX_FOLLOWERS_PER_SEARCH,
+            Config.MAX_FOLLOWERS_PER_SEARCH
+        )
+        seen = set()
+        cursor = start_cursor
+        
+        page_task = asyncio.ensure_future(
+            self.get_user_followers_page(sec_uid, min(page_size, limit), cursor)
+        )
         try:
-            url = f"https://{Config.RAPIDAPI_HOST}/api/user/followers"
+            while page_task is not None:
+                page_cursor = cursor
+                followers, cursor = await page_task
+                page_task = None
+                
+                new_followers = []
+                for follower in followers:
+                    follower_id = follower.get('user', {}).get('uniqueId')
+                    # Без никнейма фолловер не проверяется и не должен
+                    # занимать место в лимите
+                    if not follower_id or follower_id in seen:
+                        continue
+                    seen.add(follower_id)
+                    new_followers.append(follower)
+                
+                remaining = limit - len(seen)
+                if new_followers and cursor is not None and remaining > 0:
+                    page_task = asyncio.ensure_future(
+                        self.get_user_followers_page(
+                            sec_uid, min(page_size, remaining), cursor
+                        )
+                    )
+                
+                overflow = len(seen) - limit
+                if overflow > 0:
+                    new_followers = new_followers[:-overflow]
+                if on_page is not None:
+                    on_page(page_cursor, new_followers)
+                for follower in new_followers:
+                    yield follower
+        finally:
+            if page_task is not None:
+                page_task.cancel()
+    
+    async def get_user_followers_page(self, sec_uid: str, max_count: int = 50,
+                                      min_cursor: int = 0) -> Tuple[List[Dict], Optional[int]]:
+        """Получает страницу фолловеров и курсор следующей (None, если страниц больше нет)"""
+        try:
+            path = Config.TIKTOK_USER_FOLLOWERS_PATH
             params = {
                 "secUid": sec_uid,
                 "count": min(max_count, Config.MAX_FOLLOWERS_PER_SEARCH),
                 "minCursor": str(min_cursor)
             }
-            logger.info(
-                f"[TikTokAPI] get_user_followers: URL={url}, headers={self.headers}, params={params}"
-            )
-            response = requests.get(url, headers=self.headers, params=params)
-            logger.info(
-                f"[TikTokAPI] get_user_followers: status={response.status_code}, "
-                f"text={response.text}"
-            )
+            response = await self._get(path, params)
             response.raise_for_status()
             data = response.json()
-            print('DEBUG followers API response:', data)
-            logger.info(f'DEBUG followers API response: {data}')
             # В зависимости от структуры ответа API
             if data.get('statusCode', data.get('status_code', 1)) == 0:
+                next_cursor = self._next_followers_cursor(data, min_cursor)
                 if 'userList' in data:
-                    return data['userList']
+                    return data['userList'], next_cursor
                 if 'followers' in data:
-                    return data['followers']
+                    return data['followers'], next_cursor
                 elif data.get('data') and 'followers' in data['data']:
-                    return data['data']['followers']
+                    return data['data']['followers'], next_cursor
                 elif data.get('data') and isinstance(data['data'], list):
-                    return data['data']
+                    return data['data'], next_cursor
                 elif data.get('data') and 'users' in data['data']:
-                    return data['data']['users']
+                    return data['data']['users'], next_cursor
                 else:
                     logger.error(
-                        f"Не удалось найти список фолловеров в ответе: {data}"
+                        f"Не удалось найти список фолловеров в ответе: {truncate(data)}"
                     )
-                    return []
+                    return [], None
             else:
                 logger.error(
-                    f"API error getting followers for secUid {sec_uid}: {data}"
+                    f"API error getting followers for secUid {sec_uid}: {truncate(data)}"
                 )
-                return []
+                return [], None
+        except UpstreamError:
+            raise
         except Exception as e:
             logger.error(
                 f"Error getting followers for secUid {sec_uid}: {str(e)}"
             )
-            return []
+            return [], None
     
-    def get_user_videos(self, username: str, count: int = 10) -> List[Dict]:
-        """Получает список видео пользователя"""
+    @staticmethod
+    def _next_followers_cursor(data: Dict, min_cursor: int) -> Optional[int]:
+        """Извлекает курсор следующей страницы фолловеров из ответа"""
+        containers = [data]
+        if isinstance(data.get('data'), dict):
+            containers.append(data['data'])
+        
+        has_more = None
+        cursor = None
+        for container in containers:
+            for key in ('hasMore', 'has_more'):
+                if key in container:
+                    has_more = container[key]
+            for key in ('minCursor', 'min_cursor'):
+                if container.get(key) is not None:
+                    cursor = container[key]
+        
+        if has_more is not None and not has_more:
+            return None
         try:
-            url = Config.TIKTOK_USER_VIDEOS_URL
+            cursor = int(cursor)
+        except (TypeError, ValueError):
+            return None
+        # Защита от зацикливания, если API вернул тот же курсор
+        return cursor if cursor != min_cursor else None
+    
+    async def get_user_videos(self, username: str, count: int = 10) -> List[Dict]:
+        """Получает список видео пользователя (с учетом кэша)"""
+        return await self._cached_call(
+            'user_videos',
+            {"username": username, "count": count},
+            lambda: self._fetch_user_videos(username, count)
+        )
+    
+    async def _fetch_user_videos(self, username: str, count: int) -> List[Dict]:
+        """Запрашивает список видео пользователя у API"""
+        try:
+            path = Config.TIKTOK_USER_VIDEOS_PATH
             params = {
                 "username": username,
                 "count": count
             }
             
-            response = requests.get(url, headers=self.headers, params=params)
+            response = await self._get(path, params)
             response.raise_for_status()
             
             data = response.json()
@@ -117,6 +419,8 @@ class TikTokAPI:
                 logger.error(f"API error getting videos for {username}: {data.get('message')}")
                 return []
                 
+        except UpstreamError:
+            raise
         except Exception as e:
             logger.error(f"Error getting videos for {username}: {str(e)}")
             return []
@@ -130,6 +434,39 @@ class TikTokAPI:
         match = re.search(email_pattern, bio)
         return match.group(0) if match else None
     
+    @staticmethod
+    def extract_user_stats(user_data: Dict) -> Tuple[Optional[int], Optional[int]]:
+        """Возвращает (фолловеры, видео) из профиля или элемента списка фолловеров.
+        
+        Поддерживает плоскую структуру и вложенную в 'stats'; None - если
+        значение в ответе отсутствует.
+        """
+        containers = [user_data, user_data.get('stats') or {}]
+        
+        def first(key):
+            for container in containers:
+                if container.get(key) is not None:
+                    return int(container[key])
+            return None
+        
+        return first('followerCount'), first('videoCount')
+    
+    def check_cheap_criteria(self, user_data: Dict, max_followers: int = None,
+                             min_videos: int = None) -> bool:
+        """Быстрая проверка без запросов к API: отсеивает тех, кто заведомо
+        не подходит по числу фолловеров или видео. Неизвестные значения
+        проверку проходят."""
+        max_followers = max_followers or Config.DEFAULT_MAX_FOLLOWERS
+        min_videos = min_videos or Config.DEFAULT_MIN_VIDEOS
+        
+        followers_count, video_count = self.extract_user_stats(user_data)
+        if followers_count is not None and followers_count > max_followers:
+            return False
+        # Видео с высокими просмотрами не может быть больше, чем видео всего
+        if video_count is not None and video_count < min_videos:
+            return False
+        return True
+    
     def check_micro_influencer_criteria(self, user_data: Dict, videos: List[Dict], 
                                       max_followers: int = None, 
                                       min_views: int = None, 
@@ -0,0 +1,229 @@
+import asyncio
+import gzip
+import json
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+from urllib.parse import urlencode
+import httpx
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_VERSION = 1
+
+# Из ответа сохраняются только заголовки, влияющие на поведение клиента;
+# заголовки запроса (с ключом RapidAPI) не сохраняются вовсе
+KEPT_HEADERS = ('content-type', 'retry-after')
+RATE_LIMIT_HEADER_PREFIX = 'x-ratelimit'
+
+# Как часто записанное сбрасывается на диск (сек): после падения или
+# kill процесса в архиве остаются обмены до последнего сброса
+FLUSH_INTERVAL = 1.0
+
+
+def exchange_key(request: httpx.Request) -> str:
+    """Ключ запроса в архиве: путь и отсортированные параметры (без хоста)"""
+    params = sorted(request.url.params.multi_items())
+    return f"{request.method} {request.url.path}?{urlencode(params)}"
+
+
+def _kept_headers(headers: httpx.Headers) -> Dict[str, str]:
+    return {
+        name: value for name, value in headers.items()
+        if name in KEPT_HEADERS or name.startswith(RATE_LIMIT_HEADER_PREFIX)
+    }
+
+
+class TrafficRecorder:
+    """Записывает ответы API в архив (JSON Lines, сжатый gzip).
+
+    Первая строка - заголовок архива, далее по строке на обмен:
+    ключ запроса, статус, нужные заголовки, тело и время ответа.
+    Файл создается при первом обмене: процесс, который только создал
+    клиент API, существующую запись не затирает.
+    """
+
+    mode = 'record'
+    fast = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self.recorded_count = 0
+        self._file = None
+        self._flushed_at = time.monotonic()
+
+    def _write(self, entry: Dict):
+        if self._file is None:
+            self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+            self._file.write(json.dumps(
+                {'version': ARCHIVE_VERSION, 'created_at': time.time()}
+            ) + '\n')
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        if time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+            # Z_SYNC_FLUSH: записанное до этого места читается и без
+            # конца gzip-потока (см. TrafficReplayer)
+            self._file.flush()
+            self._flushed_at = time.monotonic()
+
+    def record(self, request: httpx.Request, response: httpx.Response,
+               elapsed: float):
+        self._write({
+            'key': exchange_key(request),
+            'elapsed': round(elapsed, 4),
+            'status': response.status_code,
+            'headers': _kept_headers(response.headers),
+            'body': response.text
+        })
+        self.recorded_count += 1
+
+    def wrap(self, transport: httpx.AsyncBaseTransport) -> httpx.AsyncBaseTransport:
+        return _RecordingTransport(transport, self)
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+            logger.info(
+                f"[Traffic] Записано обменов: {self.recorded_count} в {self.path}"
+            )
+
+
+class _RecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport, recorder: TrafficRecorder):
+        self._inner = inner
+        self._recorder = recorder
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        response = await self._inner.handle_async_request(request)
+        # Тело нужно целиком, чтобы сохранить его до передачи клиенту
+        content = await response.aread()
+        elapsed = time.perf_counter() - started
+        await response.aclose()
+
+        # Тело уже распаковано, поэтому заголовки кодирования не передаем
+        headers = [
+            (name, value) for name, value in response.headers.multi_items()
+            if name not in ('content-encoding', 'transfer-encoding', 'content-length')
+        ]
+        recorded = httpx.Response(
+            response.status_code,
+            headers=headers,
+            content=content,
+            request=request,
+            extensions=response.extensions
+        )
+        self._recorder.record(request, recorded, elapsed)
+        return recorded
+
+    async def aclose(self):
+        await self._inner.aclose()
+
+
+class TrafficReplayer:
+    """Отдает ответы из архива вместо обращения к сети.
+
+    Повторные запросы с одним ключом получают записанные ответы по порядку
+    (так воспроизводятся 429 и повторы), после исчерпания - последний ответ.
+    timing='original' выдерживает записанное время ответа,
+    timing='fast' отдает ответы сразу и убирает заголовки лимитов,
+    чтобы клиент не делал пауз.
+    """
+
+    mode = 'replay'
+
+    def __init__(self, path: str, timing: str = 'original'):
+        if timing not in ('original', 'fast'):
+            raise ValueError(f"Неизвестный режим воспроизведения: {timing}")
+        self.path = path
+        self.timing = timing
+        self.replayed_count = 0
+        self.missed_count = 0
+        self._exchanges: Dict[str, Deque[Dict]] = {}
+        self._last: Dict[str, Dict] = {}
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != ARCHIVE_VERSION:
+                raise ValueError(
+                    f"Неподдерживаемая версия архива: {header.get('version')}"
+                )
+            try:
+                for line in f:
+                    entry = json.loads(line)
+                    self._exchanges.setdefault(entry['key'], deque()).append(entry)
+            except (EOFError, json.JSONDecodeError):
+                # Запись прервалась (процесс упал): берем сброшенное до этого
+                logger.warning(f"[Traffic] Архив {path} обрезан, читаем до обрыва")
+        logger.info(
+            f"[Traffic] Загружено запросов из {path}: "
+            f"{sum(len(q) for q in self._exchanges.values())}"
+        )
+
+    @property
+    def fast(self) -> bool:
+        return self.timing == 'fast'
+
+    def next_exchange(self, key: str) -> Optional[Dict]:
+        queue = self._exchanges.get(key)
+        if queue:
+            self._last[key] = queue.popleft()
+        return self._last.get(key)
+
+    async def respond(self, request: httpx.Request) -> httpx.Response:
+        key = exchange_key(request)
+        entry = self.next_exchange(key)
+        if entry is None:
+            self.missed_count += 1
+            logger.warning(f"[Traffic] Нет записанного ответа для {key}")
+            return httpx.Response(
+                404, json={'message': 'not recorded'}, request=request
+            )
+
+        self.replayed_count += 1
+        headers = entry['headers']
+        if self.fast:
+            headers = {
+                name: value for name, value in headers.items()
+                if name == 'content-type'
+            }
+        else:
+            await asyncio.sleep(entry['elapsed'])
+        return httpx.Response(
+            entry['status'],
+            headers=headers,
+            content=entry['body'].encode('utf-8'),
+            request=request
+        )
+
+    def wrap(self, transport: httpx.AsyncBaseTransport) -> httpx.AsyncBaseTransport:
+        # Сеть при воспроизведении не нужна
+        return _ReplayTransport(self)
+
+    def close(self):
+        if self.missed_count:
+            logger.warning(
+                f"[Traffic] Запросов без записи в архиве: {self.missed_count}"
+            )
+
+
+class _ReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, replayer: TrafficReplayer):
+        self._replayer = replayer
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._replayer.respond(request)
+
+
+def open_traffic_archive(mode: str = None, path: str = None, timing: str = None):
+    """Создает запись или воспроизведение по настройкам (TRAFFIC_MODE)"""
+    mode = Config.TRAFFIC_MODE if mode is None else mode
+    path = path or Config.TRAFFIC_ARCHIVE
+    if not mode:
+        return None
+    if mode == 'record':
+        return TrafficRecorder(path)
+    if mode == 'replay':
+        return TrafficReplayer(path, timing or Config.TRAFFIC_REPLAY_TIMING)
+    raise ValueError(f"Неизвестный TRAFFIC_MODE: {mode}")
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Прием апдейтов Telegram через вебхук.
+
+Локальный HTTP-слушатель (WEBHOOK_LISTEN:WEBHOOK_PORT, путь WEBHOOK_PATH)
+принимает апдейты и кладет их в очередь Application. TLS для Telegram
+завершает обратный прокси (nginx, caddy), публичный адрес которого
+задается в WEBHOOK_URL.
+
+Записанные апдейты (UPDATE_RECORD_PATH, по одному JSON в строке) можно
+отправить в локальный слушатель этим же скриптом:
+    python webhook.py updates.jsonl --url http://127.0.0.1:8443/telegram
+    python webhook.py updates.jsonl --connections 20 --repeat 10 --secret s3cret
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+import httpx
+from telegram import Update
+from telegram.ext import Application
+from config import Config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+# Апдейт Telegram не бывает больше нескольких килобайт
+MAX_BODY_SIZE = 1024 * 1024
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden',
+                404: 'Not Found', 413: 'Payload Too Large',
+                503: 'Service Unavailable'}
+
+
+class UpdateQueue(asyncio.Queue):
+    """Очередь апдейтов Application, ограниченная числом необработанных.
+
+    С concurrent_updates PTB сразу забирает апдейты из очереди в задачи,
+    поэтому обычный maxsize ничего не ограничивает. Здесь место
+    освобождается только после обработки апдейта (task_done): вебхук
+    на переполнение отвечает 503 (Telegram повторит доставку позже),
+    а polling ждет свободного места.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        # Сама очередь не ограничена: предел считается по апдейтам
+        # в очереди и в обработке
+        super().__init__()
+        self.limit = maxsize
+        self._pending = 0
+        self._space = asyncio.Event()
+
+    def full(self) -> bool:
+        return 0 < self.limit <= self._pending
+
+    def put_nowait(self, item):
+        if self.full():
+            raise asyncio.QueueFull
+        super().put_nowait(item)
+        self._pending += 1
+
+    async def put(self, item):
+        while self.full():
+            self._space.clear()
+            await self._space.wait()
+        self.put_nowait(item)
+
+    def task_done(self):
+        super().task_done()
+        self._pending -= 1
+        self._space.set()
+
+    @property
+    def pending(self) -> int:
+        """Апдейты в очереди и в обработке"""
+        return self._pending
+
+
+class WebhookServer:
+    """HTTP-слушатель вебхука Telegram (HTTP/1.1 с keep-alive)"""
+
+    def __init__(self, app: Application, host: str = None, port: int = None,
+                 path: str = None, secret: str = None, reuse_port: bool = None,
+                 idle_timeout: float = None):
+        self.app = app
+        self.host = host or Config.WEBHOOK_LISTEN
+        self.port = Config.WEBHOOK_PORT if port is None else port
+        self.path = path or Config.WEBHOOK_PATH
+        self.secret = Config.WEBHOOK_SECRET if secret is None else secret
+        # Несколько процессов бота слушают один порт (см. bot.run_processes)
+        self.reuse_port = (
+            Config.BOT_PROCESSES > 1 if reuse_port is None else reuse_port
+        )
+        # Простаивающие и слишком медленные соединения закрываются
+        self.idle_timeout = idle_timeout or Config.WEBHOOK_IDLE_TIMEOUT
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle, self.host, self.port, reuse_port=self.reuse_port or None
+        )
+        logger.info(f"Вебхук слушает http://{self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter):
+        try:
+            # Telegram держит соединения открытыми и шлет по ним апдейты подряд
+            while True:
+                try:
+                    request = await asyncio.wait_for(
+                        self._read_request(reader), self.idle_timeout
+                    )
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    break
+                parts, headers, body = request
+                if body is None:
+                    await self._respond(writer, 413, keep_alive=False)
+                    break
+
+                status = self._accept(parts, headers, body)
+                metrics.inc('telegram_webhook_requests_total', status=status)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.debug(f"Ошибка соединения вебхука: {e}")
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader
+                            ) -> Optional[Tuple[List[str], Dict[str, str], Optional[bytes]]]:
+        """Читает запрос: (строка запроса, заголовки, тело).
+        None - клиент закрыл соединение; тело None - тело больше MAX_BODY_SIZE.
+        """
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        parts = request_line.decode('latin-1').split()
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY_SIZE:
+            return parts, headers, None
+        body = await reader.readexactly(length) if length else b''
+        return parts, headers, body
+
+    def _accept(self, parts: List[str], headers: Dict[str, str], body: bytes) -> int:
+        """Проверяет запрос и ставит апдейт в очередь; возвращает HTTP-статус"""
+        if len(parts) < 2 or parts[0] != 'POST' or urlsplit(parts[1]).path != self.path:
+            return 404
+        if self.secret and headers.get(SECRET_HEADER) != self.secret:
+            return 403
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+        except Exception as e:
+            logger.debug(f"Некорректный апдейт во входящем запросе: {e}")
+            return 400
+        if update is None:
+            return 400
+        try:
+            self.app.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning(
+                f"[Webhook] Очередь апдейтов заполнена ({Config.UPDATE_QUEUE_SIZE}), "
+                f"апдейт {update.update_id} отклонен"
+            )
+            return 503
+        return 200
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int,
+                       keep_alive: bool = True):
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            "Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+            .encode('latin-1')
+        )
+        await writer.drain()
+
+
+async def serve_webhook(app: Application, register: bool = True):
+    """Запускает бота в режиме вебхука до SIGINT/SIGTERM.
+
+    Повторяет жизненный цикл Application.run_polling (post_init,
+    post_shutdown), но апдейты приходят в WebhookServer. Если задан
+    WEBHOOK_URL (и register), адрес регистрируется в Telegram; без него
+    апдейты принимаются только локально (например, из записи).
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows: останавливается по KeyboardInterrupt
+
+    server = WebhookServer(app)
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        await server.start()
+        if Config.WEBHOOK_URL and register:
+            await app.bot.set_webhook(
+                Config.WEBHOOK_URL,
+                secret_token=Config.WEBHOOK_SECRET or None,
+                max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info(f"Вебхук зарегистрирован: {Config.WEBHOOK_URL}")
+        elif not Config.WEBHOOK_URL:
+            logger.warning(
+                "WEBHOOK_URL не задан: вебхук не зарегистрирован в Telegram, "
+                "апдейты принимаются только локально"
+            )
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def load_updates(path: str) -> List[Dict]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def refresh_update(update: Dict, update_id: int) -> Dict:
+    """Копия записанного апдейта с новым update_id и текущей датой сообщений
+    (по дате считается задержка доставки telegram_update_delay_seconds)"""
+    update = json.loads(json.dumps(update))
+    update['update_id'] = update_id
+    now = int(time.time())
+    for message in (update.get('message'), update.get('edited_message'),
+                    update.get('channel_post')):
+        if message:
+            message['date'] = now
+    return update
+
+
+async def post_updates(updates: List[Dict], url: str, secret: str = '',
+                       connections: int = 10, repeat: int = 1,
+                       keep_dates: bool = False) -> Dict:
+    """Отправляет записанные апдейты в вебхук и измеряет время приема"""
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+    limits = httpx.Limits(max_connections=connections,
+                          max_keepalive_connections=connections)
+    semaphore = asyncio.Semaphore(connections)
+    base_id = int(time.time() * 1000)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async def send(client: httpx.AsyncClient, index: int, update: Dict):
+        if not keep_dates:
+            update = refresh_update(update, base_id + index)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, json=update, headers=headers)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        await asyncio.gather(*(
+            send(client, index, update)
+            for index, update in enumerate(updates * repeat)
+        ))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'sent': len(latencies),
+        'statuses': statuses,
+        'elapsed': elapsed,
+        'updates_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': latencies[len(latencies) // 2] if latencies else 0.0,
+        'p95': latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+        'max': latencies[-1] if latencies else 0.0
+    }
+
+
+def format_report(result: Dict) -> str:
+    statuses = ', '.join(
+        f"{status}: {count}" for status, count in sorted(result['statuses'].items())
+    )
+    return (
+        f"Отправлено апдейтов: {result['sent']} за {result['elapsed']:.2f} с "
+        f"({result['updates_per_second']:.1f} апд/с)\n"
+        f"Ответы: {statuses}\n"
+        f"Время приема: p50 {result['p50'] * 1000:.1f} мс, "
+        f"p95 {result['p95'] * 1000:.1f} мс, max {result['max'] * 1000:.1f} мс"
+    )
+
+
+def main(argv: List[str] = None):
+    default_url = (
+        f"http://{Config.WEBHOOK_LISTEN}:{Config.WEBHOOK_PORT}{Config.WEBHOOK_PATH}"
+    )
+    parser = argparse.ArgumentParser(
+        description="Отправка записанных апдейтов Telegram в локальный вебхук"
+    )
+    parser.add_argument('updates', help="файл JSONL с апдейтами (UPDATE_RECORD_PATH)")
+    parser.add_argument('--url', default=default_url, help="адрес вебхука")
+    parser.add_argument('--secret', default=Config.WEBHOOK_SECRET,
+                        help="секрет вебхука (WEBHOOK_SECRET)")
+    parser.add_argument('--connections', type=int, default=10,
+                        help="одновременных соединений")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="сколько раз отправить запись")
+    parser.add_argument('--keep-dates', action='store_true',
+                        help="не менять update_id и даты сообщений")
+    args = parser.parse_args(argv)
+
+    updates = load_updates(args.updates)
+    result = asyncio.run(post_updates(
+        updates, args.url, args.secret, args.connections, args.repeat,
+        args.keep_dates
+    ))
+    print(format_report(result))
+
+
+if __name__ == '__main__':
+    main()